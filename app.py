@@ -1,21 +1,50 @@
-from flask import Flask, request, jsonify, render_template_string, send_from_directory
+from flask import Flask, request, jsonify, render_template_string, send_from_directory, Response
 import os
 import uuid
+import functools
+import hashlib
+import zipfile
+from werkzeug.formparser import parse_form_data
 from werkzeug.utils import secure_filename
 from loguru import logger
-import time
 from apscheduler.schedulers.background import BackgroundScheduler
 from config import Config
 from services.transcription import transcription_service
 from services.feishu import feishu_service
 from services.media import media_service
 from services.monitor import system_monitor
+from services.jobs import job_queue
+from services.admission import admission_controller, AdmissionRejected
+from services.cache import transcript_cache
+from services.ingest import streaming_ingest, IngestError
+from services.signing import url_signer
+from services.subtitles import SubtitleTrack
+from services.transcripts import transcript_store
+from services.batch import batch_processor, BatchItem
+from services.uploads import chunked_uploads, UploadSessionError
+from services.probe import probe_audio, ProbeError
+from services.cost_model import cost_model
+from services.storage import upload_store, StorageFull
+from services.lifecycle import lifecycle
+from services.http_client import http_client
+from services.retry import RetryPolicy, retry_budget
+from services.leases import hosted_leases
+from services.metrics import metrics, stage_latency, stage_errors
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = Config.MAX_CONTENT_LENGTH
+app.config['USE_X_SENDFILE'] = Config.USE_X_SENDFILE
 
-# 确保上传目录存在
-os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
+# 预先绑定各阶段的指标，记录时不再查找标签
+RECEIVE_LATENCY = stage_latency.labels('receive')
+RECEIVE_ERRORS = stage_errors.labels('receive')
+CACHE_LATENCY = stage_latency.labels('cache_lookup')
+TRANSCRIBE_LATENCY = stage_latency.labels('transcription')
+TRANSCRIBE_ERRORS = stage_errors.labels('transcription')
+DELIVERY_LATENCY = stage_latency.labels('delivery')
+DELIVERY_ERRORS = stage_errors.labels('delivery')
+PIPELINE_LATENCY = stage_latency.labels('pipeline')
+PIPELINE_ERRORS = stage_errors.labels('pipeline')
 
 # HTML 模板
 HTML_TEMPLATE = '''
@@ -77,6 +106,16 @@ HTML_TEMPLATE = '''
             box-shadow: 0 2px 4px rgba(0,0,0,0.1);
             white-space: pre-wrap;
         }
+        #transcript {
+            display: none;
+            margin-top: 20px;
+            padding: 20px;
+            border-radius: 8px;
+            background: white;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+            white-space: pre-wrap;
+        }
+        #transcript.active { display: block; }
         .success { color: #4CAF50; }
         .error { color: #f44336; }
         .loading {
@@ -105,46 +144,242 @@ HTML_TEMPLATE = '''
     </div>
     <div id="loading" class="loading">处理中...</div>
     <div id="result"></div>
+    <div id="transcript"></div>
 
     <script>
+        const PARALLEL_CHUNKS = {{ parallel_chunks }};
+        const sleep = function(ms) { return new Promise(function(resolve) { setTimeout(resolve, ms); }); };
+
+        // 非 HTTPS 页面没有 crypto.subtle，退回到 CRC32 校验
+        const crcTable = Array.from({length: 256}, function(_, n) {
+            for (let k = 0; k < 8; k++) n = n & 1 ? 0xEDB88320 ^ (n >>> 1) : n >>> 1;
+            return n >>> 0;
+        });
+        const crc32 = function(bytes) {
+            let crc = 0xFFFFFFFF;
+            for (let i = 0; i < bytes.length; i++) crc = crcTable[(crc ^ bytes[i]) & 0xFF] ^ (crc >>> 8);
+            return ((crc ^ 0xFFFFFFFF) >>> 0).toString(16).padStart(8, '0');
+        };
+        const checksum = async function(buffer) {
+            if (window.crypto && crypto.subtle) {
+                const hash = new Uint8Array(await crypto.subtle.digest('SHA-256', buffer));
+                return 'sha256=' + Array.from(hash, function(b) { return b.toString(16).padStart(2, '0'); }).join('');
+            }
+            return 'crc32=' + crc32(new Uint8Array(buffer));
+        };
+
+        // 分块并行上传；网络中断时自动重试，刷新页面后重新选择同一文件只上传缺失的分块
+        const uploadChunked = async function(file, onProgress) {
+            const key = 'upload:' + file.name + ':' + file.size + ':' + file.lastModified;
+            let upload = null;
+            const saved = localStorage.getItem(key);
+            if (saved) {
+                const response = await fetch('/uploads/' + saved);
+                if (response.ok) {
+                    upload = await response.json();
+                } else {
+                    localStorage.removeItem(key);
+                }
+            }
+            if (!upload) {
+                const response = await fetch('/uploads', {
+                    method: 'POST',
+                    headers: {'Content-Type': 'application/json'},
+                    body: JSON.stringify({filename: file.name, size: file.size})
+                });
+                upload = await response.json();
+                if (!upload.success) return upload;
+                upload.missing = Array.from({length: upload.chunks}, function(_, i) { return i; });
+                localStorage.setItem(key, upload.upload_id);
+            }
+
+            const sendChunk = async function(index) {
+                const start = index * upload.chunk_size;
+                const buffer = await file.slice(start, start + upload.chunk_size).arrayBuffer();
+                const sum = await checksum(buffer);
+                for (let attempt = 0; ; attempt++) {
+                    if (!navigator.onLine) {
+                        await new Promise(function(resolve) {
+                            window.addEventListener('online', resolve, {once: true});
+                        });
+                    }
+                    let response = null;
+                    try {
+                        response = await fetch('/uploads/' + upload.upload_id + '/chunks/' + index, {
+                            method: 'PUT',
+                            headers: {'X-Chunk-Checksum': sum},
+                            body: buffer
+                        });
+                    } catch (error) {
+                        // 网络错误，退避后重试
+                    }
+                    if (response && response.ok) return;
+                    // 4xx 中只有校验失败（传输中损坏）值得重试
+                    if (response && response.status < 500 && response.status !== 422) {
+                        const result = await response.json().catch(function() { return {}; });
+                        if (response.status === 404) localStorage.removeItem(key);
+                        throw new Error(result.error || '上传失败');
+                    }
+                    if (attempt >= 8) throw new Error('网络不稳定，请稍后重新选择该文件继续上传');
+                    await sleep(Math.min(30000, 1000 * Math.pow(2, attempt)));
+                }
+            };
+
+            const queue = upload.missing.slice();
+            let done = upload.chunks - queue.length;
+            onProgress(done, upload.chunks);
+            const worker = async function() {
+                while (queue.length) {
+                    const index = queue.shift();
+                    try {
+                        await sendChunk(index);
+                    } catch (error) {
+                        queue.length = 0;
+                        throw error;
+                    }
+                    onProgress(++done, upload.chunks);
+                }
+            };
+            await Promise.all(Array.from({length: Math.min(PARALLEL_CHUNKS, queue.length)}, worker));
+
+            const response = await fetch('/uploads/' + upload.upload_id + '/complete', {method: 'POST'});
+            // 503 为暂时拒绝，分块仍保留在服务端，稍后可直接完成
+            if (response.status !== 503) localStorage.removeItem(key);
+            return await response.json();
+        };
+
         document.getElementById('uploadForm').onsubmit = async function(e) {
             e.preventDefault();
             
-            const formData = new FormData(this);
+            const file = new FormData(this).get('audio');
             const submitButton = this.querySelector('input[type="submit"]');
             const loadingDiv = document.getElementById('loading');
             const resultDiv = document.getElementById('result');
+            const transcriptDiv = document.getElementById('transcript');
+            
+            // 字幕行按到达顺序追加；from 小于已显示的行数时（服务端重试）先删掉多余的行
+            const renderLines = function(from, lines) {
+                while (transcriptDiv.childNodes.length > from) {
+                    transcriptDiv.removeChild(transcriptDiv.lastChild);
+                }
+                const fragment = document.createDocumentFragment();
+                lines.forEach(function(line) {
+                    const div = document.createElement('div');
+                    div.textContent = line;
+                    fragment.appendChild(div);
+                });
+                transcriptDiv.appendChild(fragment);
+                transcriptDiv.className = transcriptDiv.childNodes.length ? 'active' : '';
+            };
+            renderLines(0, []);
             
-            if (!formData.get('audio').size) {
+            if (!file || !file.size) {
                 resultDiv.innerHTML = '请选择文件';
                 resultDiv.className = 'error';
                 return;
             }
             
+            const stageLabels = {
+                queued: '排队中...',
+                saved: '文件已保存，等待上传...',
+                hosted: '文件已上传，等待转录...',
+                transcribing: '转录中...',
+                delivered: '已发送到飞书'
+            };
+
+            // 服务端按耗时模型给出的预计完成时间
+            let expectedAt = null;
+            const showStage = function(stage) {
+                let text = stageLabels[stage] || '处理中，请稍候...';
+                if (expectedAt) {
+                    const remaining = Math.round((expectedAt - Date.now()) / 1000);
+                    text += remaining > 0 ? '（预计还需约 ' + remaining + ' 秒）' : '（比预计稍慢，请耐心等待）';
+                }
+                resultDiv.innerHTML = text;
+            };
+
+            const finish = function(job) {
+                if (job.status === 'done') {
+                    const lines = (job.result && job.result.lines) || 0;
+                    resultDiv.innerHTML = lines ? '转录完成，共 ' + lines + ' 行，已发送到飞书' : '处理完成，但没有识别到文本';
+                    resultDiv.className = 'success';
+                    // 没有收到实时推送（轮询或任务在其他 worker 上）时一次性取回全文
+                    if (lines && transcriptDiv.childNodes.length < lines) {
+                        fetch(job.result.transcript_url).then(function(response) {
+                            return response.ok ? response.text() : '';
+                        }).then(function(text) {
+                            if (text) {
+                                renderLines(0, text.split('\\n'));
+                            }
+                        });
+                    }
+                } else {
+                    resultDiv.innerHTML = '错误: ' + (job.error || '未知错误');
+                    resultDiv.className = 'error';
+                }
+                submitButton.disabled = false;
+                loadingDiv.className = 'loading';
+            };
+
+            // SSE 不可用时退回到轮询任务状态
+            const poll = async function(statusUrl) {
+                try {
+                    const job = await (await fetch(statusUrl)).json();
+                    if (job.status === 'done' || job.status === 'failed') {
+                        finish(job);
+                    } else {
+                        showStage(job.stage);
+                        setTimeout(function() { poll(statusUrl); }, 2000);
+                    }
+                } catch (error) {
+                    setTimeout(function() { poll(statusUrl); }, 5000);
+                }
+            };
+
             try {
                 submitButton.disabled = true;
                 loadingDiv.className = 'loading active';
-                resultDiv.innerHTML = '处理中，请稍候...';
+                resultDiv.innerHTML = '上传中，请稍候...';
                 resultDiv.className = '';
                 
-                const response = await fetch('/upload', {
-                    method: 'POST',
-                    body: formData
+                const result = await uploadChunked(file, function(done, total) {
+                    resultDiv.innerHTML = '上传中 ' + Math.floor(done * 100 / total) + '%...';
                 });
                 
-                const result = await response.json();
-                
-                if (result.success) {
-                    resultDiv.innerHTML = result.text || '处理完成，但没有识别到文本';
-                    resultDiv.className = 'success';
-                } else {
+                if (!result.success) {
                     resultDiv.innerHTML = '错误: ' + (result.error || '未知错误');
                     resultDiv.className = 'error';
+                    submitButton.disabled = false;
+                    loadingDiv.className = 'loading';
+                    return;
                 }
+
+                if (result.eta && result.eta.total !== null) {
+                    expectedAt = Date.now() + result.eta.total * 1000;
+                }
+                showStage('queued');
+                const source = new EventSource(result.events_url);
+                source.addEventListener('stage', function(e) {
+                    const data = JSON.parse(e.data);
+                    showStage(data.stage);
+                });
+                source.addEventListener('lines', function(e) {
+                    const data = JSON.parse(e.data);
+                    renderLines(data.from, data.lines);
+                });
+                ['done', 'failed'].forEach(function(name) {
+                    source.addEventListener(name, function(e) {
+                        source.close();
+                        finish(JSON.parse(e.data));
+                    });
+                });
+                source.onerror = function() {
+                    source.close();
+                    poll(result.status_url);
+                };
             } catch (error) {
                 resultDiv.innerHTML = '上传失败: ' + error.message;
                 resultDiv.className = 'error';
-            } finally {
                 submitButton.disabled = false;
                 loadingDiv.className = 'loading';
             }
@@ -158,125 +393,577 @@ def allowed_file(filename):
     """检查文件类型是否允许"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS
 
-def cleanup_old_files():
-    """清理超过1小时的临时文件"""
-    current_time = time.time()
-    for filename in os.listdir(Config.UPLOAD_FOLDER):
-        file_path = os.path.join(Config.UPLOAD_FOLDER, filename)
-        if os.path.isfile(file_path):
-            file_age = current_time - os.path.getctime(file_path)
-            if file_age > Config.CLEANUP_INTERVAL:
-                try:
-                    os.remove(file_path)
-                    logger.info(f"已清理临时文件: {filename}")
-                except Exception as e:
-                    logger.error(f"清理文件失败 {filename}: {str(e)}")
+def client_id():
+    """用于排队公平性的客户端标识"""
+    forwarded = request.headers.get('X-Forwarded-For', '')
+    return forwarded.split(',')[0].strip() or request.remote_addr or 'anonymous'
+
+def rejected_response(e):
+    """准入拒绝时返回 503 和 Retry-After"""
+    response = jsonify({'success': False, 'error': str(e), 'retry_after': e.retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+def save_upload(stream, filepath, chunk_size=64 * 1024):
+    """分块写入上传文件，同时计算 SHA-256"""
+    digest = hashlib.sha256()
+    with open(filepath, 'wb') as f:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+def stop_passthrough(hosted, abort_hosted):
+    """放弃直通上传：还没开始时取消 Future，已在上传时中止数据管道"""
+    if hosted is None or hosted.cancel() or hosted.done():
+        return
+    abort_hosted()
+    logger.info("已中止直通上传")
+
+def reject_unreadable(filepath):
+    """只解析文件头，损坏、不完整或内容与扩展名不符的文件在托管前删除，返回拒绝原因"""
+    try:
+        probe_audio(filepath)
+    except ProbeError as e:
+        upload_store.remove(filepath)
+        logger.error(f"文件校验失败 {filepath}: {str(e)}")
+        return str(e)
+    return None
+
+def expected_queue_wait(jobs):
+    """新任务预计的排队时间（秒），有空闲执行线程时为 0"""
+    if jobs['running'] + jobs['queued'] < jobs['max_workers']:
+        return 0.0
+    return admission_controller.expected_wait(jobs['queued'])
+
+def estimate_eta(filepath, sha256):
+    """按耗时模型预估各阶段耗时（秒），在提交任务之前调用"""
+    queue = expected_queue_wait(job_queue.get_stats())
+    if transcript_cache.contains(sha256):
+        stages = {'hosting': 0.0, 'transcription': 0.0}
+    else:
+        try:
+            audio_seconds = probe_audio(filepath)['duration']
+        except ProbeError:
+            audio_seconds = None
+        stages = transcription_service.estimate(filepath, audio_seconds)
+    stages['queue'] = queue
+    stages['delivery'] = cost_model.expected('feishu', feishu_service.get_stats()['pending'] + 1)
+    eta = {stage: round(seconds, 1) for stage, seconds in stages.items() if seconds is not None}
+    # 时长未知时无法预估转录耗时，不给出总时长
+    eta['total'] = round(sum(eta.values()), 1) if stages['transcription'] is not None else None
+    return eta
+
+def storage_full_response(e):
+    """淘汰未使用的文件后空间仍不足时返回 507，而不是在写入途中失败"""
+    logger.warning(f"拒绝新的请求: {str(e)}")
+    return jsonify({'success': False, 'error': str(e)}), 507
 
 @app.route('/')
 def index():
     """渲染主页"""
-    return render_template_string(HTML_TEMPLATE)
+    return render_template_string(HTML_TEMPLATE, parallel_chunks=Config.UPLOAD_PARALLEL_CHUNKS)
 
 @app.route('/status')
 def get_status():
     """获取系统状态"""
     stats = system_monitor.get_stats()
+    stats['jobs'] = job_queue.get_stats()
+    stats['jobs']['expected_wait'] = round(expected_queue_wait(stats['jobs']), 1)
+    stats['admission'] = admission_controller.get_stats()
+    stats['cache'] = transcript_cache.get_stats()
+    stats['hosts'] = transcription_service.host_selector.get_stats()
+    stats['feishu'] = feishu_service.get_stats()
+    stats['transcripts'] = transcript_store.get_stats()
+    stats['http'] = http_client.get_stats()
+    stats['retry_budget'] = retry_budget.get_stats()
+    stats['leases'] = hosted_leases.get_stats()
+    stats['cost_model'] = cost_model.get_stats()
+    stats['storage'] = upload_store.get_stats()
+    stats['lifecycle'] = lifecycle.get_stats()
     return jsonify(stats)
 
+@app.route('/status/history')
+def get_status_history():
+    """获取资源使用历史，window 为时间窗口（秒），resolution 为汇总粒度（秒，可选）"""
+    try:
+        window = int(request.args.get('window', 3600))
+        resolution = request.args.get('resolution')
+        resolution = int(resolution) if resolution else None
+    except ValueError:
+        return jsonify({'success': False, 'error': '参数格式错误'}), 400
+    if window <= 0 or (resolution is not None and resolution <= 0):
+        return jsonify({'success': False, 'error': '参数格式错误'}), 400
+    return jsonify(system_monitor.get_history(window, resolution))
+
+def process_upload(job, filepath, sha256, hosted=None):
+    """后台执行转录流水线：查缓存 -> 托管 -> 转录 -> 发送飞书
+
+    hosted 为直通上传或批量预托管的 Future，结果为 (服务名, URL) 或 None
+    """
+    system_monitor.increment_processing_count()
+    progress = functools.partial(job_queue.update, job.id)
+    # 解析出的字幕行实时推送到页面，不等整段转录完成
+    live = job_queue.attach_transcript(job.id)
+    # 托管和转录的所有尝试共用一个截止时间，超时后不再重试
+    policy = RetryPolicy(Config.REQUEST_DEADLINE)
+    try:
+        with PIPELINE_LATENCY.time(PIPELINE_ERRORS):
+            # 获取文件元数据
+            metadata = transcription_service.get_file_metadata(filepath)
+            progress('saved', **metadata)
+            
+            # 相同内容的音频直接复用缓存，跳过托管和转录
+            with CACHE_LATENCY.time():
+                result = transcript_cache.get(sha256)
+            if result:
+                progress('transcribing', cached=True)
+                live.extend(result['track'])
+            else:
+                with TRANSCRIBE_LATENCY.time(TRANSCRIBE_ERRORS):
+                    prehosted = hosted.result() if hosted is not None else None
+                    
+                    # 调用转录服务，长音频分段并行转录
+                    if prehosted:
+                        host, file_url = prehosted
+                        progress('hosted', host=host, url=file_url, prehosted=True)
+                        result = transcription_service.transcribe(filepath, on_progress=progress,
+                                                                  file_url=file_url, live=live, policy=policy,
+                                                                  digest=sha256)
+                    else:
+                        result = transcription_service.transcribe_segmented(filepath, on_progress=progress,
+                                                                            live=live, policy=policy,
+                                                                            digest=sha256)
+                    if not result:
+                        raise Exception("转录失败")
+                transcript_cache.put(sha256, result)
+                
+            # 文件头无法解析时，以最后一条字幕的结束时间作为时长
+            metadata.setdefault('duration', result['duration'])
+            
+            # 写入转录历史（后台线程完成），缓存命中的重复上传同样记录
+            transcript_store.add(job.id, job.filename, sha256, metadata, result['track'])
+            
+            # 放入飞书发送队列，不在任务线程中等待限速；格式化文本逐块生成并直接切分
+            with DELIVERY_LATENCY.time(DELIVERY_ERRORS):
+                parts = feishu_service.enqueue(feishu_service.format_transcript(result['track'], metadata))
+            progress('delivered', queued=parts)
+        
+        # 字幕文本已通过 SSE 推送，结果中只给出行数和导出地址，不再保存整段文本
+        return {
+            'lines': len(result['track']),
+            'transcript_url': f'/jobs/{job.id}/subtitles.txt',
+            'metadata': metadata,
+            'sha256': sha256  # 用于从缓存导出字幕文件
+        }
+
+    finally:
+        # 清理文件
+        if upload_store.remove(filepath):
+            logger.info(f"临时文件已删除: {filepath}")
+        system_monitor.decrement_processing_count()
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    """处理文件上传和转录"""
+    """接收文件上传并提交后台转录任务"""
     try:
         logger.info("开始处理上传请求")
-        system_monitor.increment_processing_count()
         
-        # 检查系统资源
+        # 准入预检：在读取请求体之前拒绝，避免浪费带宽
+        client = client_id()
         stats = system_monitor.get_stats()
-        if stats['cpu_percent'] > 80 or stats['memory_percent'] > 80:
-            logger.warning("系统资源使用率过高，拒绝新的请求")
-            return jsonify({
-                'success': False, 
-                'error': '系统负载过高，请稍后重试',
-                'stats': stats
-            }), 503
-        
-        # 验证文件
-        if 'audio' not in request.files:
-            logger.error("没有文件在请求中")
-            return jsonify({'success': False, 'error': '没有文件'}), 400
+        try:
+            job_queue.check_admission(client, stats)
+        except AdmissionRejected as e:
+            logger.warning(f"拒绝新的请求: {str(e)}")
+            return rejected_response(e)
+        try:
+            upload_store.make_room(min(request.content_length or Config.MAX_CONTENT_LENGTH,
+                                       Config.MAX_CONTENT_LENGTH))
+        except StorageFull as e:
+            return storage_full_response(e)
         
-        file = request.files['audio']
-        if not file or not allowed_file(file.filename):
-            logger.error("文件无效或格式不支持")
-            return jsonify({'success': False, 'error': '文件无效或格式不支持'}), 400
-
-        # 保存文件
-        filename = f"{uuid.uuid4()}{os.path.splitext(file.filename)[1]}"
-        filepath = os.path.join(Config.UPLOAD_FOLDER, filename)
-        file.save(filepath)
-        logger.info(f"文件已保存: {filepath}")
+        if Config.STREAMING_INGEST and request.mimetype == 'multipart/form-data':
+            # 流式解析请求体，只落盘一次
+            boundary = request.mimetype_params.get('boundary')
+            if not boundary:
+                return jsonify({'success': False, 'error': '请求格式错误'}), 400
+            if request.content_length and request.content_length > Config.MAX_CONTENT_LENGTH:
+                return jsonify({'success': False, 'error': '文件过大'}), 413
+            passthrough = None
+            if Config.STREAMING_PASSTHROUGH:
+                passthrough = transcription_service.upload_stream
+            try:
+                with RECEIVE_LATENCY.time(RECEIVE_ERRORS):
+                    upload = streaming_ingest.ingest(request.stream, boundary.encode(), 'audio', passthrough)
+            except IngestError as e:
+                logger.error(f"文件接收失败: {str(e)}")
+                return jsonify({'success': False, 'error': str(e)}), 400
+            original_filename = upload['original_filename']
+            filepath = upload['filepath']
+            sha256 = upload['sha256']
+            hosted = upload.get('hosted')
+            abort_hosted = upload.get('abort_hosted')
+        else:
+            # 验证文件
+            if 'audio' not in request.files:
+                logger.error("没有文件在请求中")
+                return jsonify({'success': False, 'error': '没有文件'}), 400
+            
+            file = request.files['audio']
+            if not file or not allowed_file(file.filename):
+                logger.error("文件无效或格式不支持")
+                return jsonify({'success': False, 'error': '文件无效或格式不支持'}), 400
+
+            # 保存文件
+            original_filename = file.filename
+            filename = f"{uuid.uuid4()}{os.path.splitext(file.filename)[1]}"
+            filepath = os.path.join(Config.UPLOAD_FOLDER, filename)
+            with RECEIVE_LATENCY.time(RECEIVE_ERRORS):
+                sha256 = save_upload(file.stream, filepath)
+            hosted = abort_hosted = None
+        upload_store.add(filepath)
+        logger.info(f"文件已保存: {filepath} (sha256={sha256})")
+        error = reject_unreadable(filepath)
+        if error:
+            stop_passthrough(hosted, abort_hosted)
+            return jsonify({'success': False, 'error': error}), 400
+        eta = estimate_eta(filepath, sha256)
         
+        # 提交后台任务
         try:
-            # 获取文件元数据
-            metadata = transcription_service.get_file_metadata(filepath)
-            
-            # 调用转录服务
-            result = transcription_service.transcribe(filepath)
-            if not result:
-                raise Exception("转录失败")
-                
-            # 更新元数据
-            metadata['duration'] = result['duration']
-            
-            # 发送到飞书
-            formatted_text = feishu_service.format_transcript(result['text'], metadata)
-            feishu_service.send_message(formatted_text)
-            
-            # 获取最终的系统状态
-            final_stats = system_monitor.get_stats()
-            
-            return jsonify({
-                'success': True,
-                'text': formatted_text,
-                'stats': final_stats
-            })
-
-        finally:
-            # 清理文件
-            if os.path.exists(filepath):
-                os.remove(filepath)
-                logger.info(f"临时文件已删除: {filepath}")
-            system_monitor.decrement_processing_count()
+            job = job_queue.submit(original_filename, process_upload, filepath, sha256, hosted,
+                                   client=client, stats=stats)
+        except AdmissionRejected as e:
+            stop_passthrough(hosted, abort_hosted)
+            upload_store.remove(filepath)
+            logger.warning(f"拒绝新的请求: {str(e)}")
+            return rejected_response(e)
+        
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status_url': f'/jobs/{job.id}',
+            'events_url': f'/jobs/{job.id}/events',
+            'eta': eta
+        }), 202
 
     except Exception as e:
         logger.error(f"处理错误: {str(e)}")
-        system_monitor.decrement_processing_count()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def session_error_response(e):
+    return jsonify({'success': False, 'error': str(e)}), e.status
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """创建分块上传会话，请求体为 {"filename": ..., "size": ...}"""
+    client = client_id()
+    try:
+        job_queue.check_admission(client, system_monitor.get_stats())
+    except AdmissionRejected as e:
+        logger.warning(f"拒绝新的请求: {str(e)}")
+        return rejected_response(e)
+    data = request.get_json(silent=True) or {}
+    try:
+        session = chunked_uploads.create(str(data.get('filename') or ''), int(data.get('size') or 0), client)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': '请求格式错误'}), 400
+    except UploadSessionError as e:
+        return session_error_response(e)
+    return jsonify({
+        'success': True,
+        'upload_id': session['upload_id'],
+        'chunk_size': session['chunk_size'],
+        'chunks': session['chunks'],
+        'upload_url': f"/uploads/{session['upload_id']}"
+    }), 201
+
+@app.route('/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def put_upload_chunk(upload_id, index):
+    """上传一个分块，X-Chunk-Checksum 头为 sha256=<hex> 或 crc32=<hex>"""
+    try:
+        with RECEIVE_LATENCY.time(RECEIVE_ERRORS):
+            result = chunked_uploads.put_chunk(upload_id, index, request.get_data(cache=False),
+                                               request.headers.get('X-Chunk-Checksum', ''))
+    except UploadSessionError as e:
+        return session_error_response(e)
+    return jsonify(dict(result, success=True))
+
+@app.route('/uploads/<upload_id>')
+def get_upload(upload_id):
+    """查询已收到和缺失的分块"""
+    try:
+        session = chunked_uploads.status(upload_id)
+    except UploadSessionError as e:
+        return session_error_response(e)
+    del session['client']
+    return jsonify(dict(session, success=True))
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """所有分块到齐后合并为完整文件并提交转录任务"""
+    try:
+        job_queue.check_admission(client_id(), system_monitor.get_stats())
+    except AdmissionRejected as e:
+        logger.warning(f"拒绝新的请求: {str(e)}")
+        return rejected_response(e)
+    try:
+        upload = chunked_uploads.complete(upload_id)
+    except UploadSessionError as e:
+        return session_error_response(e)
+    filepath = upload['filepath']
+    logger.info(f"分块上传完成: {filepath} (sha256={upload['sha256']})")
+    error = reject_unreadable(filepath)
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+    eta = estimate_eta(filepath, upload['sha256'])
+    try:
+        job = job_queue.submit(upload['original_filename'], process_upload, filepath, upload['sha256'], None,
+                               client=upload['client'], stats=system_monitor.get_stats())
+    except AdmissionRejected as e:
+        upload_store.remove(filepath)
+        logger.warning(f"拒绝新的请求: {str(e)}")
+        return rejected_response(e)
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status_url': f'/jobs/{job.id}',
+        'events_url': f'/jobs/{job.id}/events',
+        'eta': eta
+    }), 202
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    """放弃上传并删除已收到的分块"""
+    try:
+        chunked_uploads.abort(upload_id)
+    except UploadSessionError as e:
+        return session_error_response(e)
+    return jsonify({'success': True})
+
+def save_batch_file(items, filename, stream, size=None):
+    """保存批量上传中的一个音频文件，不符合要求时记录拒绝原因"""
+    index = len(items)
+    if not allowed_file(filename):
+        items.append(BatchItem(index, filename, error='文件格式不支持'))
+        return
+    if size is not None and size > Config.MAX_CONTENT_LENGTH:
+        items.append(BatchItem(index, filename, error='文件过大'))
+        return
+    try:
+        upload_store.make_room(size if size is not None else Config.MAX_CONTENT_LENGTH)
+    except StorageFull as e:
+        items.append(BatchItem(index, filename, error=str(e)))
+        return
+    filepath = os.path.join(Config.UPLOAD_FOLDER, f"{uuid.uuid4()}{os.path.splitext(filename)[1]}")
+    sha256 = save_upload(stream, filepath)
+    upload_store.add(filepath)
+    if os.path.getsize(filepath) > Config.MAX_CONTENT_LENGTH:
+        upload_store.remove(filepath)
+        items.append(BatchItem(index, filename, error='文件过大'))
+        return
+    error = reject_unreadable(filepath)
+    if error:
+        items.append(BatchItem(index, filename, error=error))
+        return
+    items.append(BatchItem(index, filename, filepath, sha256))
+
+def collect_batch_files(files):
+    """保存批量上传的文件，zip 压缩包按成员展开"""
+    items = []
+    for file in files:
+        if not file or not file.filename:
+            continue
+        if file.filename.lower().endswith('.zip'):
+            try:
+                with zipfile.ZipFile(file.stream) as archive:
+                    for info in archive.infolist():
+                        if info.is_dir() or os.path.basename(info.filename).startswith('.'):
+                            continue
+                        if len(items) >= Config.BATCH_MAX_FILES:
+                            break
+                        with archive.open(info) as member:
+                            save_batch_file(items, os.path.basename(info.filename), member, info.file_size)
+            except zipfile.BadZipFile:
+                items.append(BatchItem(len(items), file.filename, error='压缩包无效'))
+        else:
+            save_batch_file(items, file.filename, file.stream)
+        if len(items) >= Config.BATCH_MAX_FILES:
+            break
+    return items
+
+@app.route('/batch', methods=['POST'])
+def batch_upload():
+    """批量上传多个音频文件或 zip 压缩包，以 NDJSON 逐个返回转录结果"""
+    if request.content_length and request.content_length > Config.BATCH_MAX_BYTES:
+        return jsonify({'success': False, 'error': '文件过大'}), 413
+    client = client_id()
+    stats = system_monitor.get_stats()
+    try:
+        job_queue.check_admission(client, stats)
+    except AdmissionRejected as e:
+        logger.warning(f"拒绝批量请求: {str(e)}")
+        return rejected_response(e)
+
+    # 批量请求体可超过单文件上限，自行解析表单
+    _, _, files = parse_form_data(request.environ, max_content_length=Config.BATCH_MAX_BYTES)
+    items = collect_batch_files(files.getlist('audio'))
+    if not items:
+        return jsonify({'success': False, 'error': '没有文件'}), 400
+    logger.info(f"批量上传: {len(items)} 个文件 (客户端 {client})")
+
+    def submit(item):
+        job = job_queue.submit(item.filename, process_upload, item.filepath, item.sha256, item.hosted,
+                               client=client, stats=stats)
+        return job.id
+
+    return Response(batch_processor.run(items, submit), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """查询任务状态"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """以 SSE 推送任务进度"""
+    if not job_queue.get(job_id):
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    return Response(
+        job_queue.stream_events(job_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/jobs/<job_id>/subtitles.<fmt>')
+def job_subtitles(job_id, fmt):
+    """分块导出字幕（txt / srt / vtt / json），可用 start / end（秒）截取时间段"""
+    if fmt not in SubtitleTrack.EXPORTERS:
+        return jsonify({'success': False, 'error': '不支持的格式'}), 400
+    job = job_queue.get(job_id)
+    if not job or not job.get('result'):
+        return jsonify({'success': False, 'error': '任务不存在或尚未完成'}), 404
+    start = request.args.get('start', type=float)
+    end = request.args.get('end', type=float)
+    # 缓存目录所有 worker 共用；缓存已淘汰时从转录历史读取
+    cached = transcript_cache.get(job['result']['sha256'])
+    if cached:
+        track = cached['track']
+    else:
+        record = transcript_store.find_by_job(job_id)
+        if not record:
+            return jsonify({'success': False, 'error': '字幕已过期'}), 404
+        track = transcript_store.get_track(record['id'])
+    if start is not None or end is not None:
+        track = track.slice(start, end)
+    chunks, mimetype = track.export(fmt)
+    return Response(chunks, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{job_id}.{fmt}"'
+    })
+
+def page_args():
+    """解析分页参数 limit / cursor"""
+    limit = request.args.get('limit', Config.TRANSCRIPT_PAGE_SIZE, type=int)
+    cursor = request.args.get('cursor', type=int)
+    return min(max(limit, 1), Config.TRANSCRIPT_MAX_PAGE_SIZE), cursor
+
+@app.route('/transcripts')
+def list_transcripts():
+    """按时间倒序列出转录历史，next_cursor 为下一页游标"""
+    items, next_cursor = transcript_store.list(*page_args())
+    return jsonify({'items': items, 'next_cursor': next_cursor})
+
+@app.route('/transcripts/<int:transcript_id>/subtitles.<fmt>')
+def transcript_subtitles(transcript_id, fmt):
+    """导出历史转录的字幕，格式与任务字幕导出相同"""
+    if fmt not in SubtitleTrack.EXPORTERS:
+        return jsonify({'success': False, 'error': '不支持的格式'}), 400
+    if not transcript_store.get(transcript_id):
+        return jsonify({'success': False, 'error': '记录不存在'}), 404
+    track = transcript_store.get_track(transcript_id)
+    start = request.args.get('start', type=float)
+    end = request.args.get('end', type=float)
+    if start is not None or end is not None:
+        track = track.slice(start, end)
+    chunks, mimetype = track.export(fmt)
+    return Response(chunks, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="transcript-{transcript_id}.{fmt}"'
+    })
+
+@app.route('/search')
+def search_transcripts():
+    """全文搜索历史字幕，返回匹配的字幕行及其时间戳"""
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({'success': False, 'error': '缺少搜索词'}), 400
+    items, next_cursor = transcript_store.search(q, *page_args())
+    return jsonify({'items': items, 'next_cursor': next_cursor})
+
 @app.route('/audio/<filename>')
 def serve_file(filename):
-    """提供临时文件访问"""
-    return send_from_directory(Config.UPLOAD_FOLDER, filename)
+    """通过签名 URL 提供临时文件访问
+
+    支持 Range 请求；文件由 WSGI file_wrapper（gunicorn 下为 sendfile）
+    或 X-Sendfile 零拷贝发送
+    """
+    if not url_signer.verify(filename, request.args.get('expires'), request.args.get('signature')):
+        logger.warning(f"拒绝未签名或已过期的文件访问: {filename}")
+        return jsonify({'success': False, 'error': '链接无效或已过期'}), 403
+    return send_from_directory(Config.UPLOAD_FOLDER, filename, conditional=True)
+
+@app.route('/metrics')
+def get_metrics():
+    """以 Prometheus 文本格式输出各阶段耗时直方图和错误计数"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def start_scheduler():
+    """定时清理任务，同一主机只在 leader 中运行"""
+    scheduler = BackgroundScheduler()
+    scheduler.configure(timezone='Asia/Shanghai')
+    scheduler.add_job(upload_store.expire, 'interval', seconds=Config.UPLOAD_EXPIRE_INTERVAL)
+    scheduler.start()
+
+@app.before_request
+def start_lifecycle():
+    """未通过 gunicorn.conf.py 启动的部署，在首个请求时启动本进程的任务（此时已在 fork 之后）"""
+    lifecycle.start()
 
 def init_app():
     """初始化应用"""
     # 配置日志
     logger.add("logs/app.log", rotation="500 MB", retention="10 days")
     
-    # 启动系统监控
-    system_monitor.start_monitoring()
+    # 确保上传目录存在
+    os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
     
-    # 启动定时清理任务
-    scheduler = BackgroundScheduler()
-    scheduler.configure(timezone='Asia/Shanghai')
-    scheduler.add_job(cleanup_old_files, 'interval', hours=1)
-    scheduler.start()
+    # 每个 worker：索引上传目录、资源监控（leader 采样，其他 worker 读取发布的采样）、
+    # 飞书发送队列（补发上次退出时未发送的消息）、指标刷新、转录历史写入线程
+    lifecycle.on_worker_start(upload_store.scan)
+    lifecycle.on_worker_start(system_monitor.start_monitoring)
+    lifecycle.on_worker_start(feishu_service.start_delivery)
+    lifecycle.on_worker_start(metrics.start_flushing)
+    lifecycle.on_worker_start(transcript_store.start)
+    
+    # 只在 leader 中：启动定时清理任务（扫描整个目录，其他 worker 的遗留文件也会清理）
+    lifecycle.on_leader(start_scheduler)
     
+    # 这里只注册任务，不启动：gunicorn --preload 时本函数在 fork 之前的 master 中执行，
+    # 任务由 worker 的 post_worker_init（见 gunicorn.conf.py）启动
     return app
 
 if __name__ == '__main__':
     try:
         app = init_app()
+        lifecycle.start()
         logger.info(f"Starting application on {Config.HOST}:{Config.PORT}")
         app.run(host=Config.HOST, port=Config.PORT, debug=Config.DEBUG)
     except Exception as e:
@@ -0,0 +1,7 @@
+"""离线端到端基准测试
+
+在本机启动 catbox / transfer.sh / temp.sh、BibiGPT 和飞书 webhook 的替身，
+用不同的 gunicorn worker / 线程配置启动服务并施加上传负载，输出 JSON 结果：
+
+    python -m bench.run --workers 1,2 --threads 4,8 --clients 8 --requests 40 --output results.json
+"""
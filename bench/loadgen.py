@@ -0,0 +1,206 @@
+"""上传负载生成：合成音频、并发客户端和延迟分位数"""
+import math
+import os
+import re
+import threading
+import time
+from typing import Optional, Dict, Any, List, Tuple
+import requests
+
+# MPEG-1 Layer III 码率索引
+MP3_BITRATES = {32: 1, 40: 2, 48: 3, 56: 4, 64: 5, 80: 6, 96: 7, 112: 8,
+                128: 9, 160: 10, 192: 11, 224: 12, 256: 13, 320: 14}
+PERCENTILES = (50, 95, 99)
+
+
+def make_mp3(path: str, seconds: float, kbps: int = 128):
+    """写入能通过文件头探测的 CBR 单声道 mp3（44.1kHz），帧内容随机，每个文件的哈希都不同"""
+    header = bytes([0xFF, 0xFB, MP3_BITRATES[kbps] << 4, 0xC0])
+    frame_size = 144 * kbps * 1000 // 44100
+    frames = math.ceil(seconds * 44100 / 1152)
+    with open(path, 'wb') as f:
+        f.write(header + bytes(frame_size - 4))  # 首帧置零，避免被误认为 Xing / VBRI 头
+        for _ in range(frames - 1):
+            f.write(header + os.urandom(frame_size - 4))
+
+
+def make_audio_files(folder: str, count: int, seconds: float, kbps: int) -> List[str]:
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f'bench-{i:04d}.mp3')
+        make_mp3(path, seconds, kbps)
+        paths.append(path)
+    return paths
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """最近秩法的 p50 / p95 / p99（秒）"""
+    ordered = sorted(values)
+    result = {}
+    for p in PERCENTILES:
+        result[f'p{p}'] = round(ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)], 4) if ordered else None
+    return result
+
+
+def histogram_percentiles(bounds: List[float], counts: List[float]) -> Dict[str, Optional[float]]:
+    """由分桶计数（非累计，最后一项为 +Inf 桶）按桶内线性插值估计分位数"""
+    total = sum(counts)
+    result = {}
+    for p in PERCENTILES:
+        if not total:
+            result[f'p{p}'] = None
+            continue
+        rank = p / 100 * total
+        seen = 0.0
+        for i, count in enumerate(counts):
+            if seen + count >= rank and count:
+                if i == len(bounds):  # 落在 +Inf 桶，只能给出下界
+                    result[f'p{p}'] = bounds[-1]
+                else:
+                    lower = bounds[i - 1] if i else 0.0
+                    result[f'p{p}'] = round(lower + (bounds[i] - lower) * (rank - seen) / count, 4)
+                break
+            seen += count
+    return result
+
+
+def parse_histograms(text: str, name: str, label: str) -> Dict[str, Tuple[List[float], List[float], float]]:
+    """从 Prometheus 文本中取出 name 直方图，返回 {标签值: (上界, 累计计数, 总和)}"""
+    series: Dict[str, Tuple[List[float], List[float], float]] = {}
+    bucket = re.compile(rf'^{name}_bucket\{{{label}="([^"]*)",le="([^"]+)"\}} (\S+)$')
+    total = re.compile(rf'^{name}_sum\{{{label}="([^"]*)"\}} (\S+)$')
+    for line in text.splitlines():
+        match = bucket.match(line)
+        if match:
+            bounds, cumulative, _ = series.setdefault(match.group(1), ([], [], 0.0))
+            if match.group(2) != '+Inf':
+                bounds.append(float(match.group(2)))
+            cumulative.append(float(match.group(3)))
+            continue
+        match = total.match(line)
+        if match and match.group(1) in series:
+            bounds, cumulative, _ = series[match.group(1)]
+            series[match.group(1)] = (bounds, cumulative, float(match.group(2)))
+    return series
+
+
+def stage_latency(before: Dict[str, Tuple[List[float], List[float], float]],
+                  after: Dict[str, Tuple[List[float], List[float], float]]) -> Dict[str, Dict[str, Any]]:
+    """两次抓取之间各阶段的次数、平均耗时和分位数"""
+    stages = {}
+    for stage, (bounds, cumulative, total) in after.items():
+        _, old_cumulative, old_total = before.get(stage, (bounds, [0.0] * len(cumulative), 0.0))
+        delta = [a - b for a, b in zip(cumulative, old_cumulative)]
+        counts = [delta[0]] + [b - a for a, b in zip(delta, delta[1:])]
+        count = delta[-1] if delta else 0
+        if not count:
+            continue
+        stages[stage] = dict(count=int(count), mean=round((total - old_total) / count, 4),
+                             **histogram_percentiles(bounds, counts))
+    return stages
+
+
+class LoadGenerator:
+    """闭环负载：clients 个并发客户端依次上传文件并轮询任务直到结束
+
+    每个客户端使用不同的 X-Forwarded-For，模拟多个用户以通过按客户端的排队限制；
+    被准入控制拒绝（503）时按 Retry-After 等待后重试同一个文件。
+    """
+
+    def __init__(self, base_url: str, files: List[str], clients: int,
+                 poll_interval: float = 0.25, job_timeout: float = 900):
+        self.base_url = base_url
+        self.files = files
+        self.clients = clients
+        self.poll_interval = poll_interval
+        self.job_timeout = job_timeout
+        self._next = 0
+        self._lock = threading.Lock()
+        self.upload_latency: List[float] = []
+        self.end_to_end: List[float] = []
+        self.counts = {'done': 0, 'failed': 0, 'rejected': 0, 'errors': 0}
+
+    def _take(self) -> Optional[str]:
+        with self._lock:
+            if self._next >= len(self.files):
+                return None
+            self._next += 1
+            return self.files[self._next - 1]
+
+    def _count(self, key: str):
+        with self._lock:
+            self.counts[key] += 1
+
+    def _upload(self, session: requests.Session, client: str, path: str) -> Optional[str]:
+        """上传直到被接纳，返回 job_id"""
+        while True:
+            start = time.perf_counter()
+            with open(path, 'rb') as f:
+                response = session.post(f'{self.base_url}/upload', files={'audio': (os.path.basename(path), f)},
+                                        headers={'X-Forwarded-For': client}, timeout=300)
+            if response.status_code == 503:
+                self._count('rejected')
+                time.sleep(min(float(response.headers.get('Retry-After', 1)), 5))
+                continue
+            if response.status_code != 202:
+                self._count('errors')
+                return None
+            with self._lock:
+                self.upload_latency.append(time.perf_counter() - start)
+            return response.json()['job_id']
+
+    def _wait(self, session: requests.Session, job_id: str) -> Optional[str]:
+        deadline = time.time() + self.job_timeout
+        while time.time() < deadline:
+            response = session.get(f'{self.base_url}/jobs/{job_id}', timeout=30)
+            if response.ok:
+                status = response.json().get('status')
+                if status in ('done', 'failed'):
+                    return status
+            time.sleep(self.poll_interval)
+        return None
+
+    def _client(self, index: int):
+        session = requests.Session()
+        client = f'10.0.{index // 250}.{index % 250 + 1}'
+        while True:
+            path = self._take()
+            if path is None:
+                return
+            start = time.perf_counter()
+            try:
+                job_id = self._upload(session, client, path)
+                if job_id is None:
+                    continue
+                status = self._wait(session, job_id)
+            except requests.RequestException:
+                self._count('errors')
+                continue
+            if status is None:
+                self._count('errors')
+                continue
+            self._count(status)
+            if status == 'done':
+                with self._lock:
+                    self.end_to_end.append(time.perf_counter() - start)
+
+    def run(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        threads = [threading.Thread(target=self._client, args=(i,), name=f'bench-client-{i}')
+                   for i in range(self.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        return {
+            'requests': len(self.files),
+            'elapsed': round(elapsed, 3),
+            'rps': round(self.counts['done'] / elapsed, 4) if elapsed else None,
+            'counts': dict(self.counts),
+            'latency': {
+                'upload': percentiles(self.upload_latency),
+                'end_to_end': percentiles(self.end_to_end),
+            },
+        }
@@ -0,0 +1,219 @@
+"""基准测试入口：启动替身和服务，按 worker / 线程配置逐组施加负载，输出 JSON 结果"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Optional, Dict, Any, List
+import psutil
+import requests
+from bench.stubs import StubServer, Endpoint, Latency
+from bench.loadgen import LoadGenerator, make_audio_files, parse_histograms, stage_latency
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+class RssSampler:
+    """定期采样 gunicorn master 及所有 worker 的常驻内存，记录峰值"""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_total = 0
+        self.peak_process = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='bench-rss')
+        self._thread.daemon = True
+
+    def _run(self):
+        try:
+            root = psutil.Process(self.pid)
+        except psutil.NoSuchProcess:
+            return
+        while not self._stop.is_set():
+            total = 0
+            try:
+                for process in [root] + root.children(recursive=True):
+                    rss = process.memory_info().rss
+                    total += rss
+                    self.peak_process = max(self.peak_process, rss)
+            except psutil.NoSuchProcess:
+                pass
+            self.peak_total = max(self.peak_total, total)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Dict[str, float]:
+        self._stop.set()
+        self._thread.join()
+        return {'peak_rss_mb': round(self.peak_total / 1024 / 1024, 1),
+                'peak_process_rss_mb': round(self.peak_process / 1024 / 1024, 1)}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def git_version() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=PROJECT_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def server_env(stub: StubServer, workdir: str, extra: Dict[str, str]) -> Dict[str, str]:
+    """服务进程的环境变量：外部服务指向替身，所有状态放在本次运行的临时目录"""
+    env = dict(os.environ)
+    env.update(stub.env())
+    env.update({
+        'UPLOAD_FOLDER': os.path.join(workdir, 'uploads'),
+        'CACHE_FOLDER': os.path.join(workdir, 'cache'),
+        'FEISHU_OUTBOX_FOLDER': os.path.join(workdir, 'outbox'),
+        'STATE_DB_PATH': os.path.join(workdir, 'state.db'),
+        'TRANSCRIPT_DB_PATH': os.path.join(workdir, 'transcripts.db'),
+        'PUBLIC_BASE_URL': '',  # 不自托管，走托管服务替身
+        'METRICS_FLUSH_INTERVAL': '1',
+        'DEBUG': 'False',
+    })
+    env.update(extra)
+    return env
+
+
+def wait_ready(base_url: str, process: subprocess.Popen, timeout: float = 30) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            if requests.get(f'{base_url}/status', timeout=2).ok:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def scrape_stages(base_url: str):
+    text = requests.get(f'{base_url}/metrics', timeout=10).text
+    return parse_histograms(text, 'voice_stage_seconds', 'stage')
+
+
+def run_once(args, stub: StubServer, workers: int, threads: int) -> Dict[str, Any]:
+    """启动一组 gunicorn 配置并施加负载"""
+    workdir = tempfile.mkdtemp(prefix=f'bench-w{workers}t{threads}-')
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    command = [sys.executable, '-m', 'gunicorn', '-w', str(workers), '--threads', str(threads),
+               '-b', f'127.0.0.1:{port}', '--timeout', '300', 'app:init_app()']
+    log = open(os.path.join(workdir, 'server.log'), 'wb')
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=PROJECT_ROOT, stdout=log, stderr=subprocess.STDOUT,
+                               env=server_env(stub, workdir, args.env))
+    result: Dict[str, Any] = {'workers': workers, 'threads': threads}
+    try:
+        if not wait_ready(base_url, process):
+            raise RuntimeError(f'服务启动失败，日志见 {log.name}')
+        result['startup_seconds'] = round(time.perf_counter() - started, 3)
+
+        files = make_audio_files(os.path.join(workdir, 'audio'), args.warmup + args.requests,
+                                 args.audio_seconds, args.audio_kbps)
+        if args.warmup:
+            LoadGenerator(base_url, files[:args.warmup], args.clients).run()
+
+        time.sleep(1.5)  # 等各 worker 刷新指标快照
+        before = scrape_stages(base_url)
+        sampler = RssSampler(process.pid)
+        sampler.start()
+        result.update(LoadGenerator(base_url, files[args.warmup:], args.clients).run())
+        result.update(sampler.stop())
+        time.sleep(1.5)
+        result['latency']['stages'] = stage_latency(before, scrape_stages(base_url))
+        return result
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        log.close()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def parse_env(values: List[str]) -> Dict[str, str]:
+    env = {}
+    for value in values:
+        key, _, val = value.partition('=')
+        env[key] = val
+    return env
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='离线端到端基准测试')
+    parser.add_argument('--workers', default='1,2', help='gunicorn worker 数，逗号分隔')
+    parser.add_argument('--threads', default='4', help='每个 worker 的线程数，逗号分隔')
+    parser.add_argument('--clients', type=int, default=8, help='并发客户端数')
+    parser.add_argument('--requests', type=int, default=40, help='每组配置的上传数')
+    parser.add_argument('--warmup', type=int, default=2, help='计时前的预热上传数')
+    parser.add_argument('--audio-seconds', type=float, default=60, help='合成音频时长（秒）')
+    parser.add_argument('--audio-kbps', type=int, default=128, help='合成音频码率')
+    parser.add_argument('--host-latency', default='0.3,0.5,0.5',
+                        help='托管替身延迟 "中位数,对数标准差,每MB秒数"')
+    parser.add_argument('--host-failure-rate', type=float, default=0.02)
+    parser.add_argument('--bibigpt-latency', default='1.0,0.5,0.2',
+                        help='BibiGPT 替身延迟 "中位数,对数标准差,每分钟音频秒数"')
+    parser.add_argument('--bibigpt-failure-rate', type=float, default=0.02)
+    parser.add_argument('--feishu-latency', default='0.05,0.3', help='飞书替身延迟 "中位数,对数标准差"')
+    parser.add_argument('--feishu-failure-rate', type=float, default=0.0)
+    parser.add_argument('--line-seconds', default='2,6', help='每条字幕的时长范围（秒）')
+    parser.add_argument('--line-chars', default='8,40', help='每条字幕的字数范围')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='传给服务的额外环境变量，可重复')
+    parser.add_argument('--output', help='结果 JSON 文件，默认输出到标准输出')
+    parser.add_argument('--keep', action='store_true', help='保留每组运行的临时目录和服务日志')
+    args = parser.parse_args(argv)
+    args.env = parse_env(args.env)
+
+    low, high = (float(v) for v in args.line_seconds.split(','))
+    chars = tuple(int(v) for v in args.line_chars.split(','))
+    stub = StubServer(
+        hosting=Endpoint(Latency.parse(args.host_latency), args.host_failure_rate),
+        bibigpt=Endpoint(Latency.parse(args.bibigpt_latency), args.bibigpt_failure_rate),
+        feishu=Endpoint(Latency.parse(args.feishu_latency), args.feishu_failure_rate),
+        audio_kbps=args.audio_kbps, line_seconds=(low, high), line_chars=chars,
+    )
+    stub.start()
+    report = {'version': git_version(), 'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+              'params': vars(args), 'runs': []}
+    try:
+        for workers in [int(v) for v in args.workers.split(',')]:
+            for threads in [int(v) for v in args.threads.split(',')]:
+                print(f'运行 workers={workers} threads={threads} ...', file=sys.stderr)
+                run = run_once(args, stub, workers, threads)
+                print(f"  {run['rps']} 任务/秒，端到端 p95 {run['latency']['end_to_end']['p95']} 秒，"
+                      f"峰值 RSS {run['peak_rss_mb']}MB", file=sys.stderr)
+                report['runs'].append(run)
+    finally:
+        report['stubs'] = stub.get_stats()
+        stub.stop()
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
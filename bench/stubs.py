@@ -0,0 +1,241 @@
+"""catbox / transfer.sh / temp.sh、BibiGPT 和飞书 webhook 的本地替身"""
+import json
+import math
+import random
+import re
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any, List, Tuple
+from urllib.parse import urlparse, parse_qs
+from time import sleep
+
+# 生成字幕文本用的常用字
+CHARS = ('的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动'
+         '同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量')
+
+
+class Latency:
+    """对数正态分布的延迟
+
+    median 为中位数（秒），sigma 为对数标准差（0 表示固定延迟），
+    per_unit 为每单位（托管每 MB、转录每分钟音频）额外的秒数
+    """
+
+    def __init__(self, median: float = 0.0, sigma: float = 0.0, per_unit: float = 0.0):
+        self.median = median
+        self.sigma = sigma
+        self.per_unit = per_unit
+
+    @classmethod
+    def parse(cls, spec: str) -> 'Latency':
+        """解析 "median[,sigma[,per_unit]]"，如 "0.2,0.5,0.1" """
+        values = [float(v) for v in spec.split(',')]
+        return cls(*values)
+
+    def sample(self, units: float = 0.0) -> float:
+        base = self.median * math.exp(random.gauss(0, self.sigma)) if self.median else 0.0
+        return base + self.per_unit * units
+
+    def to_dict(self) -> Dict[str, float]:
+        return {'median': self.median, 'sigma': self.sigma, 'per_unit': self.per_unit}
+
+
+class Endpoint:
+    """一类外部服务的行为：延迟分布和失败率，并统计请求数"""
+
+    def __init__(self, latency: Latency, failure_rate: float = 0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def call(self, units: float = 0.0) -> bool:
+        """按分布等待后返回本次是否成功"""
+        sleep(self.latency.sample(units))
+        failed = random.random() < self.failure_rate
+        with self._lock:
+            self.requests += 1
+            self.failures += failed
+        return not failed
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'requests': self.requests, 'failures': self.failures,
+                    'failure_rate': self.failure_rate, 'latency': self.latency.to_dict()}
+
+
+class StubServer:
+    """在一个端口上提供三类外部服务的替身
+
+    - POST /catbox/user/api.php、PUT /transfer/<文件名>、POST /tempsh/upload：
+      读完请求体后返回 /files/<id> 地址，并记录文件大小
+    - GET /bibigpt/<token>/subtitle?url=：按托管文件大小和 audio_kbps 推算音频时长，
+      返回覆盖整段音频的 subtitlesArray
+    - POST /feishu/hook：失败时同飞书一样在 HTTP 200 中返回错误码
+    - HEAD /files/<id>：已托管的文件返回 200，否则 404（托管地址租约的校验）
+    """
+
+    def __init__(self, hosting: Endpoint, bibigpt: Endpoint, feishu: Endpoint,
+                 audio_kbps: int = 128, line_seconds: Tuple[float, float] = (2.0, 6.0),
+                 line_chars: Tuple[int, int] = (8, 40), host: str = '127.0.0.1', port: int = 0):
+        self.hosting = hosting
+        self.bibigpt = bibigpt
+        self.feishu = feishu
+        self.audio_kbps = audio_kbps
+        self.line_seconds = line_seconds
+        self._files: Dict[str, int] = {}  # 文件 id -> 字节数
+        self._lock = threading.Lock()
+        # 预先生成字幕文本，响应时只做挑选，替身本身不占用多少 CPU
+        self._lines = [''.join(random.choice(CHARS) for _ in range(random.randint(*line_chars)))
+                       for _ in range(512)]
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def env(self) -> Dict[str, str]:
+        """把服务指向替身的环境变量"""
+        return {
+            'CATBOX_UPLOAD_URL': f'{self.base_url}/catbox/user/api.php',
+            'TRANSFER_SH_URL': f'{self.base_url}/transfer',
+            'TEMP_SH_UPLOAD_URL': f'{self.base_url}/tempsh/upload',
+            'BIBIGPT_API_BASE_URL': f'{self.base_url}/bibigpt',
+            'FEISHU_WEBHOOK_URL': f'{self.base_url}/feishu/hook',
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='bench-stubs')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'hosting': self.hosting.get_stats(), 'bibigpt': self.bibigpt.get_stats(),
+                'feishu': self.feishu.get_stats()}
+
+    def host_file(self, size: int) -> Optional[str]:
+        if not self.hosting.call(size / 1024 / 1024):
+            return None
+        file_id = uuid.uuid4().hex
+        with self._lock:
+            self._files[file_id] = size
+        return f'{self.base_url}/files/{file_id}.mp3'
+
+    def has_file(self, file_url: str) -> bool:
+        match = re.search(r'/files/([0-9a-f]+)', file_url)
+        with self._lock:
+            return bool(match) and match.group(1) in self._files
+
+    def subtitles(self, file_url: str) -> Optional[List[Dict[str, Any]]]:
+        match = re.search(r'/files/([0-9a-f]+)', file_url)
+        with self._lock:
+            size = self._files.get(match.group(1)) if match else None
+        duration = size * 8 / (self.audio_kbps * 1000) if size else 60.0
+        if not self.bibigpt.call(duration / 60):
+            return None
+        subtitles = []
+        start = 0.0
+        while start < duration:
+            end = min(duration, start + random.uniform(*self.line_seconds))
+            subtitles.append({'index': len(subtitles), 'start': round(start, 2), 'end': round(end, 2),
+                              'text': random.choice(self._lines)})
+            start = end
+        return subtitles
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # 保持连接，与真实服务一样复用连接池
+
+            def log_message(self, format, *args):
+                pass
+
+            def _read_body(self) -> int:
+                """读完请求体（支持分块传输编码），返回字节数"""
+                if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+                    total = 0
+                    while True:
+                        size = int(self.rfile.readline().split(b';')[0], 16)
+                        if size == 0:
+                            self.rfile.readline()
+                            return total
+                        remaining = size
+                        while remaining:
+                            remaining -= len(self.rfile.read(min(remaining, 64 * 1024)))
+                        self.rfile.readline()
+                        total += size
+                remaining = length = int(self.headers.get('Content-Length') or 0)
+                while remaining:
+                    data = self.rfile.read(min(remaining, 64 * 1024))
+                    if not data:
+                        break
+                    remaining -= len(data)
+                return length
+
+            def _reply(self, status: int, body, content_type: str = 'text/plain'):
+                if not isinstance(body, bytes):
+                    if not isinstance(body, str):
+                        body, content_type = json.dumps(body, ensure_ascii=False), 'application/json'
+                    body = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _host(self):
+                url = stub.host_file(self._read_body())
+                if url:
+                    self._reply(200, url)
+                else:
+                    self._reply(500, 'internal error')
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                if path in ('/catbox/user/api.php', '/tempsh/upload'):
+                    self._host()
+                elif path == '/feishu/hook':
+                    self._read_body()
+                    if stub.feishu.call():
+                        self._reply(200, {'StatusCode': 0, 'StatusMessage': 'success', 'code': 0, 'msg': 'success'})
+                    else:
+                        self._reply(200, {'code': 9499, 'msg': 'too many request', 'data': {}})
+                else:
+                    self._read_body()
+                    self._reply(404, 'not found')
+
+            def do_PUT(self):
+                if urlparse(self.path).path.startswith('/transfer/'):
+                    self._host()
+                else:
+                    self._read_body()
+                    self._reply(404, 'not found')
+
+            def do_HEAD(self):
+                self.send_response(200 if stub.has_file(self.path) else 404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                if parsed.path.startswith('/bibigpt/') and parsed.path.endswith('/subtitle'):
+                    file_url = parse_qs(parsed.query).get('url', [''])[0]
+                    subtitles = stub.subtitles(file_url)
+                    if subtitles is None:
+                        self._reply(200, {'success': False, 'message': 'stub failure'})
+                    else:
+                        self._reply(200, {'success': True, 'detail': {'subtitlesArray': subtitles}})
+                else:
+                    self._reply(404, 'not found')
+
+        return Handler
@@ -11,22 +11,170 @@ class Config:
     
     # 飞书配置
     FEISHU_WEBHOOK_URL = os.getenv('FEISHU_WEBHOOK_URL', '')
+    FEISHU_MAX_MESSAGE_BYTES = 18 * 1024  # 单条消息上限，飞书请求体限制为 20KB
+    FEISHU_BURST = 5  # 令牌桶容量，允许的突发消息数
+    FEISHU_MAX_BACKOFF = 300  # 重试退避上限（秒）
+    FEISHU_OUTBOX_FOLDER = os.getenv('FEISHU_OUTBOX_FOLDER', '/tmp/feishu_outbox')  # 持久化发件箱
+    FEISHU_DEAD_LETTER_FILE = os.getenv('FEISHU_DEAD_LETTER_FILE', os.path.join(FEISHU_OUTBOX_FOLDER, 'dead_letter.jsonl'))  # 无法投递的消息，每行一条
+    FEISHU_MAX_ATTEMPTS = int(os.getenv('FEISHU_MAX_ATTEMPTS', 20))  # 可重试的失败最多尝试次数，超过后移入死信
+    FEISHU_RETRYABLE_CODES = {11232}  # 飞书业务错误码中可重试的（频率限制），其余视为永久失败
     
     # 文件配置
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', '/tmp/audio_uploads')
     MAX_CONTENT_LENGTH = 32 * 1024 * 1024  # 32MB，针对音频文件优化
     ALLOWED_EXTENSIONS = {'mp3', 'm4a', 'wav', 'ogg'}  # 只保留音频格式
+    UPLOAD_QUOTA_BYTES = int(os.getenv('UPLOAD_QUOTA_BYTES', 2 * 1024 * 1024 * 1024))  # 上传目录配额，2GB
+    UPLOAD_DISK_THRESHOLD = float(os.getenv('UPLOAD_DISK_THRESHOLD', 90))  # 磁盘使用率超过该值（%）即淘汰未使用的文件
+    UPLOAD_ORPHAN_AGE = int(os.getenv('UPLOAD_ORPHAN_AGE', 7200))  # 其他进程的文件超过多久未修改才视为遗留（秒），需大于任务最长处理时间
+    UPLOAD_EXPIRE_INTERVAL = 300  # 检查过期文件的间隔（秒），只处理过期的文件
+    
+    # 流式接收配置
+    STREAMING_INGEST = os.getenv('STREAMING_INGEST', 'True').lower() == 'true'  # 直接解析请求体，只落盘一次
+    STREAMING_PASSTHROUGH = os.getenv('STREAMING_PASSTHROUGH', 'False').lower() == 'true'  # 接收的同时转发到 transfer.sh
+    INGEST_CHUNK_SIZE = 64 * 1024
+    INGEST_PIPE_CHUNKS = 64  # 直通上传缓冲的最大块数
+    INGEST_PIPE_TIMEOUT = 30  # 直通上传阻塞超过该时间（秒）则放弃直通
+
+    # 分块上传配置
+    UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 1024 * 1024))  # 1MB
+    UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', 24 * 3600))  # 未完成的上传保留24小时，期间可续传
+    UPLOAD_PARALLEL_CHUNKS = 3  # 浏览器并行上传的分块数
+
+    # 转录缓存配置
+    CACHE_FOLDER = os.getenv('CACHE_FOLDER', '/tmp/transcript_cache')
+    CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 256 * 1024 * 1024))  # 256MB
+    CACHE_TTL = int(os.getenv('CACHE_TTL', 7 * 24 * 3600))  # 7天
+    
+    # 转录历史配置
+    TRANSCRIPT_DB_PATH = os.getenv('TRANSCRIPT_DB_PATH', 'data/transcripts.db')
+    TRANSCRIPT_PAGE_SIZE = 20  # 列表和搜索的默认每页条数
+    TRANSCRIPT_MAX_PAGE_SIZE = 100
     
     # 服务器配置
     HOST = os.getenv('HOST', '0.0.0.0')
     PORT = int(os.getenv('PORT', 5000))
     DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
     
+    # 自托管配置：设置公网地址和密钥后，BibiGPT 直接通过签名 URL 从本机拉取音频
+    PUBLIC_BASE_URL = os.getenv('PUBLIC_BASE_URL', '')  # 例如 https://example.com
+    SECRET_KEY = os.getenv('SECRET_KEY', '')  # 所有 worker 必须一致
+    SELF_HOST_ENABLED = os.getenv('SELF_HOST_ENABLED', 'True').lower() == 'true'
+    SIGNED_URL_TTL = int(os.getenv('SIGNED_URL_TTL', 3600))  # 签名 URL 有效期（秒）
+    USE_X_SENDFILE = os.getenv('USE_X_SENDFILE', 'False').lower() == 'true'  # 由 nginx 等前端代理发送文件
+    
+    # 外部 HTTP 调用配置：每类调用一个 keep-alive 连接池
+    HTTP_CONNECT_TIMEOUT = 5
+    BIBIGPT_READ_TIMEOUT = int(os.getenv('BIBIGPT_READ_TIMEOUT', 900))  # BibiGPT 同步返回字幕，需覆盖整段转录
+    HOSTING_READ_TIMEOUT = 120  # 上传完成后等待托管服务响应
+    FEISHU_READ_TIMEOUT = 10
+    HTTP_POOL_HOSTS = 10  # 每个 session 缓存连接池的主机数
+    HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 10))  # 每个主机保留的 keep-alive 连接数
+    
+    # 文件托管配置（上传地址可指向本地替身，见 bench/）
+    CATBOX_UPLOAD_URL = os.getenv('CATBOX_UPLOAD_URL', 'https://catbox.moe/user/api.php')
+    TRANSFER_SH_URL = os.getenv('TRANSFER_SH_URL', 'https://transfer.sh')
+    TEMP_SH_UPLOAD_URL = os.getenv('TEMP_SH_UPLOAD_URL', 'https://temp.sh/upload')
+    HOST_STATS_WINDOW = 20  # 每个托管服务保留的最近上传记录数
+    HOST_FAILURE_THRESHOLD = 3  # 连续失败多少次后熔断
+    HOST_COOLDOWN = 300  # 熔断冷却时间（秒）
+    HOST_HEDGE_DELAY = float(os.getenv('HOST_HEDGE_DELAY', 20))  # 启动对冲上传的最小等待时间（秒）
+    HOST_HEDGE_FACTOR = 1.5  # 超过预估耗时的倍数后启动对冲上传
+    HOST_DEFAULT_THROUGHPUT = 256 * 1024  # 无历史数据时假设的上传吞吐（字节/秒）
+    TRANSFER_SH_MAX_DAYS = 1  # transfer.sh 文件保存天数（Max-Days 请求头）
+    # 各托管服务的文件保存时间（秒），同一内容在此期间复用已托管的地址；catbox 永久保存，租约最多保留 7 天
+    HOSTED_URL_LIFETIMES = {
+        'catbox': 7 * 86400,
+        'transfer.sh': TRANSFER_SH_MAX_DAYS * 86400,
+        'temp.sh': 3 * 86400,
+    }
+    HOSTED_URL_MARGIN = 3600  # 距到期不足多少秒的地址不再复用，留出转录拉取文件的时间
+    HOSTED_URL_CHECK_TIMEOUT = 5  # 复用前 HEAD 校验地址的超时（秒）
+    
+    # 分段转录配置
+    SEGMENTED_TRANSCRIPTION = os.getenv('SEGMENTED_TRANSCRIPTION', 'True').lower() == 'true'
+    SEGMENT_MINUTES = float(os.getenv('SEGMENT_MINUTES', 10))  # 每段目标时长（分钟）
+    SEGMENT_PARALLELISM = int(os.getenv('SEGMENT_PARALLELISM', 3))  # 同时转录的分段数
+    SEGMENT_RETRIES = 2  # 单个分段失败后的重试次数（与分段内的托管、转录重试合计）
+    SEGMENT_SEARCH_WINDOW = 30  # 在目标切分点前后多少秒内寻找静音
+    SEGMENT_MIN_TAIL = 60  # 最后一段的最短时长（秒），不足则并入前一段
+    SEGMENT_SILENCE_DB = -35  # 静音阈值（dB）
+    SEGMENT_SILENCE_DURATION = 0.4  # 最短静音时长（秒）
+
+    # 转码配置：托管前转为单声道低码率语音，减少上传字节数
+    TRANSCODE_ENABLED = os.getenv('TRANSCODE_ENABLED', 'True').lower() == 'true'
+    TRANSCODE_SAMPLE_RATE = 16000  # 语音识别不需要更高的采样率
+    TRANSCODE_MIN_KBPS = 24  # 目标码率取源码率的 1/4，限制在该区间内
+    TRANSCODE_MAX_KBPS = 48
+    TRANSCODE_MIN_SAVING = 0.4  # 预计节省不足40%时不转码
+    TRANSCODE_MIN_BYTES = 1024 * 1024  # 小于1MB的文件直接托管
+    
     # 任务配置
     MAX_RETRIES = 3
-    RETRY_DELAY = 5  # seconds
+    RETRY_DELAY = 5  # 重试退避的初始上限（秒），之后每次翻倍并随机抖动
+    RETRY_MAX_DELAY = 60  # 单次退避上限（秒）
+    REQUEST_DEADLINE = int(os.getenv('REQUEST_DEADLINE', 1800))  # 单个任务托管和转录的截止时间（秒），含所有重试
+    RETRY_BUDGET_RATE = float(os.getenv('RETRY_BUDGET_RATE', 0.5))  # 整个部署每秒补充的重试次数
+    RETRY_BUDGET_BURST = int(os.getenv('RETRY_BUDGET_BURST', 10))  # 重试预算最多积累的次数
     CLEANUP_INTERVAL = 3600  # 1 hour
     
+    # 共享状态配置：sqlite（单机多 worker，放在 /dev/shm 即共享内存）或 network（多节点）
+    STATE_BACKEND = os.getenv('STATE_BACKEND', 'sqlite')
+    STATE_DB_PATH = os.getenv(
+        'STATE_DB_PATH',
+        '/dev/shm/voice_service_state.db' if os.path.isdir('/dev/shm') else '/tmp/voice_service_state.db'
+    )
+    STATE_CAS_RETRIES = 50
+    
+    # 进程生命周期：持有锁文件的 worker 作为 leader，运行定时任务和资源采样
+    LEADER_LOCK_PATH = os.getenv('LEADER_LOCK_PATH', os.path.splitext(STATE_DB_PATH)[0] + '.leader.lock')
+    LEADER_RETRY_INTERVAL = 5  # 非 leader 重试加锁的间隔（秒）
+    
     # 资源限制
-    MAX_WORKERS = 2  # 基于服务器配置（2 CPU）
-    RATE_LIMIT = "20/minute"  # 飞书消息限制
\ No newline at end of file
+    MAX_WORKERS = int(os.getenv('MAX_WORKERS', 2))  # 基于服务器配置（2 CPU）
+    MAX_QUEUE_SIZE = int(os.getenv('MAX_QUEUE_SIZE', 20))  # 等待执行的任务上限
+    MAX_CONCURRENT_TRANSCRIPTIONS = int(os.getenv('MAX_CONCURRENT_TRANSCRIPTIONS', MAX_WORKERS))  # 整个部署同时执行的转录数
+    MAX_QUEUED_PER_CLIENT = int(os.getenv('MAX_QUEUED_PER_CLIENT', 5))  # 单个客户端最多排队任务数
+    
+    # 批量处理配置
+    BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', 50))
+    BATCH_MAX_BYTES = int(os.getenv('BATCH_MAX_BYTES', 512 * 1024 * 1024))  # 整个批量请求体上限，单个文件仍受 MAX_CONTENT_LENGTH 限制
+    BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', MAX_QUEUED_PER_CLIENT))  # 一个批次同时在队列中的任务数
+    BATCH_HOST_CONCURRENCY = int(os.getenv('BATCH_HOST_CONCURRENCY', 2))  # 预托管并发数
+    BATCH_MAX_WAIT = 600  # 队列持续满载时，等待提交的最长时间（秒）
+    BATCH_KEEPALIVE = 15  # 没有结果时输出空行保活的间隔（秒）
+    
+    # 准入控制配置：CPU / 内存只作为辅助信号，带滞回
+    ADMISSION_CPU_CHECK = os.getenv('ADMISSION_CPU_CHECK', 'True').lower() == 'true'
+    ADMISSION_CPU_HIGH = 90
+    ADMISSION_CPU_LOW = 75
+    ADMISSION_MEMORY_CHECK = os.getenv('ADMISSION_MEMORY_CHECK', 'False').lower() == 'true'  # 空闲时内存即接近 90%
+    ADMISSION_MEMORY_HIGH = 97
+    ADMISSION_MEMORY_LOW = 93
+    ADMISSION_DEFAULT_DURATION = 120  # 没有观测数据时假设的流水线耗时（秒）
+    ADMISSION_MAX_RETRY_AFTER = 600
+    ADMISSION_EWMA_ALPHA = 0.2
+    ADMISSION_LEASE_TTL = 3600  # 执行槽位租约时长，进程崩溃后自动回收
+    ADMISSION_POLL_INTERVAL = 1  # 等待其他 worker 释放槽位的轮询间隔（秒）
+    JOB_RETENTION = 3600  # 已完成任务保留时间（秒）
+    JOB_POLL_INTERVAL = 1  # 跨 worker 推送进度时轮询共享状态的间隔（秒）
+    RATE_LIMIT = "20/minute"  # 飞书消息限制
+
+    # 指标配置
+    METRICS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)  # 直方图分桶上界（秒）
+    METRICS_FLUSH_INTERVAL = int(os.getenv('METRICS_FLUSH_INTERVAL', 5))  # 各 worker 写入指标快照的间隔（秒）
+    METRICS_RETIRE_AFTER = int(os.getenv('METRICS_RETIRE_AFTER', 60))  # 其他节点的快照超过该时间未更新即视为进程已退出（秒）
+    METRICS_SNAPSHOT_TTL = int(os.getenv('METRICS_SNAPSHOT_TTL', 3600))  # 快照保留时间，须留足时间把已退出进程的计数并入累计值（秒）
+
+    # 耗时模型配置：学习各阶段单位耗时，预测完成时间并确定各阶段截止时间
+    COST_EWMA_ALPHA = 0.2
+    COST_MIN_SAMPLES = 3  # 样本数不足时使用固定超时
+    COST_DEADLINE_FACTOR = 2  # 超过模型上界（均值 + 4 倍偏差）的该倍数即视为落后
+    COST_DEFAULT_BIBIGPT = 10  # 没有观测数据时假设的每分钟音频转录耗时（秒）
+    COST_DEFAULT_FEISHU = 0.5  # 没有观测数据时假设的每条飞书消息发送耗时（秒）
+    BIBIGPT_MIN_TIMEOUT = 60  # 按模型收紧后的 BibiGPT 读取超时下限（秒）
+    FEISHU_MIN_TIMEOUT = 2
+
+    # 资源历史配置
+    MONITOR_INTERVAL = 2  # 资源采样间隔（秒）
+    HISTORY_RAW_SECONDS = 3600  # 原始采样保留时长（秒）
+    HISTORY_TIERS = ((10, 6 * 3600), (60, 2 * 86400), (600, 30 * 86400))  # (汇总粒度, 保留时长)，单位秒
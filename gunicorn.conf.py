@@ -0,0 +1,11 @@
+"""gunicorn 配置，在项目目录下启动时自动加载
+
+进程生命周期任务（飞书发送队列、指标刷新、leader 选举等）必须在 fork 之后的 worker 中启动，
+否则使用 --preload 时 master 会先成为 leader 并一直持有锁文件。
+"""
+
+
+def post_worker_init(worker):
+    """worker 加载应用之后启动本进程的任务"""
+    from services.lifecycle import lifecycle
+    lifecycle.start()
@@ -0,0 +1,127 @@
+import math
+import threading
+from typing import Optional, Dict, Any
+from loguru import logger
+from config import Config
+from services.state import state_backend
+
+
+class AdmissionRejected(Exception):
+    """请求未被接纳，retry_after 为建议的重试等待秒数"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PressureSignal:
+    """带滞回的资源压力信号：超过 high 进入过载，回落到 low 以下才解除"""
+
+    def __init__(self, name: str, metric: str, enabled: bool, high: float, low: float):
+        self.name = name
+        self.metric = metric  # SystemMonitor.get_stats() 中的字段
+        self.enabled = enabled
+        self.high = high
+        self.low = low
+        self.overloaded = False
+
+    def update(self, value: float) -> bool:
+        if not self.enabled:
+            return False
+        if self.overloaded and value < self.low:
+            self.overloaded = False
+            logger.info(f"{self.name} 压力解除: {value}%")
+        elif not self.overloaded and value > self.high:
+            self.overloaded = True
+            logger.warning(f"{self.name} 压力过高: {value}%")
+        return self.overloaded
+
+
+class AdmissionController:
+    """基于并发数的准入控制
+
+    直接限制整个部署中同时执行的转录数（共享状态中的槽位租约），
+    超出的任务进入有界等待队列；队列满时拒绝并根据观测到的流水线耗时
+    计算 Retry-After。CPU / 内存只作为可配置的辅助信号，并带滞回避免抖动。
+    """
+
+    SLOT_KEY = 'transcriptions'
+
+    def __init__(self):
+        self.max_inflight = Config.MAX_CONCURRENT_TRANSCRIPTIONS
+        self.max_queue = Config.MAX_QUEUE_SIZE
+        self.max_per_client = Config.MAX_QUEUED_PER_CLIENT
+        self.signals = [
+            PressureSignal('CPU', 'cpu_percent', Config.ADMISSION_CPU_CHECK,
+                           Config.ADMISSION_CPU_HIGH, Config.ADMISSION_CPU_LOW),
+            PressureSignal('内存', 'memory_percent', Config.ADMISSION_MEMORY_CHECK,
+                           Config.ADMISSION_MEMORY_HIGH, Config.ADMISSION_MEMORY_LOW),
+        ]
+        self._lock = threading.Lock()
+        self.avg_duration: Optional[float] = None  # 流水线耗时的指数移动平均（秒）
+        self.stats = {
+            'admitted': 0,
+            'rejected': 0
+        }
+
+    def expected_wait(self, queued: int) -> float:
+        """估算排在 queued 个任务之后需要等待的时间（秒）"""
+        avg = self.avg_duration or Config.ADMISSION_DEFAULT_DURATION
+        return avg * (queued + 1) / max(self.max_inflight, 1)
+
+    def retry_after(self, queued: int) -> int:
+        """估算队列排空到能接纳新任务所需的时间"""
+        return int(min(max(math.ceil(self.expected_wait(queued)), 1), Config.ADMISSION_MAX_RETRY_AFTER))
+
+    def check(self, queued: int, client_queued: int, stats: Optional[Dict[str, Any]] = None,
+              record: bool = True):
+        """判断是否接纳新任务，不接纳时抛出 AdmissionRejected
+
+        record=False 用于读取请求体之前的预检，通过时不计入接纳数
+        """
+        with self._lock:
+            if stats:
+                pressure = [s.name for s in self.signals if s.update(stats.get(s.metric, 0))]
+            else:
+                pressure = [s.name for s in self.signals if s.overloaded]
+
+            reason = None
+            if pressure:
+                reason = f"系统负载过高（{'、'.join(pressure)}），请稍后重试"
+            elif queued >= self.max_queue:
+                reason = "任务队列已满，请稍后重试"
+            elif client_queued >= self.max_per_client:
+                reason = "您已有较多任务在排队，请等待完成后再上传"
+
+            if reason:
+                self.stats['rejected'] += 1
+                raise AdmissionRejected(reason, self.retry_after(queued))
+            if record:
+                self.stats['admitted'] += 1
+
+    def acquire(self, holder: str) -> bool:
+        """占用一个部署级的执行槽位"""
+        return state_backend.acquire_slot(self.SLOT_KEY, holder, self.max_inflight, Config.ADMISSION_LEASE_TTL)
+
+    def release(self, holder: str, duration: Optional[float] = None):
+        """释放槽位并记录本次流水线耗时"""
+        state_backend.release_slot(self.SLOT_KEY, holder)
+        if duration is not None:
+            with self._lock:
+                if self.avg_duration is None:
+                    self.avg_duration = duration
+                else:
+                    self.avg_duration += Config.ADMISSION_EWMA_ALPHA * (duration - self.avg_duration)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = self.stats.copy()
+            stats['avg_duration'] = round(self.avg_duration, 2) if self.avg_duration else None
+            stats['pressure'] = [s.name for s in self.signals if s.overloaded]
+        stats['inflight'] = state_backend.count_slots(self.SLOT_KEY)
+        stats['max_inflight'] = self.max_inflight
+        return stats
+
+
+# 创建单例实例
+admission_controller = AdmissionController()
@@ -0,0 +1,137 @@
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Dict, List, Callable, Iterator
+from loguru import logger
+from config import Config
+from services.admission import AdmissionRejected
+from services.cache import transcript_cache
+from services.jobs import job_queue
+from services.storage import upload_store
+from services.transcription import transcription_service
+
+
+class BatchItem:
+    """批量上传中的一个文件"""
+
+    def __init__(self, index: int, filename: str, filepath: Optional[str] = None,
+                 sha256: Optional[str] = None, error: Optional[str] = None):
+        self.index = index
+        self.filename = filename
+        self.filepath = filepath
+        self.sha256 = sha256
+        self.error = error  # 接收阶段即被拒绝的原因
+        self.hosted: Optional[Future] = None  # 预托管结果 (服务名, URL)
+        self.job_id: Optional[str] = None
+
+    def line(self, status: str, **data) -> str:
+        record = {'index': self.index, 'filename': self.filename, 'job_id': self.job_id, 'status': status}
+        record.update(data)
+        return json.dumps(record, ensure_ascii=False) + '\n'
+
+
+class BatchProcessor:
+    """批量转录
+
+    所有文件先进入预托管线程池（按顺序、有并发上限），同时按批次并发上限
+    逐个提交到任务队列：第 N 个文件转录时，第 N+1 个文件已经在托管，
+    整批耗时趋近于最慢阶段 × 文件数。每个文件完成后立即输出一行 JSON，
+    慢文件不会阻塞其他文件的结果；空行为保活。
+    """
+
+    def __init__(self, host_concurrency: int):
+        self.host_concurrency = host_concurrency
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.host_concurrency,
+                    thread_name_prefix='batch-host'
+                )
+            return self._executor
+
+    @staticmethod
+    def _prehost(item: BatchItem):
+        try:
+            return transcription_service.prehost(item.filepath, item.sha256)
+        except Exception as e:
+            logger.error(f"预托管失败 {item.filename}: {str(e)}")
+            return None
+
+    def run(self, items: List[BatchItem], submit: Callable[[BatchItem], str]) -> Iterator[str]:
+        """按完成顺序逐行输出结果，submit(item) 提交任务并返回 job_id"""
+        start = time.time()
+        counts = {'done': 0, 'failed': 0, 'rejected': 0}
+        for item in items:
+            if item.error:
+                counts['rejected'] += 1
+                yield item.line('rejected', error=item.error)
+
+        pending = deque(item for item in items if not item.error)
+        executor = self._get_executor()
+        for item in pending:
+            if not transcript_cache.contains(item.sha256):
+                item.hosted = executor.submit(self._prehost, item)
+
+        inflight: Dict[str, BatchItem] = {}
+        try:
+            while pending or inflight:
+                # 提交任务直到达到本批次的并发上限
+                while pending and len(inflight) < Config.BATCH_CONCURRENCY:
+                    item = pending[0]
+                    try:
+                        item.job_id = submit(item)
+                    except AdmissionRejected as e:
+                        if inflight:
+                            break  # 等本批次的任务完成后再提交
+                        if time.time() - start > Config.BATCH_MAX_WAIT:
+                            pending.popleft()
+                            self._discard(item)
+                            counts['rejected'] += 1
+                            yield item.line('rejected', error=str(e))
+                            continue
+                        time.sleep(min(e.retry_after, Config.BATCH_KEEPALIVE))
+                        yield '\n'
+                        continue
+                    except Exception as e:
+                        pending.popleft()
+                        self._discard(item)
+                        counts['failed'] += 1
+                        yield item.line('failed', error=str(e))
+                        continue
+                    pending.popleft()
+                    inflight[item.job_id] = item
+
+                if not inflight:
+                    continue
+                finished = job_queue.wait_any(list(inflight), Config.BATCH_KEEPALIVE)
+                if not finished:
+                    yield '\n'
+                    continue
+                for job in finished:
+                    item = inflight.pop(job['job_id'])
+                    counts[job['status'] if job['status'] == 'done' else 'failed'] += 1
+                    yield item.line(job['status'], result=job['result'], error=job['error'])
+        finally:
+            # 客户端断开时，尚未提交的文件不再处理；已提交的任务照常完成
+            for item in pending:
+                self._discard(item)
+
+        yield json.dumps({'summary': dict(counts, files=len(items),
+                                          elapsed=round(time.time() - start, 2))}) + '\n'
+
+    @staticmethod
+    def _discard(item: BatchItem):
+        if item.hosted is not None:
+            item.hosted.cancel()
+        if item.filepath:
+            upload_store.remove(item.filepath)
+
+
+# 创建单例实例
+batch_processor = BatchProcessor(Config.BATCH_HOST_CONCURRENCY)
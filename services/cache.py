@@ -0,0 +1,179 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+from loguru import logger
+from config import Config
+from services.subtitles import SubtitleTrack
+
+
+class TranscriptCache:
+    """以音频内容 SHA-256 为键的转录结果磁盘缓存
+
+    每条缓存是 cache_dir 下的一个 <sha256>.json 文件，内存中维护按访问顺序
+    排列的索引，超过容量时按 LRU 淘汰，超过 TTL 的条目视为未命中。
+    字幕轨以列式结构保存。
+
+    多个 worker 共用缓存目录：索引未命中时查看磁盘，采纳其他 worker 写入的条目；
+    命中时把文件 atime 设为当前时间，写入时重新扫描目录，按 atime 对整个目录执行容量上限。
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, ttl: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._index: 'OrderedDict[str, Tuple[int, float]]' = OrderedDict()  # sha256 -> (大小, 写入时间)
+        self._total_bytes = 0
+        self._loaded = False
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expired': 0
+        }
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _scan(self):
+        """扫描缓存目录重建索引，同步其他 worker 写入和淘汰的条目（需持有锁）"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith('.json'):
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue  # 扫描期间被其他 worker 删除
+                    # atime 记录最近一次命中，mtime 记录写入时间
+                    entries.append((st.st_atime, entry.name[:-5], st.st_size, st.st_mtime))
+        self._index = OrderedDict()
+        self._total_bytes = 0
+        for _, key, size, created_at in sorted(entries):
+            self._index[key] = (size, created_at)
+            self._total_bytes += size
+        self._loaded = True
+
+    def _ensure_loaded(self):
+        """首次使用时扫描缓存目录重建索引（需持有锁）"""
+        if self._loaded:
+            return
+        self._scan()
+        logger.info(f"转录缓存已加载: {len(self._index)} 条, {self._total_bytes} 字节")
+
+    def _lookup(self, key: str) -> Optional[Tuple[int, float]]:
+        """查找索引，未命中时查看磁盘并采纳其他 worker 写入的条目（需持有锁）"""
+        self._ensure_loaded()
+        entry = self._index.get(key)
+        if entry is None:
+            try:
+                st = os.stat(self._path(key))
+            except FileNotFoundError:
+                return None
+            entry = (st.st_size, st.st_mtime)
+            self._index[key] = entry
+            self._total_bytes += st.st_size
+        return entry
+
+    def _remove(self, key: str):
+        """删除一条缓存（需持有锁）"""
+        size, _ = self._index.pop(key)
+        self._total_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass  # 已被其他 worker 淘汰
+        except OSError as e:
+            logger.error(f"删除缓存文件失败 {key}: {str(e)}")
+
+    def contains(self, key: str) -> bool:
+        """只检查索引，不读取文件也不计入命中统计"""
+        with self._lock:
+            entry = self._lookup(key)
+            return bool(entry) and time.time() - entry[1] <= self.ttl and os.path.exists(self._path(key))
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """查询缓存，命中时返回转录结果"""
+        with self._lock:
+            entry = self._lookup(key)
+            if entry and time.time() - entry[1] > self.ttl:
+                self._remove(key)
+                self.stats['expired'] += 1
+                entry = None
+            if not entry:
+                self.stats['misses'] += 1
+                return None
+            self._index.move_to_end(key)
+
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                result = json.load(f)
+            if 'track' in result:
+                result['track'] = SubtitleTrack.from_columns(result['track'])
+            else:
+                # 旧格式：保存的是原始 subtitlesArray
+                result['track'] = SubtitleTrack.from_subtitles(result.pop('raw_subtitles', None) or [])
+                result.pop('text', None)
+            os.utime(self._path(key), (time.time(), entry[1]))
+        except (OSError, ValueError) as e:
+            logger.error(f"读取缓存失败 {key}: {str(e)}")
+            with self._lock:
+                if key in self._index:
+                    self._remove(key)
+                self.stats['misses'] += 1
+            return None
+
+        with self._lock:
+            self.stats['hits'] += 1
+        logger.info(f"转录缓存命中: {key}")
+        return result
+
+    def put(self, key: str, result: Dict[str, Any]):
+        """写入转录结果，必要时淘汰最久未使用的条目"""
+        data = json.dumps({
+            'duration': result.get('duration'),
+            'track': result['track'].to_columns()
+        }, ensure_ascii=False)
+        size = len(data.encode('utf-8'))
+        if size > self.max_bytes:
+            logger.warning(f"转录结果过大，不写入缓存: {size} 字节")
+            return
+
+        with self._lock:
+            self._ensure_loaded()
+            tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(data)
+                os.replace(tmp_path, self._path(key))
+            except OSError as e:
+                logger.error(f"写入缓存失败 {key}: {str(e)}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return
+
+            # 其他 worker 也在写入同一目录，按整个目录的实际占用执行容量上限
+            self._scan()
+
+            while self._total_bytes > self.max_bytes and self._index:
+                oldest = next(iter(self._index))
+                self._remove(oldest)
+                self.stats['evictions'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = self.stats.copy()
+            stats['entries'] = len(self._index)
+            stats['bytes'] = self._total_bytes
+            stats['max_bytes'] = self.max_bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0
+        return stats
+
+
+# 创建单例实例
+transcript_cache = TranscriptCache(Config.CACHE_FOLDER, Config.CACHE_MAX_BYTES, Config.CACHE_TTL)
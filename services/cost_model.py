@@ -0,0 +1,107 @@
+import threading
+from typing import Optional, Dict, Any
+from config import Config
+
+# get_stats 中各项的单位及换算倍数
+UNITS = {'host': ('MB', 1024 * 1024), 'bibigpt': ('minute', 1), 'feishu': ('message', 1)}
+
+
+class Estimate:
+    """单位耗时的指数移动平均及平均偏差（同 TCP 的 RTT 估计），均值 + 4 倍偏差作为上界"""
+
+    def __init__(self, default: float):
+        self.default = default
+        self.mean: Optional[float] = None
+        self.deviation = 0.0
+        self.samples = 0
+
+    def update(self, value: float):
+        alpha = Config.COST_EWMA_ALPHA
+        if self.mean is None:
+            self.mean = value
+            self.deviation = value / 2
+        else:
+            self.deviation += alpha * (abs(value - self.mean) - self.deviation)
+            self.mean += alpha * (value - self.mean)
+        self.samples += 1
+
+    @property
+    def expected(self) -> float:
+        return self.mean if self.mean is not None else self.default
+
+    @property
+    def upper(self) -> Optional[float]:
+        """样本不足时返回 None，调用方不据此收紧超时"""
+        if self.samples < Config.COST_MIN_SAMPLES:
+            return None
+        return self.mean + 4 * self.deviation
+
+
+class CostModel:
+    """从已完成的请求学习各阶段的单位耗时
+
+    - host:<服务名>：托管上传每字节耗时
+    - bibigpt：每分钟音频的转录耗时
+    - feishu：每条消息的发送耗时
+
+    用于预测新上传的端到端耗时，并为各阶段选择截止时间：落后于模型上界的
+    请求尽早放弃，而不是等到固定超时。
+    """
+
+    def __init__(self):
+        self._estimates: Dict[str, Estimate] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _default(key: str) -> float:
+        if key.startswith('host:'):
+            return 1 / Config.HOST_DEFAULT_THROUGHPUT
+        return {'bibigpt': Config.COST_DEFAULT_BIBIGPT, 'feishu': Config.COST_DEFAULT_FEISHU}[key]
+
+    def _get(self, key: str) -> Estimate:
+        estimate = self._estimates.get(key)
+        if estimate is None:
+            estimate = self._estimates[key] = Estimate(self._default(key))
+        return estimate
+
+    def observe(self, key: str, seconds: float, units: float = 1.0):
+        """记录一次成功请求的耗时，units 为字节数、音频分钟数或消息数"""
+        if units <= 0:
+            return
+        with self._lock:
+            self._get(key).update(seconds / units)
+
+    def expected(self, key: str, units: float = 1.0) -> float:
+        with self._lock:
+            return self._get(key).expected * units
+
+    def samples(self, key: str) -> int:
+        with self._lock:
+            return self._get(key).samples
+
+    def deadline(self, key: str, units: float, floor: float, cap: float) -> float:
+        """本次请求的截止时间（秒）：模型上界的 COST_DEADLINE_FACTOR 倍，限制在 [floor, cap]"""
+        with self._lock:
+            upper = self._get(key).upper
+        if upper is None:
+            return cap
+        return min(cap, max(floor, upper * units * Config.COST_DEADLINE_FACTOR))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """各项的单位耗时（秒），托管按每 MB 给出"""
+        stats = {}
+        with self._lock:
+            for key, estimate in self._estimates.items():
+                unit, scale = UNITS['host' if key.startswith('host:') else key]
+                upper = estimate.upper
+                stats[key] = {
+                    'unit': unit,
+                    'expected': round(estimate.expected * scale, 3),
+                    'upper': round(upper * scale, 3) if upper is not None else None,
+                    'samples': estimate.samples,
+                }
+        return stats
+
+
+# 创建单例实例
+cost_model = CostModel()
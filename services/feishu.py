@@ -1,38 +1,331 @@
 import requests
 from loguru import logger
 from config import Config
-from typing import Optional
+from typing import Optional, List, Dict, Any, Iterable, Iterator, Union
+from collections import deque
+import json
+import os
+import threading
 import time
+import uuid
+from services.state import state_backend, StateBackend
+from services.cost_model import cost_model
+from services.http_client import http_client
+from services.retry import backoff_delay, retry_budget
+from services.metrics import feishu_send_latency, feishu_send_errors
+from services.subtitles import SubtitleTrack
+
+
+class FeishuSendError(Exception):
+    """发送飞书消息失败；retryable 为 False 时重试也不会成功（如关键词或签名校验失败）"""
+
+    def __init__(self, message: str, retryable: bool):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class TokenBucket:
+    """令牌桶：按固定速率补充令牌，允许少量突发
+
+    桶保存在共享状态后端中，所有 worker 共用同一个速率限制
+    """
+
+    def __init__(self, key: str, rate: float, capacity: int, backend: StateBackend = state_backend):
+        self.key = key
+        self.rate = rate  # 每秒补充的令牌数
+        self.capacity = capacity
+        self.backend = backend
+
+    def try_acquire(self) -> float:
+        """尝试取一个令牌，成功返回 0，否则返回需要等待的秒数"""
+        return self.backend.take_token(self.key, self.rate, self.capacity)
+
+
+class OutboxItem:
+    """待发送的一条飞书消息，同时持久化为发件箱中的一个文件"""
+
+    def __init__(self, text: str, path: str, attempts: int = 0):
+        self.text = text
+        self.path = path
+        self.attempts = attempts
+        self.next_attempt_at = 0.0
+
 
 class FeishuService:
     def __init__(self):
         self.webhook_url = Config.FEISHU_WEBHOOK_URL
-        self.last_send_time = 0
-        self.min_interval = 60 / int(Config.RATE_LIMIT.split('/')[0])  # 根据速率限制计算最小间隔
-    
-    def format_transcript(self, text: str, metadata: Optional[dict] = None) -> str:
-        """格式化转录文本，添加元数据"""
+        rate_count, _ = Config.RATE_LIMIT.split('/')
+        self.bucket = TokenBucket('feishu', int(rate_count) / 60, Config.FEISHU_BURST)  # 根据速率限制补充令牌
+        self.outbox_dir = ''  # 每个进程独立的发件箱目录，启动发送线程时确定
+        self._queue: deque = deque()
+        self._cond = threading.Condition()
+        self._worker: Optional[threading.Thread] = None
+        self._seq = 0
+        self.stats = {
+            'enqueued': 0,
+            'sent': 0,
+            'failures': 0,
+            'dead_letters': 0
+        }
+
+    def format_transcript(self, track: SubtitleTrack, metadata: Optional[dict] = None) -> Iterator[str]:
+        """逐块输出格式化的转录文本（带元数据），不拼接成整个字符串"""
         header = "📝 语音转文字结果\n"
         if metadata:
             header += f"🎤 时长：{metadata.get('duration', '未知')}分钟\n"
             header += f"📊 文件大小：{metadata.get('file_size', '未知')}MB\n"
             header += f"📁 文件格式：{metadata.get('file_type', '未知')}\n"
-        
+
         header += "\n🕒 时间戳格式说明：[开始时间s -> 结束时间s]\n"
-        
-        return f"{header}\n{text}"
-    
-    def send_message(self, text: str, retry_count: int = 0) -> bool:
-        """发送消息到飞书群"""
+
+        yield header + '\n'
+        yield from track.iter_text()
+
+    @staticmethod
+    def _lines(chunks: Iterable[str]) -> Iterator[str]:
+        """把分块的文本还原为逐行输出，与 text.split('\\n') 结果相同"""
+        pending = ''
+        for chunk in chunks:
+            pending += chunk
+            *lines, pending = pending.split('\n')
+            yield from lines
+        yield pending
+
+    def split_message(self, text: Union[str, Iterable[str]], max_bytes: int) -> List[str]:
+        """按字幕行切分长消息，每段不超过 max_bytes（UTF-8）；text 可以是分块的迭代器"""
+        parts = []
+        current: List[str] = []
+        size = 0
+        for line in self._lines([text] if isinstance(text, str) else text):
+            line_size = len(line.encode('utf-8')) + 1
+            if line_size > max_bytes:
+                # 单行过长时按字符硬切分
+                if current:
+                    parts.append('\n'.join(current))
+                    current, size = [], 0
+                encoded = line.encode('utf-8')
+                while encoded:
+                    piece = encoded[:max_bytes].decode('utf-8', errors='ignore')
+                    parts.append(piece)
+                    encoded = encoded[len(piece.encode('utf-8')):]
+                continue
+            if size + line_size > max_bytes and current:
+                parts.append('\n'.join(current))
+                current, size = [], 0
+            current.append(line)
+            size += line_size
+        if current:
+            parts.append('\n'.join(current))
+        return parts
+
+    def start_delivery(self):
+        """启动后台发送线程，并接管已退出进程遗留的发件箱
+
+        未配置 Webhook 时不启动，遗留的发件箱保留到配置之后再发送
+        """
+        if not self.webhook_url:
+            return
+        with self._cond:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self.outbox_dir = os.path.join(Config.FEISHU_OUTBOX_FOLDER, str(os.getpid()))
+            os.makedirs(self.outbox_dir, exist_ok=True)
+            os.makedirs(os.path.dirname(Config.FEISHU_DEAD_LETTER_FILE) or '.', exist_ok=True)
+            self._recover_outbox()
+            self._worker = threading.Thread(target=self._deliver_loop, name='feishu-delivery')
+            self._worker.daemon = True
+            self._worker.start()
+            logger.info(f"飞书发送队列已启动，待发送 {len(self._queue)} 条")
+
+    def _recover_outbox(self):
+        """把已退出进程的发件箱文件移到本进程目录并按顺序加载（需持有锁）"""
+        for entry in os.scandir(Config.FEISHU_OUTBOX_FOLDER):
+            if not entry.is_dir() or entry.path == self.outbox_dir:
+                continue
+            try:
+                os.kill(int(entry.name), 0)
+                continue  # 进程仍在运行
+            except (ValueError, ProcessLookupError):
+                pass
+            except PermissionError:
+                continue
+            for item in os.scandir(entry.path):
+                try:
+                    os.rename(item.path, os.path.join(self.outbox_dir, item.name))
+                except OSError:
+                    pass  # 已被其他进程接管
+            try:
+                os.rmdir(entry.path)
+            except OSError:
+                pass
+
+        for name in sorted(os.listdir(self.outbox_dir)):
+            if not name.endswith('.json'):
+                continue  # 写到一半的临时文件
+            path = os.path.join(self.outbox_dir, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self._queue.append(OutboxItem(data['text'], path, data.get('attempts', 0)))
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"读取发件箱文件失败 {name}: {str(e)}")
+
+    def enqueue(self, text: Union[str, Iterable[str]]) -> int:
+        """把消息放入后台发送队列，长消息按行切分并标注序号，返回分段数"""
         if not self.webhook_url:
             logger.warning("飞书 Webhook URL 未配置")
+            return 0
+
+        parts = self.split_message(text, Config.FEISHU_MAX_MESSAGE_BYTES - 64)
+        if len(parts) > 1:
+            parts = [f"({i}/{len(parts)})\n{part}" for i, part in enumerate(parts, 1)]
+
+        self.start_delivery()
+        with self._cond:
+            for part in parts:
+                self._seq += 1
+                name = f"{time.time_ns():020d}-{self._seq:06d}-{uuid.uuid4().hex[:8]}.json"
+                path = os.path.join(self.outbox_dir, name)
+                try:
+                    with open(path, 'w', encoding='utf-8') as f:
+                        json.dump({'text': part}, f, ensure_ascii=False)
+                except OSError as e:
+                    logger.error(f"写入发件箱失败: {str(e)}")
+                self._queue.append(OutboxItem(part, path))
+            self.stats['enqueued'] += len(parts)
+            self._cond.notify_all()
+        return len(parts)
+
+    def _next_batch(self) -> List[OutboxItem]:
+        """取出队首消息，并合并其后能放进同一条消息的小通知（需持有锁）"""
+        batch = [self._queue.popleft()]
+        size = len(batch[0].text.encode('utf-8'))
+        while self._queue and self._queue[0].attempts == 0:
+            next_size = len(self._queue[0].text.encode('utf-8')) + 2
+            if size + next_size > Config.FEISHU_MAX_MESSAGE_BYTES - 64:
+                break
+            batch.append(self._queue.popleft())
+            size += next_size
+        return batch
+
+    def _deliver_loop(self):
+        """后台发送线程：令牌桶限速，失败后抖动指数退避重试，保持消息顺序
+
+        消息已持久化在发件箱中，不设截止时间；重试预算用完时按最长退避推迟，而不是丢弃。
+        永久失败和超过 FEISHU_MAX_ATTEMPTS 次的消息移入死信文件，不阻塞后面的消息
+        """
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                wait = self._queue[0].next_attempt_at - time.time()
+                if wait > 0:
+                    self._cond.wait(timeout=wait)
+                    continue
+                batch = self._next_batch()
+
+            wait = self.bucket.try_acquire()
+            while wait > 0:
+                time.sleep(wait)
+                wait = self.bucket.try_acquire()
+
+            self._deliver_batch(batch)
+
+    def _deliver_batch(self, batch: List[OutboxItem]):
+        """发送一批消息并处理结果：成功删除发件箱文件，失败时放回队首或移入死信"""
+        try:
+            self._post('\n\n'.join(item.text for item in batch))
+        except FeishuSendError as e:
+            self._handle_failure(batch, e)
+            return
+
+        with self._cond:
+            self.stats['sent'] += 1
+        for item in batch:
+            self._remove(item.path)
+
+    def _handle_failure(self, batch: List[OutboxItem], error: FeishuSendError):
+        with self._cond:
+            self.stats['failures'] += 1
+            for item in batch:
+                item.attempts += 1
+                self._save(item)
+
+            if not error.retryable and len(batch) > 1:
+                # 合并发送被拒绝时逐条重发（已失败过的消息不再合并），只把被拒绝的那条移入死信
+                self._queue.extendleft(reversed(batch))
+                logger.info(f"合并的 {len(batch)} 条飞书消息被拒绝，改为逐条发送")
+                return
+
+            if not error.retryable or batch[0].attempts >= Config.FEISHU_MAX_ATTEMPTS:
+                for item in batch:
+                    self._dead_letter(item, str(error))
+                return
+
+            delay = backoff_delay(batch[0].attempts, Config.RETRY_DELAY, Config.FEISHU_MAX_BACKOFF)
+            if not retry_budget.try_acquire():
+                delay = Config.FEISHU_MAX_BACKOFF
+            batch[0].next_attempt_at = time.time() + delay
+            # 放回队首，保持顺序
+            self._queue.extendleft(reversed(batch))
+        logger.info(f"飞书消息将在 {delay:.1f} 秒后重试 (第 {batch[0].attempts} 次失败)")
+
+    def _save(self, item: OutboxItem):
+        """把尝试次数写回发件箱文件，重启后仍按累计次数判断是否移入死信"""
+        tmp_path = item.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'text': item.text, 'attempts': item.attempts}, f, ensure_ascii=False)
+            os.replace(tmp_path, item.path)
+        except OSError as e:
+            logger.error(f"更新发件箱文件失败: {str(e)}")
+
+    def _dead_letter(self, item: OutboxItem, error: str):
+        """把无法投递的消息追加到死信文件并从发件箱删除（需持有锁）"""
+        record = {
+            'text': item.text,
+            'attempts': item.attempts,
+            'error': error,
+            'failed_at': time.time()
+        }
+        try:
+            with open(Config.FEISHU_DEAD_LETTER_FILE, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except OSError as e:
+            logger.error(f"写入飞书死信文件失败: {str(e)}")
+            return
+        self._remove(item.path)
+        self.stats['dead_letters'] += 1
+        logger.error(f"飞书消息无法投递，已移入死信 (尝试 {item.attempts} 次): {error}")
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = self.stats.copy()
+            stats['pending'] = len(self._queue)
+        return stats
+
+    def send_message(self, text: str) -> bool:
+        """发送一条消息到飞书群（不做限速和重试，由发送队列负责）"""
+        try:
+            self._post(text)
+            return True
+        except FeishuSendError:
             return False
-            
-        # 速率限制处理
-        current_time = time.time()
-        if current_time - self.last_send_time < self.min_interval:
-            time.sleep(self.min_interval - (current_time - self.last_send_time))
-        
+
+    def _post(self, text: str):
+        """发送一条消息，失败时抛出 FeishuSendError 并标明能否重试"""
+        if not self.webhook_url:
+            logger.warning("飞书 Webhook URL 未配置")
+            raise FeishuSendError("飞书 Webhook URL 未配置", retryable=False)
+
+        start = time.time()
         try:
             payload = {
                 "msg_type": "text",
@@ -40,20 +333,46 @@ class FeishuService:
                     "text": text
                 }
             }
-            response = requests.post(self.webhook_url, json=payload)
-            response.raise_for_status()
-            
-            self.last_send_time = time.time()
+            read_timeout = cost_model.deadline('feishu', 1, Config.FEISHU_MIN_TIMEOUT, Config.FEISHU_READ_TIMEOUT)
+            response = http_client.session('feishu').post(
+                self.webhook_url,
+                data=json.dumps(payload, ensure_ascii=False).encode('utf-8'),
+                headers={'Content-Type': 'application/json; charset=utf-8'},
+                timeout=(Config.HTTP_CONNECT_TIMEOUT, read_timeout)
+            )
+            if response.status_code == 429 or response.status_code >= 500:
+                raise FeishuSendError(f"飞书返回 HTTP {response.status_code}", retryable=True)
+            if response.status_code >= 400:
+                raise FeishuSendError(f"飞书拒绝请求 HTTP {response.status_code}: {response.text[:200]}",
+                                      retryable=False)
+
+            # 飞书在 HTTP 200 中通过 code 字段返回业务错误（如频率限制、关键词或签名校验失败）
+            try:
+                result = response.json()
+            except ValueError as e:
+                # 多半是网关返回的错误页，按临时故障处理
+                raise FeishuSendError(f"飞书响应无法解析: {str(e)}", retryable=True) from e
+            code = result.get('code', result.get('StatusCode', 0))
+            if code:
+                raise FeishuSendError(f"飞书返回错误 {code}: {result.get('msg')}",
+                                      retryable=code in Config.FEISHU_RETRYABLE_CODES)
+
             logger.info("消息发送成功")
-            return True
-            
+            cost_model.observe('feishu', time.time() - start)
+
         except requests.exceptions.RequestException as e:
+            # 超时、连接失败等网络错误都可以重试
             logger.error(f"发送消息失败: {str(e)}")
-            if retry_count < Config.MAX_RETRIES:
-                logger.info(f"尝试重试 ({retry_count + 1}/{Config.MAX_RETRIES})")
-                time.sleep(Config.RETRY_DELAY)
-                return self.send_message(text, retry_count + 1)
-            return False
+            feishu_send_errors.inc()
+            raise FeishuSendError(str(e), retryable=True) from e
+
+        except FeishuSendError as e:
+            logger.error(f"发送消息失败: {str(e)}")
+            feishu_send_errors.inc()
+            raise
+
+        finally:
+            feishu_send_latency.observe(time.time() - start)
 
 # 创建单例实例
-feishu_service = FeishuService() 
\ No newline at end of file
+feishu_service = FeishuService()
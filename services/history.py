@@ -0,0 +1,165 @@
+import math
+import threading
+from array import array
+from typing import Optional, Dict, Any, List, Tuple
+from config import Config
+
+METRICS = ('cpu_percent', 'memory_percent', 'disk_usage', 'processing_count')
+
+
+class Ring:
+    """定长环形缓冲区，每列一个预分配的 array，写满后覆盖最旧的数据"""
+
+    def __init__(self, capacity: int, columns: Tuple[str, ...]):
+        self.capacity = capacity
+        self.times = array('d', [0.0] * capacity)
+        self.columns = {name: array('f', [0.0] * capacity) for name in columns}
+        self.head = 0  # 下一个写入位置
+        self.size = 0
+
+    def append(self, timestamp: float, values: Dict[str, float]):
+        i = self.head
+        self.times[i] = timestamp
+        for name, column in self.columns.items():
+            column[i] = values[name]
+        self.head = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def _index(self, n: int) -> int:
+        """第 n 旧的数据在数组中的位置"""
+        return (self.head - self.size + n) % self.capacity
+
+    def since(self, start: float) -> range:
+        """时间戳不早于 start 的数据的逻辑序号范围（时间戳单调递增，二分查找）"""
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[self._index(mid)] < start:
+                lo = mid + 1
+            else:
+                hi = mid
+        return range(lo, self.size)
+
+
+class Rollup:
+    """按固定粒度增量汇总 min / avg / max
+
+    当前时间桶的累计值保存在标量中，样本跨入下一个桶时才写入环形缓冲区
+    """
+
+    def __init__(self, resolution: int, retention: int):
+        self.resolution = resolution
+        columns = tuple(f'{m}_{agg}' for m in METRICS for agg in ('min', 'avg', 'max'))
+        self.ring = Ring(max(retention // resolution, 1), columns)
+        self.bucket: Optional[float] = None
+        self.count = 0
+        self.acc: Dict[str, List[float]] = {m: [0.0, 0.0, 0.0] for m in METRICS}  # [min, sum, max]
+
+    def add(self, timestamp: float, values: Dict[str, float]):
+        bucket = math.floor(timestamp / self.resolution) * self.resolution
+        if bucket != self.bucket:
+            self._commit()
+            self.bucket = bucket
+        for m in METRICS:
+            acc = self.acc[m]
+            value = values[m]
+            if self.count == 0:
+                acc[0] = acc[1] = acc[2] = value
+            else:
+                acc[0] = min(acc[0], value)
+                acc[1] += value
+                acc[2] = max(acc[2], value)
+        self.count += 1
+
+    def current(self) -> Optional[Dict[str, float]]:
+        """尚未写入缓冲区的当前桶"""
+        if not self.count:
+            return None
+        row = {}
+        for m, (low, total, high) in self.acc.items():
+            row[f'{m}_min'] = low
+            row[f'{m}_avg'] = total / self.count
+            row[f'{m}_max'] = high
+        return row
+
+    def _commit(self):
+        row = self.current()
+        if row is not None:
+            self.ring.append(self.bucket, row)
+        self.count = 0
+
+
+class ResourceHistory:
+    """资源使用历史：原始采样 + 多级汇总，内存占用固定
+
+    默认配置下保留 1 小时原始数据、6 小时 10 秒汇总、2 天 1 分钟汇总、
+    30 天 10 分钟汇总，合计约 600 KB。
+    """
+
+    def __init__(self, interval: int, raw_seconds: int, tiers: Tuple[Tuple[int, int], ...]):
+        self.interval = interval
+        self.raw = Ring(max(raw_seconds // interval, 1), METRICS)
+        self.rollups = [Rollup(resolution, retention) for resolution, retention in tiers]
+        self.raw_seconds = raw_seconds
+        self._lock = threading.Lock()
+
+    def add(self, timestamp: float, values: Dict[str, float]):
+        with self._lock:
+            self.raw.append(timestamp, values)
+            for rollup in self.rollups:
+                rollup.add(timestamp, values)
+
+    def resolutions(self) -> List[Tuple[int, int]]:
+        """可用的 (粒度, 保留时长)，从细到粗"""
+        return [(self.interval, self.raw_seconds)] + [
+            (r.resolution, r.ring.capacity * r.resolution) for r in self.rollups
+        ]
+
+    def pick_resolution(self, window: int, resolution: Optional[int] = None) -> int:
+        """未指定粒度时选择能覆盖整个时间窗口的最细粒度；指定时取不细于它的可用粒度"""
+        options = self.resolutions()
+        if resolution is not None:
+            for res, _ in options:
+                if res >= resolution:
+                    return res
+            return options[-1][0]
+        for res, retention in options:
+            if retention >= window:
+                return res
+        return options[-1][0]
+
+    def query(self, window: int, resolution: int, now: float) -> Dict[str, Any]:
+        """返回时间窗口内的列式数据：t 为时间戳，各指标分别给出 min / avg / max 序列"""
+        start = now - window
+        result: Dict[str, Any] = {'resolution': resolution, 'window': window, 't': []}
+        with self._lock:
+            if resolution == self.interval:
+                ring = self.raw
+                rows = ring.since(start)
+                result['t'] = [round(ring.times[ring._index(n)], 1) for n in rows]
+                for m in METRICS:
+                    values = [round(ring.columns[m][ring._index(n)], 2) for n in rows]
+                    result[m] = {'min': values, 'avg': values, 'max': values}
+                return result
+
+            rollup = next(r for r in self.rollups if r.resolution == resolution)
+            ring = rollup.ring
+            rows = ring.since(start)
+            indexes = [ring._index(n) for n in rows]
+            result['t'] = [ring.times[i] for i in indexes]
+            series = {
+                name: [round(column[i], 2) for i in indexes]
+                for name, column in ring.columns.items()
+            }
+            current = rollup.current()
+            if current is not None and rollup.bucket >= start:
+                result['t'].append(rollup.bucket)
+                for name, value in current.items():
+                    series[name].append(round(value, 2))
+        for m in METRICS:
+            result[m] = {agg: series[f'{m}_{agg}'] for agg in ('min', 'avg', 'max')}
+        return result
+
+
+# 创建单例实例
+resource_history = ResourceHistory(Config.MONITOR_INTERVAL, Config.HISTORY_RAW_SECONDS, Config.HISTORY_TIERS)
@@ -0,0 +1,315 @@
+import math
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional, Dict, Any, Callable, List, Tuple
+from loguru import logger
+from config import Config
+from services.cost_model import cost_model
+from services.metrics import host_upload_latency, host_upload_errors
+from services.retry import RetryPolicy
+
+
+class UploadCancelled(Exception):
+    """上传已被取消（对冲上传中落后的一方）"""
+
+
+class CancellableFile:
+    """包装文件对象，取消后下一次 read 立即抛出异常以中断上传"""
+
+    def __init__(self, f, cancel: Optional[threading.Event] = None):
+        self._f = f
+        self._cancel = cancel
+        self.len = os.fstat(f.fileno()).st_size - f.tell()
+
+    def read(self, size: int = -1) -> bytes:
+        if self._cancel is not None and self._cancel.is_set():
+            raise UploadCancelled("上传已取消")
+        data = self._f.read(size)
+        self.len -= len(data)
+        return data
+
+    def __len__(self):
+        return self.len
+
+
+class MultipartFile:
+    """流式 multipart/form-data 请求体
+
+    requests 的 files= 参数会把整个文件读进内存再发送，这里按块读取文件，
+    并提供长度以便以 Content-Length 方式流式发送，同时支持取消。
+    """
+
+    def __init__(self, fields: Dict[str, str], file_field: str, f,
+                 filename: str, cancel: Optional[threading.Event] = None):
+        self.boundary = uuid.uuid4().hex
+        head = b''
+        for name, value in fields.items():
+            head += (f'--{self.boundary}\r\n'
+                     f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                     f'{value}\r\n').encode('utf-8')
+        head += (f'--{self.boundary}\r\n'
+                 f'Content-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n').encode('utf-8')
+        self._parts = [head, CancellableFile(f, cancel), f'\r\n--{self.boundary}--\r\n'.encode('utf-8')]
+        self.len = sum(len(part) for part in self._parts)
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.len
+        out = b''
+        while self._parts and len(out) < size:
+            part = self._parts[0]
+            if isinstance(part, bytes):
+                taken = part[:size - len(out)]
+                out += taken
+                if len(taken) == len(part):
+                    self._parts.pop(0)
+                else:
+                    self._parts[0] = part[len(taken):]
+            else:
+                data = part.read(size - len(out))
+                if not data:
+                    self._parts.pop(0)
+                out += data
+        self.len -= len(out)
+        return out
+
+    def __len__(self):
+        return self.len
+
+
+class HostStats:
+    """单个文件托管服务的滚动窗口统计和熔断状态"""
+
+    def __init__(self, name: str, priority: int):
+        self.name = name
+        self.key = f'host:{name}'  # 耗时模型中的每字节上传耗时
+        self.priority = priority  # 没有历史数据时的默认顺序
+        self.window = deque(maxlen=Config.HOST_STATS_WINDOW)  # (是否成功, 耗时, 字节数)
+        self.consecutive_failures = 0
+        self.opened_until = 0.0  # 熔断截止时间，0 表示闭合
+
+    @property
+    def success_rate(self) -> float:
+        if not self.window:
+            return 1.0
+        return sum(1 for ok, _, _ in self.window if ok) / len(self.window)
+
+    @property
+    def throughput(self) -> Optional[float]:
+        """耗时模型估计的上传吞吐（字节/秒），没有成功记录时为 None"""
+        if not cost_model.samples(self.key):
+            return None
+        return 1 / cost_model.expected(self.key)
+
+    def expected_latency(self, size: int) -> float:
+        """按模型吞吐和成功率估算上传耗时"""
+        return cost_model.expected(self.key, size) / max(self.success_rate, 0.1)
+
+    def state(self, now: float) -> str:
+        if self.opened_until == 0:
+            return 'closed'
+        if now < self.opened_until:
+            return 'open'
+        return 'half_open'
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        throughput = self.throughput
+        return {
+            'state': self.state(now),
+            'samples': len(self.window),
+            'success_rate': round(self.success_rate, 3),
+            'throughput_kbps': round(throughput / 1024, 1) if throughput else None,
+            'consecutive_failures': self.consecutive_failures,
+        }
+
+
+class HostSelector:
+    """按健康度选择文件托管服务，并对慢请求进行对冲上传
+
+    - 每个服务维护滚动窗口内的成功率和吞吐，按预估耗时排序
+    - 连续失败达到阈值后熔断，冷却期后放行一次探测请求（半开）
+    - 首选服务超过延迟阈值仍未完成时，并行启动下一个服务，取先完成者并取消另一方
+    - 换用下一个服务和对冲上传都算一次重试，受请求的截止时间和共享重试预算限制
+    """
+
+    def __init__(self, providers: List[Tuple[str, Callable[..., Optional[str]]]]):
+        self.providers = dict(providers)
+        self._stats = {name: HostStats(name, i) for i, (name, _) in enumerate(providers)}
+        self._latency = {name: host_upload_latency.labels(name) for name in self.providers}
+        self._errors = {name: host_upload_errors.labels(name) for name in self.providers}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=Config.MAX_WORKERS * len(self.providers),
+                    thread_name_prefix='host-upload'
+                )
+            return self._executor
+
+    def order(self, size: int) -> List[str]:
+        """返回本次上传的尝试顺序：闭合的按预估耗时，其次半开，最后熔断中的"""
+        now = time.time()
+        with self._lock:
+            ranked = {'closed': [], 'half_open': [], 'open': []}
+            for stats in self._stats.values():
+                ranked[stats.state(now)].append(stats)
+            ranked['closed'].sort(key=lambda s: (s.expected_latency(size), s.priority))
+            ranked['half_open'].sort(key=lambda s: s.priority)
+            ranked['open'].sort(key=lambda s: s.opened_until)
+            return [s.name for s in ranked['closed'] + ranked['half_open'] + ranked['open']]
+
+    def hedge_delay(self, name: str, size: int) -> float:
+        """首选服务在此时间内未完成则启动对冲上传"""
+        with self._lock:
+            stats = self._stats[name]
+            if stats.throughput is None:
+                return Config.HOST_HEDGE_DELAY
+            return max(Config.HOST_HEDGE_DELAY, stats.expected_latency(size) * Config.HOST_HEDGE_FACTOR)
+
+    def abandon_after(self, name: str, size: int) -> float:
+        """上传超过模型上界仍未完成即视为落后，样本不足时不放弃"""
+        return cost_model.deadline(f'host:{name}', size, Config.HOST_HEDGE_DELAY, math.inf)
+
+    def expected_latency(self, size: int) -> float:
+        """本次上传的预估耗时：按尝试顺序取首选服务"""
+        candidates = self.order(size)
+        if not candidates:
+            return 0.0
+        with self._lock:
+            return self._stats[candidates[0]].expected_latency(size)
+
+    def record(self, name: str, ok: bool, seconds: float, size: int):
+        """记录一次上传结果，更新耗时模型和熔断状态"""
+        if ok:
+            cost_model.observe(f'host:{name}', seconds, size)
+        with self._lock:
+            stats = self._stats[name]
+            stats.window.append((ok, seconds, size))
+            if ok:
+                stats.consecutive_failures = 0
+                stats.opened_until = 0.0
+                return
+            stats.consecutive_failures += 1
+            if stats.opened_until or stats.consecutive_failures >= Config.HOST_FAILURE_THRESHOLD:
+                stats.opened_until = time.time() + Config.HOST_COOLDOWN
+                logger.warning(f"文件托管服务 {name} 已熔断 {Config.HOST_COOLDOWN} 秒")
+
+    def _claim(self, name: str):
+        """半开状态的服务只放行一次探测，探测期间重新视为熔断"""
+        now = time.time()
+        with self._lock:
+            stats = self._stats[name]
+            if stats.state(now) == 'half_open':
+                stats.opened_until = now + Config.HOST_COOLDOWN
+
+    def _attempt(self, name: str, file_path: str, size: int,
+                 cancel: threading.Event) -> Optional[str]:
+        start = time.time()
+        try:
+            url = self.providers[name](file_path, cancel=cancel)
+        except UploadCancelled:
+            url = None
+        if cancel.is_set() and not url:
+            # 被对冲取消的上传不计入失败
+            logger.info(f"已取消上传到 {name}")
+            return None
+        elapsed = time.time() - start
+        self.record(name, bool(url), elapsed, size)
+        self._latency[name].observe(elapsed)
+        if not url:
+            self._errors[name].inc()
+        return url
+
+    def upload(self, file_path: str, policy: Optional[RetryPolicy] = None) -> Optional[Tuple[str, str]]:
+        """上传文件，返回 (服务名, URL)，全部失败时返回 None
+
+        超过 policy 的截止时间或被取消时，取消进行中的上传并抛出 DeadlineExceeded
+        """
+        size = os.path.getsize(file_path)
+        candidates = self.order(size)
+        if not candidates:
+            return None
+        if policy is not None:
+            policy.check()
+
+        executor = self._get_executor()
+        pending = {}  # future -> (服务名, 取消事件, 开始时间, 放弃时间)
+
+        def launch(retry: bool = True) -> Optional[str]:
+            """启动下一个服务，首次以外都消耗重试预算，预算不足时不再换用其他服务"""
+            if retry and policy is not None and not policy.allow_retry():
+                candidates.clear()
+                return None
+            name = candidates.pop(0)
+            self._claim(name)
+            cancel = threading.Event()
+            future = executor.submit(self._attempt, name, file_path, size, cancel)
+            now = time.time()
+            pending[future] = (name, cancel, now, now + self.abandon_after(name, size))
+            return name
+
+        primary = launch(retry=False)
+        delay = self.hedge_delay(primary, size)
+        hedge_at = time.time() + delay
+        while pending:
+            now = time.time()
+            if policy is not None and (policy.cancelled or now >= policy.deadline):
+                for _, cancel, _, _ in pending.values():
+                    cancel.set()
+                policy.check()
+            # 落后于模型的上传在还有其他选择时放弃，计为一次失败
+            for future, (name, cancel, started, abandon_at) in list(pending.items()):
+                if now >= abandon_at and (len(pending) > 1 or candidates):
+                    del pending[future]
+                    cancel.set()
+                    self.record(name, False, now - started, size)
+                    self._errors[name].inc()
+                    logger.warning(f"上传到 {name} 已 {now - started:.1f} 秒，落后于预估，放弃")
+            if not pending:
+                launch()
+                hedge_at = time.time() + delay
+
+            wake = [abandon_at for _, _, _, abandon_at in pending.values()]
+            if candidates:
+                wake.append(hedge_at)
+            if policy is not None:
+                wake.append(min(policy.deadline, now + 1))  # 定期检查是否已被取消
+            timeout = max(min(wake) - time.time(), 0) if wake and min(wake) < math.inf else None
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if candidates and time.time() >= hedge_at:
+                    hedged = launch()
+                    hedge_at = time.time() + delay
+                    if hedged:
+                        logger.info(f"上传超过 {delay:.1f} 秒未完成，对冲上传到 {hedged}")
+                continue
+
+            for future in done:
+                name = pending.pop(future)[0]
+                url = future.result()
+                if url:
+                    for _, cancel, _, _ in pending.values():
+                        cancel.set()
+                    return name, url
+
+            # 失败的上传立即由下一个服务接替
+            if candidates:
+                launch()
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            return {name: stats.to_dict(now) for name, stats in self._stats.items()}
@@ -0,0 +1,113 @@
+import os
+import threading
+from typing import Dict, Any, Tuple
+import requests
+from requests.adapters import HTTPAdapter
+from config import Config
+
+
+class TimeoutSession(requests.Session):
+    """未显式指定 timeout 的请求使用默认的 (连接超时, 读取超时)
+
+    requests 会忽略 session.timeout 属性，这里在 request() 中补上，
+    同时统计请求数、失败数和超时数。
+    """
+
+    def __init__(self, name: str, timeout: Tuple[float, float]):
+        super().__init__()
+        self.name = name
+        self.default_timeout = timeout
+        self.stats = {'requests': 0, 'errors': 0, 'timeouts': 0}
+        self._stats_lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.default_timeout)
+        with self._stats_lock:
+            self.stats['requests'] += 1
+        try:
+            return super().request(method, url, **kwargs)
+        except requests.exceptions.Timeout:
+            with self._stats_lock:
+                self.stats['errors'] += 1
+                self.stats['timeouts'] += 1
+            raise
+        except requests.exceptions.RequestException:
+            with self._stats_lock:
+                self.stats['errors'] += 1
+            raise
+
+
+class HttpClient:
+    """所有外部 HTTP 调用共用的连接池
+
+    每类调用一个命名 session（各自的默认超时），session 内按主机维护
+    keep-alive 连接池，重复调用无需重新握手。session 按进程创建，
+    gunicorn fork 后不会复用父进程的连接。连接层不重试，重试统一由
+    RetryPolicy（截止时间 + 共享重试预算）在调用方决定。
+    """
+
+    def __init__(self):
+        self._profiles: Dict[str, Dict[str, Any]] = {}
+        self._sessions: Dict[str, TimeoutSession] = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def register(self, name: str, timeout: Tuple[float, float]):
+        """登记一类调用的默认超时，首次使用时才创建 session"""
+        self._profiles[name] = {'timeout': timeout}
+
+    def session(self, name: str) -> TimeoutSession:
+        with self._lock:
+            if self._pid != os.getpid():
+                self._sessions = {}
+                self._pid = os.getpid()
+            session = self._sessions.get(name)
+            if session is None:
+                profile = self._profiles[name]
+                session = TimeoutSession(name, profile['timeout'])
+                adapter = HTTPAdapter(
+                    pool_connections=Config.HTTP_POOL_HOSTS,
+                    pool_maxsize=Config.HTTP_POOL_SIZE,
+                    max_retries=0
+                )
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._sessions[name] = session
+            return session
+
+    def get_stats(self) -> Dict[str, Any]:
+        """各 session 的请求统计和按主机的连接池状态"""
+        with self._lock:
+            sessions = list(self._sessions.items())
+        stats = {}
+        for name, session in sessions:
+            with session._stats_lock:
+                entry = dict(session.stats)
+            pools = {}
+            adapter = session.get_adapter('https://')
+            for key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                pools[f'{pool.scheme}://{pool.host}:{pool.port}'] = {
+                    # 队列中未建立的连接以 None 占位
+                    'idle': sum(1 for conn in list(pool.pool.queue) if conn) if pool.pool else 0,
+                    'max_size': pool.pool.maxsize if pool.pool else 0,
+                    'connections_opened': pool.num_connections,
+                    'requests': pool.num_requests,
+                }
+            entry['pools'] = pools
+            entry['timeout'] = list(session.default_timeout)
+            stats[name] = entry
+        return stats
+
+
+# 创建单例实例
+http_client = HttpClient()
+
+# 转录请求：BibiGPT 同步返回字幕，读取超时需覆盖整段转录耗时
+http_client.register('bibigpt', timeout=(Config.HTTP_CONNECT_TIMEOUT, Config.BIBIGPT_READ_TIMEOUT))
+# 文件托管：失败后由 HostSelector 在预算内切换服务
+http_client.register('hosting', timeout=(Config.HTTP_CONNECT_TIMEOUT, Config.HOSTING_READ_TIMEOUT))
+# 飞书：由发送队列退避重试
+http_client.register('feishu', timeout=(Config.HTTP_CONNECT_TIMEOUT, Config.FEISHU_READ_TIMEOUT))
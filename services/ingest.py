@@ -0,0 +1,236 @@
+import hashlib
+import os
+import queue
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Callable, Iterator
+from loguru import logger
+from werkzeug.sansio.multipart import MultipartDecoder, File, Data, Epilogue, NEED_DATA
+from config import Config
+
+
+class IngestError(Exception):
+    """流式接收上传失败（格式错误、文件过大等）"""
+
+
+def detect_audio_format(head: bytes) -> Optional[str]:
+    """根据文件开头的魔数判断音频格式"""
+    if head.startswith(b'ID3'):
+        return 'mp3'
+    if len(head) >= 2 and head[0] == 0xFF and (head[1] & 0xE0) == 0xE0:
+        return 'mp3'  # 无 ID3 标签的 MPEG 帧同步字
+    if head[4:8] == b'ftyp':
+        return 'm4a'
+    if head.startswith(b'RIFF') and head[8:12] == b'WAVE':
+        return 'wav'
+    if head.startswith(b'OggS'):
+        return 'ogg'
+    return None
+
+
+class ChunkPipe:
+    """请求线程向外发上传线程传递数据块的有界管道
+
+    队列有界，外发上传跟不上时会对接收产生背压；外发失败后管道被关闭，
+    接收端继续落盘而不再送入数据。
+    """
+
+    _END = object()
+
+    def __init__(self, max_chunks: int):
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self.closed = False
+        self.aborted = False
+
+    def put(self, chunk: bytes):
+        if self.closed:
+            return
+        try:
+            self._queue.put(chunk, timeout=Config.INGEST_PIPE_TIMEOUT)
+        except queue.Full:
+            logger.warning("外发上传过慢，停止直通上传")
+            self.abort()
+
+    def finish(self):
+        if not self.closed:
+            self._queue.put(self._END)
+
+    def close_reader(self):
+        """外发上传结束（成功或失败）后调用，之后的 put 直接丢弃"""
+        self.closed = True
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def abort(self):
+        self.aborted = True
+        self.closed = True
+        try:
+            self._queue.put_nowait(self._END)
+        except queue.Full:
+            pass
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            chunk = self._queue.get()
+            if self.aborted:
+                raise IngestError("上传已中止")
+            if chunk is self._END:
+                return
+            yield chunk
+
+
+class StreamingIngest:
+    """按固定大小分块解析 multipart 请求体，一次写入 UPLOAD_FOLDER
+
+    绕过 Werkzeug 的临时文件和 file.save 拷贝：边读边计算 SHA-256，
+    从文件开头校验音频格式，可选地把数据块直接转发给外部文件托管服务。
+    """
+
+    def __init__(self, upload_folder: str, chunk_size: int):
+        self.upload_folder = upload_folder
+        self.chunk_size = chunk_size
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=Config.MAX_WORKERS,
+                    thread_name_prefix='passthrough'
+                )
+            return self._executor
+
+    @staticmethod
+    def _run_passthrough(passthrough: Callable[[str, Iterator[bytes]], Any],
+                         filename: str, pipe: ChunkPipe) -> Any:
+        try:
+            return passthrough(filename, pipe)
+        except Exception as e:
+            logger.error(f"直通上传失败: {str(e)}")
+            return None
+        finally:
+            pipe.close_reader()
+
+    def ingest(self, stream, boundary: bytes, field: str = 'audio',
+               passthrough: Optional[Callable[[str, Iterator[bytes]], Any]] = None
+               ) -> Dict[str, Any]:
+        """读取请求体并保存指定字段的文件
+
+        返回 filename / filepath / sha256 / size / file_type，开启直通上传时
+        额外返回 hosted（Future，结果为 passthrough 的返回值，失败时为 None）和
+        abort_hosted（中止仍在进行的直通上传，上传在下一次读取数据时失败）
+        """
+        decoder = MultipartDecoder(boundary, Config.MAX_CONTENT_LENGTH)
+        delimiter = b'\n--' + boundary
+        digest = hashlib.sha256()
+        state = {'file': None, 'head': b'', 'size': 0, 'done': False}
+        result: Dict[str, Any] = {}
+        pipe: Optional[ChunkPipe] = None
+
+        def open_target(filename: str, head: bytes):
+            file_type = detect_audio_format(head)
+            if file_type not in Config.ALLOWED_EXTENSIONS:
+                raise IngestError("文件无效或格式不支持")
+            ext = os.path.splitext(filename)[1][1:].lower()
+            if ext != file_type:
+                logger.warning(f"文件扩展名与内容不符: {filename} 实际为 {file_type}")
+            saved_name = f"{uuid.uuid4()}.{file_type}"
+            result.update({
+                'original_filename': filename,
+                'filename': saved_name,
+                'filepath': os.path.join(self.upload_folder, saved_name),
+                'file_type': file_type,
+            })
+            state['file'] = open(result['filepath'], 'wb')
+
+        def write(data: bytes):
+            nonlocal pipe
+            if not data:
+                return
+            if state['file'] is None:
+                state['head'] += data
+                if len(state['head']) < 12:
+                    return
+                data, state['head'] = state['head'], b''
+                open_target(state['filename'], data)
+                if passthrough:
+                    pipe = ChunkPipe(Config.INGEST_PIPE_CHUNKS)
+                    result['hosted'] = self._get_executor().submit(
+                        self._run_passthrough, passthrough, result['filename'], pipe)
+                    result['abort_hosted'] = pipe.abort
+            state['size'] += len(data)
+            if state['size'] > Config.MAX_CONTENT_LENGTH:
+                raise IngestError("文件过大")
+            digest.update(data)
+            state['file'].write(data)
+            if pipe:
+                pipe.put(data)
+
+        try:
+            in_field = False
+            while not state['done']:
+                chunk = stream.read(self.chunk_size)
+                try:
+                    decoder.receive_data(chunk or None)
+                except ValueError as e:
+                    raise IngestError("请求格式错误") from e
+                while True:
+                    try:
+                        event = decoder.next_event()
+                    except ValueError as e:
+                        # Werkzeug 无法继续解析：读完时说明请求体被截断，否则是格式错误
+                        raise IngestError("上传不完整" if not chunk else "请求格式错误") from e
+                    if event is NEED_DATA:
+                        break
+                    if isinstance(event, File):
+                        in_field = event.name == field and state['file'] is None and not result
+                        state['filename'] = event.filename
+                    elif isinstance(event, Data) and in_field:
+                        data = event.data
+                        if event.more_data and data.endswith(b'\r') and decoder.buffer.startswith(delimiter):
+                            # 缓冲区止于结束边界之后、换行还没收全时，Werkzeug 3.x 会把分隔符 CRLF 的 \r
+                            # 当作内容输出；其后紧跟 \n--boundary 的 \r 只能属于分隔符
+                            data = data[:-1]
+                        write(data)
+                        if not event.more_data:
+                            in_field = False
+                            if state['file'] is None and state['head']:
+                                # 文件很小，不足以凑满魔数长度
+                                head, state['head'] = state['head'], b''
+                                open_target(state['filename'], head)
+                                write(head)
+                    elif isinstance(event, Epilogue):
+                        state['done'] = True
+                        break
+                if not chunk:
+                    break
+
+            if not state['done']:
+                # 客户端断开或请求体被截断，没有读到结束边界
+                raise IngestError("上传不完整")
+            if state['file'] is None:
+                raise IngestError("没有文件")
+            state['file'].close()
+            if pipe:
+                pipe.finish()
+            result['sha256'] = digest.hexdigest()
+            result['size'] = state['size']
+            return result
+
+        except Exception:
+            if pipe:
+                pipe.abort()
+            if state['file'] is not None:
+                state['file'].close()
+                if os.path.exists(result['filepath']):
+                    os.remove(result['filepath'])
+            raise
+
+
+# 创建单例实例
+streaming_ingest = StreamingIngest(Config.UPLOAD_FOLDER, Config.INGEST_CHUNK_SIZE)
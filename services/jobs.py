@@ -0,0 +1,337 @@
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from typing import Optional, Dict, Any, List, Callable, Iterator, Deque
+from loguru import logger
+from config import Config
+from services.state import state_backend
+from services.admission import admission_controller
+from services.subtitles import LiveTrack
+
+
+class Job:
+    """一次上传对应的后台转录任务"""
+
+    # 处理阶段，按顺序推进
+    STAGES = ('queued', 'saved', 'hosted', 'transcribing', 'delivered')
+
+    def __init__(self, filename: str, client: str, handler: Callable[..., Dict[str, Any]], args: tuple):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.client = client
+        self.handler = handler
+        self.args = args
+        self.status = 'queued'  # queued / running / done / failed
+        self.stage = 'queued'
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.events: List[Dict[str, Any]] = []
+        self.transcript: Optional[LiveTrack] = None  # 转录中逐步输出的字幕行，结束后释放
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('done', 'failed')
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.id,
+            'filename': self.filename,
+            'status': self.status,
+            'stage': self.stage,
+            'result': self.result,
+            'error': self.error,
+            'created_at': round(self.created_at, 3),
+            'updated_at': round(self.updated_at, 3),
+        }
+
+
+class JobQueue:
+    """有界的后台任务队列
+
+    上传请求只负责保存文件并入队，转录流水线在固定大小的线程池中执行，
+    HTTP 线程不再被长时间占用。等待中的任务按客户端轮转出队，一个客户端
+    的批量上传不会饿死其他人；执行前需从 AdmissionController 取得部署级槽位。
+    任务快照同步写入共享状态后端，轮询和 SSE 请求落到其他 worker 上时也能查到进度。
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._dispatcher: Optional[threading.Thread] = None
+        self._jobs: Dict[str, Job] = {}
+        self._waiting: Dict[str, Deque[Job]] = {}  # 客户端 -> 等待中的任务
+        self._clients: Deque[str] = deque()  # 轮转顺序
+        self._queued = 0
+        self._running = 0
+        self._cond = threading.Condition()
+
+    def _start(self):
+        """延迟创建线程池和调度线程，避免在 gunicorn fork 之前启动线程（需持有锁）"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix='job'
+            )
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name='job-dispatcher')
+            self._dispatcher.daemon = True
+            self._dispatcher.start()
+
+    def check_admission(self, client: str, stats: Optional[Dict[str, Any]] = None):
+        """读取请求体之前预检是否会被接纳，不接纳时抛出 AdmissionRejected"""
+        with self._cond:
+            queued, client_queued = self._queued, len(self._waiting.get(client, ()))
+        admission_controller.check(queued, client_queued, stats, record=False)
+
+    def submit(self, filename: str, handler: Callable[..., Dict[str, Any]], *args,
+               client: str = 'anonymous', stats: Optional[Dict[str, Any]] = None) -> Job:
+        """提交任务，handler(job, *args) 返回任务结果；不接纳时抛出 AdmissionRejected"""
+        with self._cond:
+            admission_controller.check(self._queued, len(self._waiting.get(client, ())), stats)
+            self._prune()
+            job = Job(filename, client, handler, args)
+            self._jobs[job.id] = job
+            if client not in self._waiting:
+                self._waiting[client] = deque()
+                self._clients.append(client)
+            self._waiting[client].append(job)
+            self._queued += 1
+            # 在调度线程取走任务之前写入 queued 事件，保证事件顺序
+            self.update(job.id, 'queued', position=self._queued)
+            self._start()
+            self._cond.notify_all()
+
+        logger.info(f"任务已入队: {job.id} ({filename}, 客户端 {client})")
+        return job
+
+    def _next_job(self) -> Job:
+        """按客户端轮转取出下一个任务（需持有锁）"""
+        client = self._clients.popleft()
+        jobs = self._waiting[client]
+        job = jobs.popleft()
+        if jobs:
+            self._clients.append(client)
+        else:
+            del self._waiting[client]
+        self._queued -= 1
+        return job
+
+    def _dispatch_loop(self):
+        """调度线程：本进程有空闲线程且取得部署级槽位时启动下一个任务"""
+        while True:
+            with self._cond:
+                while not (self._queued and self._running < self.max_workers):
+                    self._cond.wait()
+
+            holder = uuid.uuid4().hex
+            try:
+                acquired = admission_controller.acquire(holder)
+            except Exception as e:
+                logger.error(f"获取执行槽位失败: {str(e)}")
+                acquired = False
+            if not acquired:
+                # 槽位被其他 worker 占用，稍后重试
+                time.sleep(Config.ADMISSION_POLL_INTERVAL)
+                continue
+
+            with self._cond:
+                job = self._next_job()
+                job.status = 'running'
+                self._running += 1
+            self._executor.submit(self._run, job, holder)
+
+    def _run(self, job: Job, holder: str):
+        start = time.time()
+        status, result, error = 'done', None, None
+        try:
+            result = job.handler(job, *job.args)
+            logger.info(f"任务完成: {job.id}")
+        except Exception as e:
+            logger.error(f"任务失败 {job.id}: {str(e)}")
+            status, error = 'failed', str(e)
+        finally:
+            # 先释放槽位再唤醒调度线程，下一个任务不必等到下一轮轮询；
+            # 释放失败时槽位租约到期后自动回收，任务照常结束
+            try:
+                admission_controller.release(holder, time.time() - start)
+            except Exception as e:
+                logger.error(f"释放执行槽位失败 {job.id}: {str(e)}")
+            self._finish(job, status, result=result, error=error)
+
+    def _finish(self, job: Job, status: str, result: Optional[Dict[str, Any]] = None,
+                error: Optional[str] = None):
+        with self._cond:
+            self._running -= 1
+            job.handler, job.args = None, ()
+            job.transcript = None
+            job.status = status
+            job.result = result
+            job.error = error
+            job.updated_at = time.time()
+            job.events.append({'event': status, 'data': job.to_dict()})
+            self._publish(job)
+            self._cond.notify_all()
+
+    def attach_transcript(self, job_id: str) -> LiveTrack:
+        """为任务创建实时字幕轨，写入的字幕行通过 SSE 的 lines 事件推送"""
+        live = LiveTrack(on_change=self._wake)
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job:
+                job.transcript = live
+        return live
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def update(self, job_id: str, stage: str, **data):
+        """推进任务阶段并通知订阅者"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if not job:
+                return
+            job.stage = stage
+            job.updated_at = time.time()
+            job.events.append({
+                'event': 'stage',
+                'data': dict(data, job_id=job_id, stage=stage, time=round(job.updated_at, 3))
+            })
+            self._publish(job)
+            self._cond.notify_all()
+
+    def _publish(self, job: Job):
+        """把任务快照和事件写入共享状态（需持有锁）"""
+        try:
+            snapshot = job.to_dict()
+            snapshot['events'] = job.events
+            state_backend.put_json(f'job:{job.id}', snapshot, ttl=Config.JOB_RETENTION)
+        except Exception as e:
+            logger.error(f"同步任务状态失败 {job.id}: {str(e)}")
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """查询任务状态，本进程没有时从共享状态读取"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job:
+                return job.to_dict()
+        snapshot = state_backend.get_json(f'job:{job_id}')
+        if snapshot:
+            snapshot.pop('events', None)
+        return snapshot
+
+    def wait_any(self, job_ids: List[str], timeout: float) -> List[Dict[str, Any]]:
+        """等待任一本进程任务结束，返回已结束任务的快照（超时返回空列表）"""
+        deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                done = [self._jobs[job_id].to_dict() for job_id in job_ids
+                        if job_id in self._jobs and self._jobs[job_id].finished]
+                remaining = deadline - time.time()
+                if done or remaining <= 0:
+                    return done
+                self._cond.wait(timeout=remaining)
+
+    def _stream_remote_events(self, job_id: str, heartbeat: float) -> Iterator[str]:
+        """任务在其他 worker 上执行时，轮询共享状态输出新事件"""
+        index = 0
+        idle = 0.0
+        while True:
+            snapshot = state_backend.get_json(f'job:{job_id}')
+            if not snapshot:
+                return
+            events = snapshot.get('events', [])
+            for event in events[index:]:
+                data = json.dumps(event['data'], ensure_ascii=False)
+                yield f"event: {event['event']}\ndata: {data}\n\n"
+            if len(events) > index:
+                index = len(events)
+                idle = 0.0
+            if snapshot['status'] in ('done', 'failed'):
+                return
+            time.sleep(Config.JOB_POLL_INTERVAL)
+            idle += Config.JOB_POLL_INTERVAL
+            if idle >= heartbeat:
+                idle = 0.0
+                yield ': keepalive\n\n'
+
+    def stream_events(self, job_id: str, heartbeat: float = 15) -> Iterator[str]:
+        """以 SSE 格式逐条输出任务事件，任务结束后停止"""
+        with self._cond:
+            local = job_id in self._jobs
+        if not local:
+            yield from self._stream_remote_events(job_id, heartbeat)
+            return
+
+        index = 0
+        sent = 0  # 已推送的字幕行数
+        transcript = None
+        while True:
+            with self._cond:
+                job = self._jobs.get(job_id)
+                if not job:
+                    return
+                # 任务结束时会释放实时字幕轨，已开始读取的连接继续持有引用读完
+                if transcript is None:
+                    transcript = job.transcript
+                idle = transcript is None or len(transcript) == sent
+                if index >= len(job.events) and not job.finished and idle:
+                    self._cond.wait(timeout=heartbeat)
+                pending = job.events[index:]
+                index += len(pending)
+                finished = job.finished
+
+            # 字幕行先于 done 事件输出
+            lines = []
+            if transcript is not None:
+                while True:
+                    start, batch = transcript.read(sent)
+                    if not batch and start == sent:
+                        break
+                    lines.append(self._lines_event(start, batch))
+                    sent = start + len(batch)
+
+            if not pending and not lines:
+                if finished:
+                    return
+                yield ': keepalive\n\n'
+                continue
+
+            yield from lines
+            for event in pending:
+                data = json.dumps(event['data'], ensure_ascii=False)
+                yield f"event: {event['event']}\ndata: {data}\n\n"
+            if finished:
+                return
+
+    @staticmethod
+    def _lines_event(start: int, lines: List[str]) -> str:
+        """from 小于已推送的行数时表示字幕轨已回退（如重试），客户端从该行起替换"""
+        data = json.dumps({'from': start, 'lines': lines}, ensure_ascii=False)
+        return f"event: lines\ndata: {data}\n\n"
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'max_workers': self.max_workers,
+                'running': self._running,
+                'queued': self._queued,
+                'waiting_clients': len(self._waiting),
+                'tracked': len(self._jobs),
+            }
+
+    def _prune(self):
+        """清理过期的已完成任务（需持有锁）"""
+        expire_before = time.time() - Config.JOB_RETENTION
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.updated_at < expire_before]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+# 创建单例实例
+job_queue = JobQueue(Config.MAX_CONCURRENT_TRANSCRIPTIONS)
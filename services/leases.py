@@ -0,0 +1,114 @@
+import hashlib
+import threading
+import time
+from typing import Optional, Dict, Any, Tuple
+import requests
+from loguru import logger
+from config import Config
+from services.http_client import http_client
+from services.state import state_backend
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(file_path: str) -> str:
+    """计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def derived_key(digest: str, params: str) -> str:
+    """派生文件（转码结果、分段）的租约键：源文件摘要加生成参数
+
+    相同源文件按相同参数生成的派生文件视为同一内容，不需要再读取派生文件计算摘要
+    """
+    return f'{digest}|{params}'
+
+
+class HostedUrlLeases:
+    """已托管文件的地址租约，以上传内容的 SHA-256（派生文件为 derived_key）为键
+
+    每次托管成功后记录 (服务名, URL)，按该服务的文件保存时间到期，保存在共享状态中，
+    所有 worker 可见。转录重试、分段重试、预托管后的转录和相同文件的再次处理
+    在租约有效期内直接复用地址，同一内容只上传一次。
+    距到期不足 HOSTED_URL_MARGIN 秒的租约不再复用；复用前先发 HEAD 请求确认文件仍可访问，
+    文件已被删除（404 / 410）时作废租约。
+    """
+
+    def __init__(self, lifetimes: Dict[str, int], margin: float, prefix: str = 'hosted:'):
+        self.lifetimes = lifetimes
+        self.margin = margin
+        self.prefix = prefix
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'stored': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def get(self, digest: str) -> Optional[Tuple[str, str]]:
+        """返回仍可复用的 (服务名, URL)，没有或已失效时返回 None"""
+        try:
+            lease = state_backend.get_json(self.prefix + digest)
+        except Exception as e:
+            logger.error(f"读取托管租约失败: {str(e)}")
+            lease = None
+        if not lease or lease['expires_at'] - time.time() < self.margin:
+            self._count('misses')
+            return None
+        status = self.check(lease['url'])
+        if status is None or status >= 400:
+            # 文件已被删除时作废租约；网络错误或服务端错误时本次不复用，但保留租约
+            if status in (404, 410):
+                logger.info(f"已托管文件已被删除: {lease['url']}")
+                self.invalidate(digest)
+            self._count('stale')
+            return None
+        self._count('hits')
+        return lease['host'], lease['url']
+
+    def put(self, digest: str, host: str, url: str):
+        """记录托管结果，未知保存时间的服务不记录"""
+        lifetime = self.lifetimes.get(host)
+        if not lifetime:
+            return
+        try:
+            state_backend.put_json(self.prefix + digest,
+                                   {'host': host, 'url': url, 'expires_at': time.time() + lifetime},
+                                   ttl=lifetime)
+            self._count('stored')
+        except Exception as e:
+            logger.error(f"写入托管租约失败: {str(e)}")
+
+    def invalidate(self, digest: str):
+        try:
+            state_backend.delete(self.prefix + digest)
+        except Exception as e:
+            logger.error(f"删除托管租约失败: {str(e)}")
+
+    @staticmethod
+    def check(url: str) -> Optional[int]:
+        """HEAD 请求检查地址，返回状态码，网络错误时返回 None"""
+        try:
+            response = http_client.session('hosting').head(
+                url, allow_redirects=True,
+                timeout=(Config.HTTP_CONNECT_TIMEOUT, Config.HOSTED_URL_CHECK_TIMEOUT)
+            )
+            return response.status_code
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"校验已托管地址失败 {url}: {str(e)}")
+            return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return self.stats.copy()
+
+
+# 创建单例实例
+hosted_leases = HostedUrlLeases(Config.HOSTED_URL_LIFETIMES, Config.HOSTED_URL_MARGIN)
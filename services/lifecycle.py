@@ -0,0 +1,121 @@
+import os
+import fcntl
+import threading
+import time
+from typing import Optional, Dict, Any, List, Callable
+from loguru import logger
+from config import Config
+
+
+class Lifecycle:
+    """gunicorn 多 worker 下的进程生命周期
+
+    - worker 任务（飞书发送队列、指标刷新等）每个进程启动一份
+    - 主机级任务（定时清理、上传目录索引）只由持有锁文件的 leader 进程运行
+
+    leader 通过对 LEADER_LOCK_PATH 加 flock 选出，进程退出时内核自动释放锁，
+    其他 worker 每 LEADER_RETRY_INTERVAL 秒重试一次即可接管。
+
+    start() 必须在 fork 之后的 worker 中调用（gunicorn 由 gunicorn.conf.py 的 post_worker_init 调用）：
+    flock 属于打开的文件，fork 之前选出的 leader（如 --preload 时的 master）会一直持有锁，
+    worker 永远无法接管，定时任务也跑在不处理请求的 master 中。fork 之后子进程丢弃继承的状态，
+    只有自己启动后才参与选举。
+    """
+
+    def __init__(self, lock_path: str):
+        self.lock_path = lock_path
+        self._worker_tasks: List[Callable[[], None]] = []
+        self._leader_tasks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None  # 已启动任务的进程
+        self._fd: Optional[int] = None  # 本进程打开的锁文件
+        self._leader = False
+        self._elected_at: Optional[float] = None
+        os.register_at_fork(before=self._before_fork, after_in_child=self._after_fork)
+
+    def _before_fork(self):
+        if self._pid == os.getpid():
+            logger.warning(f"进程 {os.getpid()} 在 fork 之前已启动生命周期任务，"
+                           f"子进程{'无法接管 leader' if self._leader else '会重新启动任务'}")
+
+    def _after_fork(self):
+        """子进程继承的锁文件描述符与父进程共享同一把锁，关闭后重新参与选举"""
+        self._lock = threading.Lock()
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = None
+        self._pid = None
+        self._leader = False
+        self._elected_at = None
+
+    def on_worker_start(self, task: Callable[[], None]):
+        """注册每个进程都要运行的启动任务"""
+        self._worker_tasks.append(task)
+
+    def on_leader(self, task: Callable[[], None]):
+        """注册只在 leader 中运行的启动任务"""
+        self._leader_tasks.append(task)
+
+    @property
+    def is_leader(self) -> bool:
+        return self._leader
+
+    def start(self):
+        """在当前进程中启动已注册的任务，同一进程重复调用无效"""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            os.makedirs(os.path.dirname(self.lock_path) or '.', exist_ok=True)
+            self._fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        for task in self._worker_tasks:
+            task()
+        if not self._try_elect():
+            thread = threading.Thread(target=self._campaign, name='leader-election')
+            thread.daemon = True
+            thread.start()
+
+    def _try_elect(self) -> bool:
+        # 只有调用过 start() 的进程参与选举
+        if self._pid != os.getpid():
+            return False
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        os.ftruncate(self._fd, 0)
+        os.pwrite(self._fd, str(os.getpid()).encode(), 0)
+        self._leader = True
+        self._elected_at = time.time()
+        logger.info(f"进程 {os.getpid()} 成为 leader，运行定时任务和资源采样")
+        for task in self._leader_tasks:
+            try:
+                task()
+            except Exception as e:
+                logger.error(f"leader 任务启动失败: {str(e)}")
+        return True
+
+    def _campaign(self):
+        """非 leader 进程定期重试加锁，leader 退出后接管"""
+        pid = os.getpid()
+        while self._pid == pid and not self._try_elect():
+            time.sleep(Config.LEADER_RETRY_INTERVAL)
+
+    def leader_pid(self) -> Optional[int]:
+        try:
+            with open(self.lock_path) as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'pid': os.getpid(),
+            'leader': self._leader,
+            'leader_pid': self.leader_pid(),
+            'elected_at': self._elected_at,
+        }
+
+
+# 创建单例实例
+lifecycle = Lifecycle(Config.LEADER_LOCK_PATH)
@@ -1,13 +1,16 @@
 import os
+import re
 from loguru import logger
 import subprocess
-from typing import Optional
+from typing import Optional, List, Tuple
 import uuid
+from config import Config
+from services.probe import probe_audio, ProbeError
+from services.storage import upload_store
 
 class MediaService:
     def __init__(self):
-        self.temp_dir = os.getenv('UPLOAD_FOLDER', '/tmp/audio_uploads')
-        os.makedirs(self.temp_dir, exist_ok=True)
+        self.temp_dir = Config.UPLOAD_FOLDER  # 目录由 upload_store 启动时创建
 
     def is_video_file(self, filename: str) -> bool:
         """检查是否是视频文件"""
@@ -52,11 +55,208 @@ class MediaService:
             logger.error(f"音频提取过程出错: {str(e)}")
             return None
 
+    def get_duration(self, audio_path: str) -> Optional[float]:
+        """获取音频时长（秒），优先只解析文件头，无法解析时使用 ffprobe"""
+        try:
+            return probe_audio(audio_path)['duration']
+        except ProbeError:
+            pass
+        try:
+            command = [
+                'ffprobe',
+                '-v', 'error',
+                '-show_entries', 'format=duration',  # 只输出容器时长
+                '-of', 'default=noprint_wrappers=1:nokey=1',
+                audio_path
+            ]
+            process = subprocess.Popen(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+            stdout, stderr = process.communicate()
+
+            if process.returncode != 0:
+                logger.error(f"获取音频时长失败: {stderr.decode()}")
+                return None
+            return float(stdout.decode().strip())
+
+        except Exception as e:
+            logger.error(f"获取音频时长出错: {str(e)}")
+            return None
+
+    def detect_silences(self, audio_path: str) -> List[Tuple[float, float]]:
+        """使用 ffmpeg silencedetect 找出低能量区间，返回 [(开始, 结束)]"""
+        command = [
+            'ffmpeg',
+            '-i', audio_path,
+            '-af', f'silencedetect=noise={Config.SEGMENT_SILENCE_DB}dB:d={Config.SEGMENT_SILENCE_DURATION}',
+            '-f', 'null',  # 只分析不输出
+            '-'
+        ]
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        stdout, stderr = process.communicate()
+
+        if process.returncode != 0:
+            logger.error(f"静音检测失败: {stderr.decode(errors='ignore')}")
+            return []
+
+        output = stderr.decode(errors='ignore')
+        starts = [float(v) for v in re.findall(r'silence_start: (-?[\d.]+)', output)]
+        ends = [float(v) for v in re.findall(r'silence_end: ([\d.]+)', output)]
+        return list(zip(starts, ends))
+
+    def find_split_points(self, audio_path: str, duration: float, segment_seconds: float) -> List[float]:
+        """在每个目标切分点附近选择最近的静音区间中点，找不到时直接在目标点切分"""
+        silences = self.detect_silences(audio_path)
+        midpoints = [(start + end) / 2 for start, end in silences]
+        points = []
+        target = segment_seconds
+        while target < duration - Config.SEGMENT_MIN_TAIL:
+            nearby = [m for m in midpoints if abs(m - target) <= Config.SEGMENT_SEARCH_WINDOW]
+            point = min(nearby, key=lambda m: abs(m - target)) if nearby else target
+            if not points or point > points[-1]:
+                points.append(point)
+            target = point + segment_seconds
+        return points
+
+    def split_audio(self, audio_path: str, points: List[float]) -> Optional[List[Tuple[str, float]]]:
+        """按切分点拆分音频（流复制，不重新编码），返回 [(分段路径, 起始偏移秒)]"""
+        ext = os.path.splitext(audio_path)[1]
+        bounds = [0.0] + points + [None]
+        segments = []
+        try:
+            # 流复制的分段总大小约等于原文件
+            upload_store.make_room(os.path.getsize(audio_path))
+            for start, end in zip(bounds, bounds[1:]):
+                segment_path = os.path.join(self.temp_dir, f"{uuid.uuid4()}{ext}")
+                command = [
+                    'ffmpeg',
+                    '-ss', f'{start:.3f}',  # 起始时间
+                    '-i', audio_path,
+                ]
+                if end is not None:
+                    command += ['-t', f'{end - start:.3f}']  # 分段时长
+                command += [
+                    '-vn',
+                    '-c', 'copy',  # 流复制
+                    '-y',
+                    segment_path
+                ]
+                process = subprocess.Popen(
+                    command,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE
+                )
+                stdout, stderr = process.communicate()
+
+                if process.returncode != 0:
+                    logger.error(f"音频分段失败: {stderr.decode(errors='ignore')}")
+                    raise Exception("ffmpeg 分段失败")
+                upload_store.add(segment_path)
+                segments.append((segment_path, start))
+
+            logger.info(f"音频已拆分为 {len(segments)} 段")
+            return segments
+
+        except Exception as e:
+            logger.error(f"音频分段过程出错: {str(e)}")
+            for segment_path, _ in segments:
+                self.cleanup_file(segment_path)
+            return None
+
+    def segment_audio(self, audio_path: str, segment_seconds: float,
+                      duration: Optional[float] = None) -> Optional[List[Tuple[str, float]]]:
+        """在静音处把长音频拆分为约 segment_seconds 的分段，不需要拆分时返回 None"""
+        duration = duration or self.get_duration(audio_path)
+        if not duration or duration <= segment_seconds + Config.SEGMENT_MIN_TAIL:
+            return None
+        try:
+            points = self.find_split_points(audio_path, duration, segment_seconds)
+        except Exception as e:
+            logger.error(f"查找切分点出错: {str(e)}")
+            return None
+        if not points:
+            return None
+        return self.split_audio(audio_path, points)
+
+    @staticmethod
+    def speech_kbps(size: int, duration: float) -> int:
+        """转码目标码率：源码率的 1/4，限制在 TRANSCODE_MIN_KBPS 到 TRANSCODE_MAX_KBPS 之间"""
+        source_kbps = size * 8 / duration / 1000
+        return int(min(Config.TRANSCODE_MAX_KBPS, max(Config.TRANSCODE_MIN_KBPS, source_kbps / 4)))
+
+    def transcode_for_speech(self, audio_path: str, duration: Optional[float] = None) -> Optional[str]:
+        """托管前转码为单声道低码率 mp3，返回新文件路径
+
+        目标码率按源码率自适应，预计节省不足 TRANSCODE_MIN_SAVING 或文件很小时返回 None，
+        调用方继续使用原文件
+        """
+        if not Config.TRANSCODE_ENABLED:
+            return None
+        size = os.path.getsize(audio_path)
+        if size < Config.TRANSCODE_MIN_BYTES:
+            return None
+        duration = duration or self.get_duration(audio_path)
+        if not duration:
+            return None
+
+        source_kbps = size * 8 / duration / 1000
+        target_kbps = self.speech_kbps(size, duration)
+        expected = target_kbps * 1000 / 8 * duration
+        if expected > size * (1 - Config.TRANSCODE_MIN_SAVING):
+            return None
+
+        output_path = os.path.join(self.temp_dir, f"{uuid.uuid4()}.mp3")
+        try:
+            upload_store.make_room(int(expected))
+            command = [
+                'ffmpeg',
+                '-i', audio_path,
+                '-vn',
+                '-map_metadata', '-1',  # 去掉封面和标签
+                '-ac', '1',  # 单声道
+                '-ar', str(Config.TRANSCODE_SAMPLE_RATE),
+                '-acodec', 'libmp3lame',
+                '-ab', f'{target_kbps}k',
+                '-y',
+                output_path
+            ]
+            process = subprocess.Popen(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+            stdout, stderr = process.communicate()
+
+            if process.returncode != 0:
+                logger.error(f"音频转码失败: {stderr.decode(errors='ignore')}")
+                self.cleanup_file(output_path)
+                return None
+
+            upload_store.add(output_path)
+            output_size = os.path.getsize(output_path)
+            if output_size > size * (1 - Config.TRANSCODE_MIN_SAVING):
+                logger.info(f"转码节省不足，使用原文件: {size} -> {output_size} 字节")
+                self.cleanup_file(output_path)
+                return None
+
+            logger.info(f"音频已转码 ({source_kbps:.0f}kbps -> {target_kbps}kbps): {size} -> {output_size} 字节")
+            return output_path
+
+        except Exception as e:
+            logger.error(f"音频转码过程出错: {str(e)}")
+            self.cleanup_file(output_path)
+            return None
+
     def cleanup_file(self, file_path: str):
         """清理临时文件"""
         try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            if upload_store.remove(file_path):
                 logger.info(f"临时文件已删除: {file_path}")
         except Exception as e:
             logger.error(f"清理文件失败 {file_path}: {str(e)}")
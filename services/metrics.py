@@ -0,0 +1,374 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left
+from typing import Optional, Dict, Any, Iterable, List, Tuple
+from loguru import logger
+from config import Config
+from services.state import state_backend
+
+STRIPES = 8  # 计数分片数，不同线程写不同分片以减少锁竞争
+SNAPSHOT_PREFIX = 'metrics:'
+RETIRED_KEY = 'metrics-retired'  # 已退出进程的累计计数，不在快照前缀下
+HOSTNAME = socket.gethostname()
+
+
+class _Stripe:
+    __slots__ = ('lock', 'counts', 'total')
+
+    def __init__(self, size: int):
+        self.lock = threading.Lock()
+        self.counts = array('Q', [0] * size)  # 预分配，记录时不再分配内存
+        self.total = array('d', [0.0])
+
+
+class Timer:
+    """计时上下文：退出时记录耗时，出现异常时累加错误计数"""
+
+    __slots__ = ('_child', '_errors', '_start')
+
+    def __init__(self, child: 'HistogramChild', errors: Optional['CounterChild']):
+        self._child = child
+        self._errors = errors
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._child.observe(time.perf_counter() - self._start)
+        if exc_type is not None and self._errors is not None:
+            self._errors.inc()
+        return False
+
+
+class HistogramChild:
+    """某一组标签值对应的固定分桶直方图"""
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self._stripes = [_Stripe(len(bounds) + 1) for _ in range(STRIPES)]
+
+    def observe(self, value: float):
+        index = bisect_left(self.bounds, value)
+        stripe = self._stripes[threading.get_ident() % STRIPES]
+        with stripe.lock:
+            stripe.counts[index] += 1
+            stripe.total[0] += value
+
+    def time(self, errors: Optional['CounterChild'] = None) -> Timer:
+        return Timer(self, errors)
+
+    def snapshot(self) -> List[float]:
+        """返回 [各分桶计数..., 总和]"""
+        counts = [0] * (len(self.bounds) + 1)
+        total = 0.0
+        for stripe in self._stripes:
+            with stripe.lock:
+                for i, n in enumerate(stripe.counts):
+                    counts[i] += n
+                total += stripe.total[0]
+        return counts + [total]
+
+
+class CounterChild:
+    """某一组标签值对应的分片计数器"""
+
+    def __init__(self):
+        self._stripes = [_Stripe(1) for _ in range(STRIPES)]
+
+    def inc(self, amount: int = 1):
+        stripe = self._stripes[threading.get_ident() % STRIPES]
+        with stripe.lock:
+            stripe.counts[0] += amount
+
+    def snapshot(self) -> List[float]:
+        total = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                total += stripe.counts[0]
+        return [total]
+
+
+class _Family(ABC):
+    """同名指标的所有标签组合"""
+
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def _new_child(self):
+        """创建一组标签值对应的子指标"""
+
+    def labels(self, *values: str):
+        """获取标签子指标；热路径上应在模块级预先绑定"""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def snapshot(self) -> Dict[str, List[float]]:
+        with self._lock:
+            children = list(self._children.items())
+        return {json.dumps(values): child.snapshot() for values, child in children}
+
+
+class Histogram(_Family):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...],
+                 buckets: Tuple[float, ...]):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> HistogramChild:
+        return HistogramChild(self.buckets)
+
+
+class Counter(_Family):
+    kind = 'counter'
+
+    def _new_child(self) -> CounterChild:
+        return CounterChild()
+
+
+class MetricsRegistry:
+    """进程内指标注册表
+
+    每个 worker 定期把快照写入共享状态，/metrics 汇总所有存活 worker 的数据，
+    无论请求落到哪个 worker，Prometheus 看到的都是整个部署的计数。
+    进程退出后，它最后一次的快照并入持久的累计值再删除，汇总出的计数不会因 worker 重启而减少。
+    """
+
+    def __init__(self):
+        self._families: Dict[str, _Family] = {}
+        self._flusher: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._instance: Optional[Tuple[int, str]] = None
+
+    def histogram(self, name: str, help_text: str, label_names=(), buckets=None) -> Histogram:
+        family = Histogram(name, help_text, tuple(label_names), tuple(buckets or Config.METRICS_BUCKETS))
+        self._families[name] = family
+        return family
+
+    def counter(self, name: str, help_text: str, label_names=()) -> Counter:
+        family = Counter(name, help_text, tuple(label_names))
+        self._families[name] = family
+        return family
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            name: {
+                'kind': family.kind,
+                'help': family.help,
+                'labels': list(family.label_names),
+                'buckets': list(getattr(family, 'buckets', ())),
+                'series': family.snapshot(),
+            }
+            for name, family in self._families.items()
+        }
+
+    def _key(self) -> str:
+        # fork 后重新生成；键中带随机后缀，pid 被新进程复用时不会覆盖已退出进程的快照
+        pid = os.getpid()
+        if self._instance is None or self._instance[0] != pid:
+            self._instance = (pid, f'{SNAPSHOT_PREFIX}{HOSTNAME}:{pid}:{uuid.uuid4().hex[:8]}')
+        return self._instance[1]
+
+    def flush(self):
+        """把本进程快照写入共享状态"""
+        try:
+            state_backend.put_json(self._key(), {
+                'host': HOSTNAME,
+                'pid': os.getpid(),
+                'flushed_at': time.time(),
+                'families': self.snapshot()
+            }, ttl=Config.METRICS_SNAPSHOT_TTL)
+        except Exception as e:
+            logger.error(f"写入指标快照失败: {str(e)}")
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(Config.METRICS_FLUSH_INTERVAL)
+            self.flush()
+            # 没有抓取请求时也及时回收已退出进程的快照
+            try:
+                self._collect()
+            except Exception as e:
+                logger.error(f"回收指标快照失败: {str(e)}")
+
+    def start_flushing(self):
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._flush_loop, name='metrics-flush')
+                self._flusher.daemon = True
+                self._flusher.start()
+
+    @staticmethod
+    def _alive(snapshot: Dict[str, Any], now: float) -> bool:
+        """本机进程按 pid 判断；其他节点的进程无法探测，按快照是否长时间未更新判断"""
+        if snapshot['host'] != HOSTNAME:
+            return now - snapshot['flushed_at'] < Config.METRICS_RETIRE_AFTER
+        try:
+            os.kill(snapshot['pid'], 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _retire(self, dead: Dict[str, Any], present: Iterable[str] = ()) -> Dict[str, Any]:
+        """把已退出进程的快照并入累计值，然后删除快照
+
+        并入和记录已并入的键在同一次原子更新中完成，多个 worker 同时回收时每份快照只计一次。
+        已并入的记录保存快照的 flushed_at 和计数：其他节点上只是暂时失联的进程恢复后会在
+        同一个键下继续写入，只有更新的快照才计入，且只计入超出已并入部分的增量。
+        记录保留到快照本身过期之后，仍有快照（present）的键一直保留。
+        """
+        now = time.time()
+        present = set(present)
+
+        def fold(retired):
+            retired = retired or {'families': {}, 'folded': {}}
+            folded = {key: entry for key, entry in retired['folded'].items()
+                      if key in present or now - entry['at'] < Config.METRICS_SNAPSHOT_TTL}
+            for key, snapshot in dead.items():
+                entry = folded.get(key)
+                if entry and snapshot['flushed_at'] <= entry['flushed_at']:
+                    continue
+                _accumulate(retired['families'], _subtract(snapshot['families'], entry['families'] if entry else {}))
+                folded[key] = {'at': now, 'flushed_at': snapshot['flushed_at'], 'families': snapshot['families']}
+            retired['folded'] = folded
+            return retired
+
+        retired = state_backend.update_json(RETIRED_KEY, fold)
+        for key in dead:
+            state_backend.delete(key)
+        logger.info(f"已并入退出进程的指标快照: {len(dead)} 个")
+        return retired
+
+    def _collect(self) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """返回 (存活进程的快照, 累计值)，顺带回收已退出进程的快照
+
+        曾被并入的键再次出现时，快照中的计数只保留尚未并入的增量
+        """
+        now = time.time()
+        snapshots = state_backend.get_json_prefix(SNAPSHOT_PREFIX)
+        dead = {key: snapshot for key, snapshot in snapshots.items() if not self._alive(snapshot, now)}
+        retired = None
+        if dead:
+            try:
+                retired = self._retire(dead, snapshots)
+            except Exception as e:
+                # 本次仍按存活进程计入，不会重复计数
+                logger.error(f"合并已退出进程的指标失败: {str(e)}")
+        if retired is None:
+            retired = state_backend.get_json(RETIRED_KEY) or {'families': {}, 'folded': {}}
+        live = {}
+        for key, snapshot in snapshots.items():
+            entry = retired['folded'].get(key)
+            if entry is None:
+                live[key] = snapshot
+            elif snapshot['flushed_at'] > entry['flushed_at']:
+                live[key] = dict(snapshot, families=_subtract(snapshot['families'], entry['families']))
+        return live, retired
+
+    def _merged(self) -> Dict[str, Any]:
+        """汇总累计值和所有存活 worker 的快照，按标签逐项相加"""
+        self.flush()
+        live, retired = self._collect()
+        merged: Dict[str, Any] = {}
+        _accumulate(merged, retired['families'])
+        for snapshot in live.values():
+            _accumulate(merged, snapshot['families'])
+        return merged
+
+    def render(self) -> str:
+        """输出 Prometheus 文本格式"""
+        lines = []
+        for name, family in sorted(self._merged().items()):
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['kind']}")
+            for key, values in sorted(family['series'].items()):
+                labels = list(zip(family['labels'], json.loads(key)))
+                if family['kind'] == 'counter':
+                    lines.append(f"{name}{_format_labels(labels)} {values[0]:g}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(family['buckets'] + ['+Inf'], values[:-1]):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else f'{bound:g}'
+                    lines.append(f"{name}_bucket{_format_labels(labels + [('le', le)])} {cumulative:g}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {values[-1]:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative:g}")
+        return '\n'.join(lines) + '\n'
+
+
+def _accumulate(target: Dict[str, Any], families: Dict[str, Any]):
+    """把一份快照的各指标按标签逐项加到 target 上"""
+    for name, family in families.items():
+        merged = target.setdefault(name, dict(family, series={}))
+        for key, values in family['series'].items():
+            current = merged['series'].get(key)
+            merged['series'][key] = values if current is None else [
+                a + b for a, b in zip(current, values)
+            ]
+
+
+def _subtract(families: Dict[str, Any], base: Dict[str, Any]) -> Dict[str, Any]:
+    """返回 families 相对 base 的增量，base 中没有的指标和标签原样保留"""
+    delta = {}
+    for name, family in families.items():
+        base_series = base.get(name, {}).get('series', {})
+        series = {}
+        for key, values in family['series'].items():
+            previous = base_series.get(key)
+            series[key] = values if previous is None else [a - b for a, b in zip(values, previous)]
+        delta[name] = dict(family, series=series)
+    return delta
+
+
+def _format_labels(labels: List[Tuple[str, str]]) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(f'{k}="{_escape(str(v))}"' for k, v in labels)
+    return '{' + pairs + '}'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# 创建单例实例
+metrics = MetricsRegistry()
+
+# 流水线各阶段耗时
+stage_latency = metrics.histogram(
+    'voice_stage_seconds', '上传流水线各阶段耗时', ['stage'])
+stage_errors = metrics.counter(
+    'voice_stage_errors_total', '上传流水线各阶段错误数', ['stage'])
+
+# 每次文件托管上传尝试
+host_upload_latency = metrics.histogram(
+    'voice_host_upload_seconds', '单次文件托管上传耗时', ['host'])
+host_upload_errors = metrics.counter(
+    'voice_host_upload_errors_total', '文件托管上传失败数', ['host'])
+
+# 飞书消息发送（无标签，直接绑定唯一的子指标）
+feishu_send_latency = metrics.histogram(
+    'voice_feishu_send_seconds', '飞书消息发送耗时').labels()
+feishu_send_errors = metrics.counter(
+    'voice_feishu_send_errors_total', '飞书消息发送失败数').labels()
@@ -3,7 +3,7 @@ import sys
 import psutil
 import time
 from loguru import logger
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 import threading
 
 # 添加项目根目录到 Python 路径
@@ -11,28 +11,37 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, project_root)
 
 from config import Config
+from services.state import state_backend
+from services.history import resource_history
+from services.storage import upload_store
+from services.lifecycle import lifecycle
+
+# leader 发布的最新采样
+SAMPLE_KEY = 'monitor:sample'
+HISTORY_FIELDS = ('cpu_percent', 'memory_percent', 'disk_usage', 'processing_count')
 
 class SystemMonitor:
     def __init__(self):
         self.start_time = time.time()
         self._monitoring = False
         self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
         self.stats = {
             'cpu_percent': 0,
             'memory_percent': 0,
             'memory_used': 0,
-            'disk_usage': 0,
-            'processing_count': 0
+            'disk_usage': 0
         }
+        self._sampled_at = 0.0
         
     def start_monitoring(self):
-        """开始监控系统资源"""
+        """开始监控系统资源：leader 采样并发布，其他 worker 读取发布的采样"""
         with self._lock:
-            if not self._monitoring:
+            if self._thread is None or not self._thread.is_alive():
                 self._monitoring = True
-                thread = threading.Thread(target=self._monitor_resources)
-                thread.daemon = True
-                thread.start()
+                self._thread = threading.Thread(target=self._monitor_resources)
+                self._thread.daemon = True
+                self._thread.start()
                 logger.info("系统资源监控已启动")
 
     def stop_monitoring(self):
@@ -40,59 +49,91 @@ class SystemMonitor:
         with self._lock:
             self._monitoring = False
 
+    def _sample(self) -> Dict[str, Any]:
+        """采样本机资源，只在 leader 中调用"""
+        # CPU 使用率：与上次采样之间的平均值，不阻塞
+        cpu_percent = psutil.cpu_percent(interval=None)
+        
+        # 内存使用情况
+        memory = psutil.virtual_memory()
+        
+        # 磁盘使用情况
+        disk = psutil.disk_usage(Config.UPLOAD_FOLDER)
+        
+        return {
+            'time': time.time(),
+            'cpu_percent': cpu_percent,
+            'memory_percent': memory.percent,
+            'memory_used': round(memory.used / (1024 * 1024), 2),  # MB
+            'disk_usage': disk.percent,
+            'processing_count': state_backend.get_counter('processing_count')
+        }
+
+    def _apply(self, sample: Dict[str, Any]):
+        """更新当前状态并写入本进程的资源历史"""
+        upload_store.relieve(sample['disk_usage'])
+        with self._lock:
+            self._sampled_at = sample['time']
+            self.stats.update({key: sample[key] for key in self.stats})
+        resource_history.add(sample['time'], {key: sample[key] for key in HISTORY_FIELDS})
+
     def _monitor_resources(self):
-        """持续监控系统资源"""
+        """持续监控系统资源
+
+        同一主机只有 leader 调用 psutil 采样并写入共享状态，其他 worker 只读取
+        最新采样，所有进程看到相同的状态和资源历史；leader 切换后新 leader 接着采样。
+        """
+        sampling = False
         while self._monitoring:
+            time.sleep(Config.MONITOR_INTERVAL)
             try:
-                # CPU 使用率
-                cpu_percent = psutil.cpu_percent(interval=1)
-                
-                # 内存使用情况
-                memory = psutil.virtual_memory()
-                memory_percent = memory.percent
-                memory_used = memory.used / (1024 * 1024)  # MB
-                
-                # 磁盘使用情况
-                disk = psutil.disk_usage(Config.UPLOAD_FOLDER)
-                disk_percent = disk.percent
-
-                with self._lock:
-                    self.stats.update({
-                        'cpu_percent': cpu_percent,
-                        'memory_percent': memory_percent,
-                        'memory_used': round(memory_used, 2),
-                        'disk_usage': disk_percent
-                    })
-
-                # 检查是否超过资源限制
-                if cpu_percent > 80 or memory_percent > 80:
-                    logger.warning(f"系统资源使用率过高: CPU {cpu_percent}%, 内存 {memory_percent}%")
+                if lifecycle.is_leader:
+                    if not sampling:
+                        psutil.cpu_percent(interval=None)  # 首次调用只建立基准，返回值无意义
+                        sampling = True
+                        continue
+                    sample = self._sample()
+                    state_backend.put_json(SAMPLE_KEY, sample, ttl=Config.MONITOR_INTERVAL * 5)
+
+                    # 检查是否超过资源限制
+                    if sample['cpu_percent'] > 80 or sample['memory_percent'] > 80:
+                        logger.warning(f"系统资源使用率过高: CPU {sample['cpu_percent']}%, "
+                                       f"内存 {sample['memory_percent']}%")
+                else:
+                    sample = state_backend.get_json(SAMPLE_KEY)
+                    if not sample or sample['time'] <= self._sampled_at:
+                        continue
+                self._apply(sample)
 
             except Exception as e:
                 logger.error(f"监控资源时出错: {str(e)}")
-            
-            time.sleep(2)  # 每2秒更新一次
 
     def get_stats(self) -> Dict[str, Any]:
         """获取当前系统状态"""
         with self._lock:
             stats = self.stats.copy()
         
+        # 处理计数保存在共享状态中，所有 worker 看到的是同一个值
+        stats['processing_count'] = state_backend.get_counter('processing_count')
+        
         # 添加运行时间
         uptime = time.time() - self.start_time
         stats['uptime'] = round(uptime, 2)
         
         return stats
 
+    def get_history(self, window: int, resolution: Optional[int] = None) -> Dict[str, Any]:
+        """获取最近 window 秒的资源历史，resolution 为汇总粒度（秒）"""
+        resolution = resource_history.pick_resolution(window, resolution)
+        return resource_history.query(window, resolution, time.time())
+
     def increment_processing_count(self):
         """增加处理计数"""
-        with self._lock:
-            self.stats['processing_count'] += 1
+        state_backend.incr('processing_count', 1)
 
     def decrement_processing_count(self):
         """减少处理计数"""
-        with self._lock:
-            self.stats['processing_count'] = max(0, self.stats['processing_count'] - 1)
+        state_backend.incr('processing_count', -1, floor=0)
 
 # 创建单例实例
 system_monitor = SystemMonitor()
@@ -104,6 +145,7 @@ if __name__ == '__main__':
     
     try:
         print("开始系统监控测试...")
+        lifecycle.start()
         system_monitor.start_monitoring()
         
         # 持续显示系统状态
@@ -0,0 +1,311 @@
+import os
+import struct
+from typing import Optional, Dict, Any, BinaryIO, Iterator, Tuple
+from services.ingest import detect_audio_format
+
+
+class ProbeError(Exception):
+    """音频文件无法解析（损坏、不完整或内容与扩展名不符）"""
+
+
+# MPEG 音频帧头各字段的取值表，索引为 (版本, 层)
+MP3_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MP3_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 2.5: (11025, 12000, 8000)}
+MP3_SYNC_SEARCH = 64 * 1024  # ID3 标签之后寻找首个帧同步字的范围
+MP3_SCAN_BYTES = 256 * 1024  # 没有 Xing/VBRI 头时扫描的范围，据此估算平均码率
+OGG_TAIL_BYTES = 64 * 1024  # 最后一页必然落在文件末尾的这个范围内
+WAV_FORMATS = {1: 'pcm', 3: 'pcm_float', 6: 'alaw', 7: 'mulaw', 0x11: 'adpcm', 0x55: 'mp3', 0xFFFE: 'pcm'}
+MP4_AUDIO_CODECS = {b'mp4a': 'aac', b'alac': 'alac', b'Opus': 'opus', b'fLaC': 'flac', b'ac-3': 'ac3',
+                    b'ec-3': 'eac3', b'.mp3': 'mp3'}
+
+
+def _parse_mp3_header(header: bytes) -> Optional[Dict[str, Any]]:
+    """解析 4 字节帧头，不是有效帧头时返回 None"""
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+    version = {3: 1, 2: 2, 0: 2.5}.get((header[1] >> 3) & 0x03)
+    layer = {3: 1, 2: 2, 1: 3}.get((header[1] >> 1) & 0x03)
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x03
+    if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+    padding = (header[2] >> 1) & 0x01
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if layer == 2 or version == 1 else 576
+        length = samples // 8 * bitrate // sample_rate + padding
+    return {
+        'version': version,
+        'layer': layer,
+        'bitrate': bitrate,
+        'sample_rate': sample_rate,
+        'channels': 1 if (header[3] >> 6) == 3 else 2,
+        'samples': samples,
+        'length': length,
+    }
+
+
+def _probe_mp3(f: BinaryIO, size: int) -> Dict[str, Any]:
+    start = 0
+    head = f.read(10)
+    if head.startswith(b'ID3') and len(head) == 10:
+        # ID3v2 标签长度为 syncsafe 整数，另加 10 字节头和可选的 10 字节尾
+        tag_size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+        start = 10 + tag_size + (10 if head[5] & 0x10 else 0)
+    end = size
+    if size >= 128:
+        f.seek(size - 128)
+        if f.read(3) == b'TAG':
+            end = size - 128  # ID3v1 标签
+
+    f.seek(start)
+    data = f.read(MP3_SCAN_BYTES)
+    # 找到首个后面紧跟有效帧的同步字，排除数据中偶然出现的 0xFFE
+    offset = -1
+    frame = None
+    position = data.find(b'\xff')
+    while 0 <= position < MP3_SYNC_SEARCH:
+        frame = _parse_mp3_header(data[position:position + 4])
+        if frame:
+            following = position + frame['length']
+            if following >= min(len(data), end - start) or _parse_mp3_header(data[following:following + 4]):
+                offset = position
+                break
+        position = data.find(b'\xff', position + 1)
+    if offset < 0:
+        raise ProbeError("未找到有效的 MP3 音频帧")
+
+    info = {
+        'codec': 'mp3',
+        'sample_rate': frame['sample_rate'],
+        'channels': frame['channels'],
+    }
+    # Xing/Info 头位于首帧的边信息之后，VBRI 头固定在帧头后 32 字节
+    side_info = (32 if frame['channels'] == 2 else 17) if frame['version'] == 1 else \
+        (17 if frame['channels'] == 2 else 9)
+    xing = offset + 4 + side_info
+    frames = None
+    if data[xing:xing + 4] in (b'Xing', b'Info'):
+        flags = struct.unpack('>I', data[xing + 4:xing + 8])[0]
+        if flags & 0x01:
+            frames = struct.unpack('>I', data[xing + 8:xing + 12])[0]
+    elif data[offset + 36:offset + 40] == b'VBRI':
+        frames = struct.unpack('>I', data[offset + 50:offset + 54])[0]
+    if frames:
+        info['duration'] = frames * frame['samples'] / frame['sample_rate']
+        info['bitrate'] = int((end - start - offset) * 8 / info['duration']) if info['duration'] else 0
+        return info
+
+    # 没有 VBR 头：扫描开头的帧，按平均码率估算（CBR 文件即为精确值）
+    position = offset
+    scanned_frames = 0
+    scanned_bytes = 0
+    while position + 4 <= len(data):
+        current = _parse_mp3_header(data[position:position + 4])
+        if not current:
+            break
+        scanned_frames += 1
+        scanned_bytes += current['length']
+        position += current['length']
+    if scanned_frames < 2 and end - start - offset > 2 * frame['length']:
+        raise ProbeError("MP3 音频帧不连续，文件可能已损坏")
+    seconds_per_byte = scanned_frames * frame['samples'] / frame['sample_rate'] / scanned_bytes
+    info['duration'] = (end - start - offset) * seconds_per_byte
+    info['bitrate'] = int(8 / seconds_per_byte)
+    return info
+
+
+def _probe_wav(f: BinaryIO, size: int) -> Dict[str, Any]:
+    f.seek(12)
+    fmt = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            raise ProbeError("WAV 文件缺少 data 块")
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk)
+        if chunk_id == b'fmt ':
+            fmt = f.read(min(chunk_size, 40))
+            if len(fmt) < 16:
+                raise ProbeError("WAV fmt 块不完整")
+            f.seek(chunk_size - len(fmt) + (chunk_size & 1), os.SEEK_CUR)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ProbeError("WAV 文件缺少 fmt 块")
+            # 流式写入的文件 data 长度可能未回填
+            data_size = min(chunk_size, size - f.tell()) if chunk_size else size - f.tell()
+            break
+        else:
+            f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+    format_tag, channels, sample_rate, byte_rate = struct.unpack('<HHII', fmt[:12])
+    if not channels or not sample_rate or not byte_rate:
+        raise ProbeError("WAV fmt 块参数无效")
+    return {
+        'codec': WAV_FORMATS.get(format_tag, f'wav_0x{format_tag:04x}'),
+        'duration': data_size / byte_rate,
+        'sample_rate': sample_rate,
+        'channels': channels,
+        'bitrate': byte_rate * 8,
+    }
+
+
+def _probe_ogg(f: BinaryIO, size: int) -> Dict[str, Any]:
+    header = f.read(27)
+    if len(header) < 27 or header[:4] != b'OggS':
+        raise ProbeError("OGG 页头无效")
+    serial = header[14:18]
+    segments = f.read(header[26])
+    packet = f.read(min(sum(segments), 64))
+
+    pre_skip = 0
+    if packet.startswith(b'\x01vorbis') and len(packet) >= 16:
+        codec = 'vorbis'
+        channels = packet[11]
+        sample_rate = struct.unpack('<I', packet[12:16])[0]
+        granule_rate = sample_rate
+    elif packet.startswith(b'OpusHead') and len(packet) >= 16:
+        codec = 'opus'
+        channels = packet[9]
+        pre_skip = struct.unpack('<H', packet[10:12])[0]
+        sample_rate = struct.unpack('<I', packet[12:16])[0] or 48000
+        granule_rate = 48000  # Opus 的 granule 始终以 48kHz 计
+    elif packet.startswith(b'\x7fFLAC') and len(packet) >= 33:
+        codec = 'flac'
+        # STREAMINFO 中采样率占 20 位，其后 3 位为声道数减一
+        bits = int.from_bytes(packet[27:30], 'big')
+        sample_rate = bits >> 4
+        channels = ((bits >> 1) & 0x07) + 1
+        granule_rate = sample_rate
+    else:
+        raise ProbeError("不支持的 OGG 编码")
+    if not sample_rate:
+        raise ProbeError("OGG 采样率无效")
+
+    # 最后一页的 granule position 即总采样数
+    f.seek(max(0, size - OGG_TAIL_BYTES))
+    tail = f.read()
+    position = tail.rfind(b'OggS')
+    granule = None
+    while position >= 0:
+        page = tail[position:position + 27]
+        if len(page) == 27 and page[14:18] == serial:
+            granule = struct.unpack('<q', page[6:14])[0]
+            if granule >= 0:
+                break
+        position = tail.rfind(b'OggS', 0, position)
+    if granule is None or granule < 0:
+        raise ProbeError("OGG 文件不完整，找不到结束页")
+    duration = max(0, granule - pre_skip) / granule_rate
+    return {
+        'codec': codec,
+        'duration': duration,
+        'sample_rate': sample_rate,
+        'channels': channels,
+        'bitrate': int(size * 8 / duration) if duration else 0,
+    }
+
+
+def _boxes(f: BinaryIO, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """遍历 [start, end) 内的 MP4 box，返回 (类型, 内容起点, 内容终点)，只读取 box 头"""
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        box_size, box_type = struct.unpack('>I4s', header)
+        payload = position + 8
+        if box_size == 1:
+            box_size = struct.unpack('>Q', f.read(8))[0]
+            payload += 8
+        elif box_size == 0:
+            box_size = end - position
+        if box_size < payload - position or position + box_size > end:
+            raise ProbeError("MP4 box 长度无效，文件可能不完整")
+        yield box_type, payload, position + box_size
+        position += box_size
+
+
+def _find_box(f: BinaryIO, start: int, end: int, path: Tuple[bytes, ...]) -> Optional[Tuple[int, int]]:
+    for box_type, payload, box_end in _boxes(f, start, end):
+        if box_type == path[0]:
+            return (payload, box_end) if len(path) == 1 else _find_box(f, payload, box_end, path[1:])
+    return None
+
+
+def _probe_m4a(f: BinaryIO, size: int) -> Dict[str, Any]:
+    moov = _find_box(f, 0, size, (b'moov',))
+    if moov is None:
+        raise ProbeError("M4A 文件缺少 moov，文件可能不完整")
+    mvhd = _find_box(f, moov[0], moov[1], (b'mvhd',))
+    if mvhd is None:
+        raise ProbeError("M4A 文件缺少 mvhd")
+    f.seek(mvhd[0])
+    data = f.read(32)
+    if data[0] == 1:
+        timescale, duration = struct.unpack('>IQ', data[20:32])
+    else:
+        timescale, duration = struct.unpack('>II', data[12:20])
+    if not timescale:
+        raise ProbeError("M4A 时间刻度无效")
+    info = {'codec': None, 'duration': duration / timescale, 'sample_rate': None, 'channels': None}
+
+    # 第一条音轨的采样描述：格式、声道数、采样率（16.16 定点数）
+    for box_type, payload, box_end in _boxes(f, moov[0], moov[1]):
+        if box_type != b'trak':
+            continue
+        stsd = _find_box(f, payload, box_end, (b'mdia', b'minf', b'stbl', b'stsd'))
+        if stsd is None:
+            continue
+        f.seek(stsd[0] + 8)
+        entry = f.read(36)
+        if len(entry) < 36 or entry[4:8] not in MP4_AUDIO_CODECS:
+            continue
+        info['codec'] = MP4_AUDIO_CODECS[entry[4:8]]
+        info['channels'] = struct.unpack('>H', entry[24:26])[0]
+        info['sample_rate'] = struct.unpack('>I', entry[32:36])[0] >> 16
+        break
+    if info['codec'] is None:
+        raise ProbeError("M4A 文件中没有音轨")
+    info['bitrate'] = int(size * 8 / info['duration']) if info['duration'] else 0
+    return info
+
+
+PROBES = {'mp3': _probe_mp3, 'wav': _probe_wav, 'ogg': _probe_ogg, 'm4a': _probe_m4a}
+
+
+def probe_audio(file_path: str) -> Dict[str, Any]:
+    """只读取容器头部，返回 format / codec / duration（秒）/ sample_rate / channels / bitrate
+
+    不调用 ffmpeg，也不读取整个文件。文件损坏、不完整、时长为 0，
+    或内容与扩展名不符时抛出 ProbeError。
+    """
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        file_type = detect_audio_format(f.read(12))
+        if file_type not in PROBES:
+            raise ProbeError("无法识别的音频格式")
+        ext = os.path.splitext(file_path)[1][1:].lower()
+        if ext in PROBES and ext != file_type:
+            raise ProbeError(f"文件内容为 {file_type}，与扩展名 {ext} 不符")
+        f.seek(0)
+        try:
+            info = PROBES[file_type](f, size)
+        except (struct.error, IndexError, ZeroDivisionError):
+            raise ProbeError("音频文件头不完整")
+    if not info['duration'] or info['duration'] <= 0:
+        raise ProbeError("音频时长为 0")
+    info['format'] = file_type
+    info['duration'] = round(info['duration'], 3)
+    return info
@@ -0,0 +1,122 @@
+import random
+import threading
+import time
+from typing import Optional, Dict, Any
+from loguru import logger
+from config import Config
+from services.state import state_backend
+
+
+class DeadlineExceeded(Exception):
+    """请求已超过截止时间或已被取消，不再重试"""
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """第 attempt 次重试（从 1 开始）前的等待时间：指数增长，在 0 到上限之间均匀抖动"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class RetryBudget:
+    """整个部署共享的重试预算
+
+    令牌桶保存在共享状态中，每秒补充 RETRY_BUDGET_RATE 个，最多积累 RETRY_BUDGET_BURST 个。
+    每次重试（包括换用下一个托管服务和对冲上传）消耗一个令牌，外部服务故障时
+    所有 worker 的重试总速率有上限，层层重试不会把负载放大。
+    """
+
+    def __init__(self, key: str, rate: float, capacity: int):
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity
+        self.stats = {'granted': 0, 'denied': 0}
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        try:
+            granted = state_backend.take_token(self.key, self.rate, self.capacity) == 0
+        except Exception as e:
+            # 共享状态不可用时不阻止重试，仍受截止时间和次数限制
+            logger.error(f"读取重试预算失败: {str(e)}")
+            granted = True
+        with self._lock:
+            self.stats['granted' if granted else 'denied'] += 1
+        return granted
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = self.stats.copy()
+        stats['rate'] = self.rate
+        stats['capacity'] = self.capacity
+        return stats
+
+
+class RetryPolicy:
+    """一次请求的重试策略，贯穿托管、转录等每次外部调用
+
+    - 截止时间：每次调用的超时不超过剩余时间，过期后抛出 DeadlineExceeded
+    - 最多 max_attempts 次尝试，重试前按抖动指数退避等待
+    - 每次重试先从共享预算取令牌，取不到时直接失败
+    - cancel() 后等待立即结束，共用取消事件的子策略（如并行的分段）一起停止
+    """
+
+    def __init__(self, timeout: float, max_attempts: int = Config.MAX_RETRIES + 1,
+                 budget: Optional[RetryBudget] = None, deadline: Optional[float] = None,
+                 cancel_event: Optional[threading.Event] = None):
+        self.deadline = deadline if deadline is not None else time.time() + timeout
+        self.max_attempts = max_attempts
+        self.budget = budget or retry_budget
+        self.cancel_event = cancel_event or threading.Event()
+        self.failures = 0
+
+    def child(self, max_attempts: Optional[int] = None) -> 'RetryPolicy':
+        """共用截止时间、预算和取消事件，单独计算尝试次数"""
+        return RetryPolicy(0, max_attempts or self.max_attempts, self.budget,
+                           self.deadline, self.cancel_event)
+
+    def remaining(self) -> float:
+        return max(self.deadline - time.time(), 0.0)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def check(self):
+        """已取消或超过截止时间时抛出 DeadlineExceeded"""
+        if self.cancelled:
+            raise DeadlineExceeded("请求已取消")
+        if self.remaining() <= 0:
+            self.cancel()
+            raise DeadlineExceeded("处理超过截止时间")
+
+    def timeout(self, read_timeout: float) -> float:
+        """本次调用的读取超时，不超过剩余时间"""
+        self.check()
+        return min(read_timeout, self.remaining())
+
+    def allow_retry(self) -> bool:
+        """不等待地再尝试一次（如换用下一个托管服务）前调用，消耗一个预算令牌"""
+        if self.cancelled or self.remaining() <= 0:
+            return False
+        if not self.budget.try_acquire():
+            logger.warning("重试预算已用完，不再重试")
+            return False
+        return True
+
+    def retry(self, error: Exception) -> bool:
+        """一次尝试失败后调用：次数、截止时间和预算都允许时退避等待并返回 True"""
+        self.failures += 1
+        if self.failures >= self.max_attempts:
+            return False
+        delay = backoff_delay(self.failures, Config.RETRY_DELAY, Config.RETRY_MAX_DELAY)
+        if delay >= self.remaining() or not self.allow_retry():
+            return False
+        logger.info(f"{delay:.1f} 秒后重试 ({self.failures}/{self.max_attempts - 1}): {str(error)}")
+        self.cancel_event.wait(delay)
+        return not self.cancelled
+
+
+# 创建单例实例
+retry_budget = RetryBudget('retry_budget', Config.RETRY_BUDGET_RATE, Config.RETRY_BUDGET_BURST)
@@ -0,0 +1,56 @@
+import hashlib
+import hmac
+import os
+import time
+from typing import Optional
+from urllib.parse import urlencode
+from config import Config
+
+
+class UrlSigner:
+    """为 /audio/<filename> 生成和校验短期有效的 HMAC 签名 URL
+
+    服务器可公网访问时，BibiGPT 直接从本机拉取音频，不必先上传到第三方托管服务。
+    """
+
+    def __init__(self, secret_key: str, public_base_url: str, ttl: int):
+        self.secret_key = secret_key.encode('utf-8')
+        self.public_base_url = public_base_url.rstrip('/')
+        self.ttl = ttl
+
+    @property
+    def enabled(self) -> bool:
+        return Config.SELF_HOST_ENABLED and bool(self.secret_key and self.public_base_url)
+
+    def _signature(self, filename: str, expires: int) -> str:
+        message = f"{filename}:{expires}".encode('utf-8')
+        return hmac.new(self.secret_key, message, hashlib.sha256).hexdigest()
+
+    def can_serve(self, file_path: str) -> bool:
+        """文件位于 UPLOAD_FOLDER 下且已启用自托管"""
+        if not self.enabled:
+            return False
+        folder = os.path.abspath(Config.UPLOAD_FOLDER)
+        return os.path.dirname(os.path.abspath(file_path)) == folder
+
+    def sign(self, filename: str, ttl: Optional[int] = None) -> str:
+        """生成带过期时间和签名的公网访问 URL"""
+        expires = int(time.time()) + (ttl or self.ttl)
+        query = urlencode({'expires': expires, 'signature': self._signature(filename, expires)})
+        return f"{self.public_base_url}/audio/{filename}?{query}"
+
+    def verify(self, filename: str, expires: Optional[str], signature: Optional[str]) -> bool:
+        """校验签名，拒绝未签名、签名错误或已过期的请求"""
+        if not self.secret_key or not expires or not signature:
+            return False
+        try:
+            expires_at = int(expires)
+        except ValueError:
+            return False
+        if expires_at < time.time():
+            return False
+        return hmac.compare_digest(self._signature(filename, expires_at), signature)
+
+
+# 创建单例实例
+url_signer = UrlSigner(Config.SECRET_KEY, Config.PUBLIC_BASE_URL, Config.SIGNED_URL_TTL)
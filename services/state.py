@@ -0,0 +1,373 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Optional, Dict, Any, Tuple, List, Callable
+from loguru import logger
+from config import Config
+
+
+class StateBackend(ABC):
+    """跨 gunicorn worker / 节点共享的状态后端接口
+
+    保存并发计数、限速令牌桶和任务状态，所有操作都是原子的，
+    使准入和限速判断对整个部署生效，而不是每个进程各算各的。
+    """
+
+    @abstractmethod
+    def incr(self, key: str, delta: int = 1, floor: Optional[int] = None) -> int:
+        """原子地增加计数并返回新值，floor 为下限"""
+
+    @abstractmethod
+    def get_counter(self, key: str) -> int:
+        """读取计数，不存在时为 0"""
+
+    @abstractmethod
+    def take_token(self, key: str, rate: float, capacity: float) -> float:
+        """从令牌桶取一个令牌，成功返回 0，否则返回需要等待的秒数"""
+
+    @abstractmethod
+    def acquire_slot(self, key: str, holder: str, limit: int, ttl: float) -> bool:
+        """在 limit 个并发槽位中占用一个，租约 ttl 秒后自动过期（防止进程崩溃后泄漏）"""
+
+    @abstractmethod
+    def release_slot(self, key: str, holder: str):
+        """释放 holder 占用的槽位"""
+
+    @abstractmethod
+    def count_slots(self, key: str) -> int:
+        """统计未过期的已占用槽位数"""
+
+    @abstractmethod
+    def put_json(self, key: str, value: Any, ttl: Optional[float] = None):
+        """写入 JSON 值，提供 ttl 时 ttl 秒后过期"""
+
+    @abstractmethod
+    def get_json(self, key: str) -> Optional[Any]:
+        """读取未过期的 JSON 值，不存在时返回 None"""
+
+    @abstractmethod
+    def get_json_prefix(self, prefix: str) -> Dict[str, Any]:
+        """读取所有以 prefix 开头且未过期的 JSON 值"""
+
+    @abstractmethod
+    def update_json(self, key: str, fn: Callable[[Optional[Any]], Any], ttl: Optional[float] = None) -> Any:
+        """原子地读-改-写 JSON 值：fn(旧值，不存在时为 None) 返回新值，并返回写入的新值"""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """删除 JSON 值"""
+
+
+def _refill(state: Optional[Tuple[float, float]], rate: float, capacity: float,
+            now: float) -> Tuple[float, float]:
+    """令牌桶计算：返回 (剩余令牌, 需要等待的秒数)"""
+    if state is None:
+        tokens = capacity
+    else:
+        tokens = min(capacity, state[0] + (now - state[1]) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class SQLiteStateBackend(StateBackend):
+    """单机共享状态：SQLite 数据库放在 /dev/shm 时即为共享内存实现
+
+    每个线程使用独立连接，写操作使用 BEGIN IMMEDIATE 保证跨进程原子性。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._puts = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        # fork 后不能复用父进程的连接
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets '
+                         '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS kv '
+                         '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS slots '
+                         '(key TEXT, holder TEXT, expires_at REAL NOT NULL, PRIMARY KEY (key, holder))')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def incr(self, key: str, delta: int = 1, floor: Optional[int] = None) -> int:
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT value FROM counters WHERE key = ?', (key,)).fetchone()
+            value = (row[0] if row else 0) + delta
+            if floor is not None:
+                value = max(floor, value)
+            conn.execute('INSERT OR REPLACE INTO counters (key, value) VALUES (?, ?)', (key, value))
+            conn.execute('COMMIT')
+            return value
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def get_counter(self, key: str) -> int:
+        row = self._conn().execute('SELECT value FROM counters WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+
+    def take_token(self, key: str, rate: float, capacity: float) -> float:
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = conn.execute('SELECT tokens, updated_at FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens, wait = _refill(row, rate, capacity, now)
+            conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)',
+                         (key, tokens, now))
+            conn.execute('COMMIT')
+            return wait
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def acquire_slot(self, key: str, holder: str, limit: int, ttl: float) -> bool:
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            conn.execute('DELETE FROM slots WHERE key = ? AND expires_at < ?', (key, now))
+            used = conn.execute('SELECT COUNT(*) FROM slots WHERE key = ? AND holder != ?',
+                                (key, holder)).fetchone()[0]
+            acquired = used < limit
+            if acquired:
+                conn.execute('INSERT OR REPLACE INTO slots (key, holder, expires_at) VALUES (?, ?, ?)',
+                             (key, holder, now + ttl))
+            conn.execute('COMMIT')
+            return acquired
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def release_slot(self, key: str, holder: str):
+        self._conn().execute('DELETE FROM slots WHERE key = ? AND holder = ?', (key, holder))
+
+    def count_slots(self, key: str) -> int:
+        row = self._conn().execute('SELECT COUNT(*) FROM slots WHERE key = ? AND expires_at >= ?',
+                                   (key, time.time())).fetchone()
+        return row[0]
+
+    def put_json(self, key: str, value: Any, ttl: Optional[float] = None):
+        conn = self._conn()
+        expires_at = time.time() + ttl if ttl else None
+        conn.execute('INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)',
+                     (key, json.dumps(value, ensure_ascii=False), expires_at))
+        self._puts += 1
+        if self._puts % 100 == 0:
+            conn.execute('DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at < ?', (time.time(),))
+
+    def get_json(self, key: str) -> Optional[Any]:
+        row = self._conn().execute('SELECT value, expires_at FROM kv WHERE key = ?', (key,)).fetchone()
+        if not row or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def get_json_prefix(self, prefix: str) -> Dict[str, Any]:
+        rows = self._conn().execute(
+            'SELECT key, value FROM kv WHERE key >= ? AND key < ? AND (expires_at IS NULL OR expires_at >= ?)',
+            (prefix, prefix + '\uffff', time.time())
+        ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def update_json(self, key: str, fn: Callable[[Optional[Any]], Any], ttl: Optional[float] = None) -> Any:
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = conn.execute('SELECT value, expires_at FROM kv WHERE key = ?', (key,)).fetchone()
+            old = json.loads(row[0]) if row and (row[1] is None or row[1] >= now) else None
+            value = fn(old)
+            conn.execute('INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)',
+                         (key, json.dumps(value, ensure_ascii=False), now + ttl if ttl else None))
+            conn.execute('COMMIT')
+            return value
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def delete(self, key: str):
+        self._conn().execute('DELETE FROM kv WHERE key = ?', (key,))
+
+
+class KeyValueClient(ABC):
+    """网络存储客户端需要实现的最小接口
+
+    Redis（WATCH/MULTI）、etcd、Consul 等都可以提供带版本号的读取和
+    比较并交换（CAS）写入；计数使用原生的原子自增。
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Tuple[Optional[str], int]:
+        """返回 (值, 版本号)，不存在时版本号为 0"""
+
+    @abstractmethod
+    def cas(self, key: str, version: int, value: str, ttl: Optional[float] = None) -> bool:
+        """版本号未变化时写入并返回 True"""
+
+    @abstractmethod
+    def incrby(self, key: str, amount: int) -> int:
+        """原子自增并返回新值，不存在时从 0 开始"""
+
+    @abstractmethod
+    def scan(self, prefix: str) -> List[str]:
+        """列出以 prefix 开头的键（Redis SCAN MATCH / etcd 前缀查询）"""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """删除键"""
+
+
+class LocalKeyValueStore(KeyValueClient):
+    """进程内的网络存储替身，用于单进程部署和开发调试"""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[str, int, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key: str) -> Optional[Tuple[str, int, Optional[float]]]:
+        entry = self._data.get(key)
+        if entry and entry[2] is not None and entry[2] < time.time():
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key: str) -> Tuple[Optional[str], int]:
+        with self._lock:
+            entry = self._live(key)
+            return (entry[0], entry[1]) if entry else (None, 0)
+
+    def cas(self, key: str, version: int, value: str, ttl: Optional[float] = None) -> bool:
+        with self._lock:
+            entry = self._live(key)
+            if (entry[1] if entry else 0) != version:
+                return False
+            self._data[key] = (value, version + 1, time.time() + ttl if ttl else None)
+            return True
+
+    def incrby(self, key: str, amount: int) -> int:
+        with self._lock:
+            entry = self._live(key)
+            value = int(entry[0]) + amount if entry else amount
+            self._data[key] = (str(value), (entry[1] if entry else 0) + 1, None)
+            return value
+
+    def scan(self, prefix: str) -> List[str]:
+        with self._lock:
+            return [key for key in list(self._data) if key.startswith(prefix) and self._live(key)]
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class NetworkStateBackend(StateBackend):
+    """基于 KeyValueClient 的多节点状态后端，复合操作用 CAS 重试实现"""
+
+    def __init__(self, client: KeyValueClient, prefix: str = 'voice:'):
+        self.client = client
+        self.prefix = prefix
+
+    def _update(self, key: str, fn, ttl: Optional[float] = None):
+        """CAS 循环：fn(旧值) -> (新值, 返回值)"""
+        for _ in range(Config.STATE_CAS_RETRIES):
+            raw, version = self.client.get(self.prefix + key)
+            new_value, result = fn(raw)
+            if self.client.cas(self.prefix + key, version, new_value, ttl):
+                return result
+        raise RuntimeError(f"状态更新冲突过多: {key}")
+
+    def incr(self, key: str, delta: int = 1, floor: Optional[int] = None) -> int:
+        if floor is None:
+            return self.client.incrby(self.prefix + key, delta)
+
+        def apply(raw):
+            value = max(floor, (int(raw) if raw else 0) + delta)
+            return str(value), value
+        return self._update(key, apply)
+
+    def get_counter(self, key: str) -> int:
+        raw, _ = self.client.get(self.prefix + key)
+        return int(raw) if raw else 0
+
+    def take_token(self, key: str, rate: float, capacity: float) -> float:
+        def apply(raw):
+            now = time.time()
+            tokens, wait = _refill(tuple(json.loads(raw)) if raw else None, rate, capacity, now)
+            return json.dumps([tokens, now]), wait
+        return self._update(key, apply)
+
+    def acquire_slot(self, key: str, holder: str, limit: int, ttl: float) -> bool:
+        def apply(raw):
+            now = time.time()
+            holders = {h: exp for h, exp in (json.loads(raw) if raw else {}).items() if exp >= now}
+            acquired = len([h for h in holders if h != holder]) < limit
+            if acquired:
+                holders[holder] = now + ttl
+            return json.dumps(holders), acquired
+        return self._update(f'slots:{key}', apply)
+
+    def release_slot(self, key: str, holder: str):
+        def apply(raw):
+            holders = json.loads(raw) if raw else {}
+            holders.pop(holder, None)
+            return json.dumps(holders), None
+        self._update(f'slots:{key}', apply)
+
+    def count_slots(self, key: str) -> int:
+        raw, _ = self.client.get(f'{self.prefix}slots:{key}')
+        now = time.time()
+        return sum(1 for exp in (json.loads(raw) if raw else {}).values() if exp >= now)
+
+    def put_json(self, key: str, value: Any, ttl: Optional[float] = None):
+        data = json.dumps(value, ensure_ascii=False)
+        self._update(key, lambda raw: (data, None), ttl)
+
+    def get_json(self, key: str) -> Optional[Any]:
+        raw, _ = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw else None
+
+    def get_json_prefix(self, prefix: str) -> Dict[str, Any]:
+        result = {}
+        for full_key in self.client.scan(self.prefix + prefix):
+            raw, _ = self.client.get(full_key)
+            if raw:
+                result[full_key[len(self.prefix):]] = json.loads(raw)
+        return result
+
+    def update_json(self, key: str, fn: Callable[[Optional[Any]], Any], ttl: Optional[float] = None) -> Any:
+        def apply(raw):
+            value = fn(json.loads(raw) if raw else None)
+            return json.dumps(value, ensure_ascii=False), value
+        return self._update(key, apply, ttl)
+
+    def delete(self, key: str):
+        self.client.delete(self.prefix + key)
+
+
+def create_state_backend() -> StateBackend:
+    """按 Config.STATE_BACKEND 创建状态后端"""
+    if Config.STATE_BACKEND == 'network':
+        logger.info("使用网络状态后端（本地替身）")
+        return NetworkStateBackend(LocalKeyValueStore())
+    logger.info(f"使用 SQLite 状态后端: {Config.STATE_DB_PATH}")
+    return SQLiteStateBackend(Config.STATE_DB_PATH)
+
+
+# 创建单例实例
+state_backend = create_state_backend()
@@ -0,0 +1,232 @@
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+from loguru import logger
+from config import Config
+
+
+class StorageFull(Exception):
+    """淘汰所有未使用的文件后仍没有足够的空间"""
+
+
+class UploadStore:
+    """UPLOAD_FOLDER 的配额管理
+
+    内存中按最近使用顺序（LRU）索引目录下的文件：大小、最后使用时间、引用数和是否由本进程写入。
+    写入前先腾出空间，超过字节配额或磁盘使用率阈值时立即淘汰最久未使用且
+    没有被引用的文件（崩溃遗留的文件、停滞的分块上传），写入不会因为磁盘写满而失败。
+
+    引用数只在写入文件的进程内有效。扫描目录发现的其他进程的文件（其他 worker
+    正在托管、转码的文件或分块上传）一律视为被引用，超过 UPLOAD_ORPHAN_AGE 秒
+    未修改才视为遗留文件，可以淘汰或过期清理。删除前重新读取文件的修改时间，
+    其他 worker 刚写入的分块会推迟清理。
+
+    每个 worker 启动时扫描目录，配额按整个目录计算；过期清理由 leader 定期执行，
+    每次重新扫描整个目录，其他 worker 遗留的文件也会被清理。
+    """
+
+    def __init__(self, folder: str, quota: int, disk_threshold: float, orphan_age: float):
+        self.folder = folder
+        self.quota = quota
+        self.disk_threshold = disk_threshold  # 磁盘使用率上限（%）
+        self.orphan_age = orphan_age
+        # 文件名 -> [大小, 最后使用时间, 引用数, 是否由本进程写入]
+        self._entries: 'OrderedDict[str, List]' = OrderedDict()
+        self._used = 0
+        self._lock = threading.Lock()
+        self.stats = {'evicted': 0, 'evicted_bytes': 0, 'expired': 0, 'rejected': 0}
+
+    def _name(self, path: str) -> Optional[str]:
+        """只管理 UPLOAD_FOLDER 下的文件"""
+        if os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.folder):
+            return None
+        return os.path.basename(path)
+
+    def scan(self):
+        """扫描目录，把其他进程的文件加入索引，移除已不存在的文件"""
+        os.makedirs(self.folder, exist_ok=True)
+        found = []
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    found.append((stat.st_mtime, entry.name, stat.st_size))
+        found.sort()
+        with self._lock:
+            self._merge(found)
+        logger.info(f"上传目录已索引: {len(found)} 个文件，{self._used / 1024 / 1024:.1f}MB")
+
+    def _merge(self, found: List[Tuple[float, str, int]]):
+        """合并扫描结果（需持有锁）：本进程的文件以索引为准，其他文件按修改时间更新"""
+        names = set()
+        for mtime, name, size in found:
+            names.add(name)
+            entry = self._entries.get(name)
+            if entry is None:
+                self._entries[name] = [size, mtime, 0, False]
+                self._used += size
+            elif not entry[3]:
+                self._used += size - entry[0]
+                entry[0] = size
+                entry[1] = max(entry[1], mtime)
+        for name in [name for name, entry in self._entries.items() if not entry[3] and name not in names]:
+            self._used -= self._entries.pop(name)[0]
+
+    def add(self, path: str, refs: int = 1):
+        """登记写入完成的文件，默认由调用方持有一个引用，处理完后 remove"""
+        name = self._name(path)
+        if name is None:
+            return
+        size = os.path.getsize(path)
+        with self._lock:
+            old = self._entries.pop(name, None)
+            if old:
+                self._used -= old[0]
+            self._entries[name] = [size, time.time(), refs, True]
+            self._used += size
+
+    def touch(self, path: str):
+        """标记为最近使用（如分块上传写入新分块）"""
+        name = self._name(path)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry:
+                entry[1] = time.time()
+                self._entries.move_to_end(name)
+
+    def release(self, path: str):
+        """释放引用，文件保留在目录中，空间紧张或过期时被清理"""
+        name = self._name(path)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry and entry[2] > 0:
+                entry[2] -= 1
+
+    def rename(self, src: str, dst: str, refs: int = 1):
+        os.rename(src, dst)
+        name = self._name(src)
+        with self._lock:
+            entry = self._entries.pop(name, None)
+            if entry:
+                self._used -= entry[0]
+        self.add(dst, refs)
+
+    def remove(self, path: str) -> bool:
+        """删除文件并移出索引"""
+        name = self._name(path)
+        if name is not None:
+            with self._lock:
+                entry = self._entries.pop(name, None)
+                if entry:
+                    self._used -= entry[0]
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _disk_excess(self, nbytes: int) -> float:
+        """写入 nbytes 后超出磁盘使用率阈值的字节数"""
+        usage = shutil.disk_usage(self.folder)
+        return usage.used + nbytes - usage.total * self.disk_threshold / 100
+
+    def _idle(self, name: str, entry: List, now: float, min_idle: float) -> Optional[float]:
+        """可以删除时返回空闲秒数，否则返回 None（需持有锁）
+
+        本进程持有引用的文件不删除；其他进程的文件至少空闲 orphan_age 秒。
+        空闲时间同时参考文件的修改时间，其他 worker 写入的分块也算作使用
+        """
+        size, used_at, refs, own = entry
+        if refs:
+            return None
+        try:
+            mtime = os.stat(os.path.join(self.folder, name)).st_mtime
+        except FileNotFoundError:
+            mtime = used_at
+        idle = now - max(used_at, mtime)
+        if idle < (min_idle if own else max(min_idle, self.orphan_age)):
+            return None
+        return idle
+
+    def _drop(self, name: str) -> int:
+        """删除文件并移出索引（需持有锁），返回释放的字节数"""
+        size = self._entries.pop(name)[0]
+        self._used -= size
+        try:
+            os.remove(os.path.join(self.folder, name))
+        except FileNotFoundError:
+            pass
+        return size
+
+    def _evict(self, need: float) -> int:
+        """按 LRU 淘汰可以删除的文件直到释放 need 字节（需持有锁），返回释放的字节数"""
+        freed = 0
+        now = time.time()
+        for name in list(self._entries):
+            if freed >= need:
+                break
+            if self._idle(name, self._entries[name], now, 0) is None:
+                continue
+            size = self._drop(name)
+            freed += size
+            self.stats['evicted'] += 1
+            self.stats['evicted_bytes'] += size
+            logger.warning(f"空间不足，已淘汰文件: {name} ({size} 字节)")
+        return freed
+
+    def make_room(self, nbytes: int):
+        """写入前确保有 nbytes 的空间，腾不出时重新扫描目录再试一次，仍不足时抛出 StorageFull"""
+        with self._lock:
+            need = max(self._used + nbytes - self.quota, self._disk_excess(nbytes), 0)
+            if not need or self._evict(need) >= need:
+                return
+        self.scan()
+        with self._lock:
+            need = max(self._used + nbytes - self.quota, self._disk_excess(nbytes), 0)
+            if need and self._evict(need) < need:
+                self.stats['rejected'] += 1
+                raise StorageFull("服务器存储空间不足，请稍后重试")
+
+    def relieve(self, disk_percent: float):
+        """磁盘使用率超过阈值时淘汰文件，由资源监控在每次采样时调用"""
+        if disk_percent <= self.disk_threshold:
+            return
+        with self._lock:
+            self._evict(max(self._disk_excess(0), 0))
+
+    def expire(self):
+        """扫描整个目录，清理过期的未引用文件，未完成的分块上传在会话有效期内保留"""
+        self.scan()
+        now = time.time()
+        expired = []
+        with self._lock:
+            for name, entry in list(self._entries.items()):
+                max_age = Config.UPLOAD_SESSION_TTL if name.endswith('.part') else Config.CLEANUP_INTERVAL
+                if self._idle(name, entry, now, max_age) is None:
+                    continue
+                try:
+                    self._drop(name)
+                    expired.append(name)
+                    logger.info(f"已清理临时文件: {name}")
+                except Exception as e:
+                    logger.error(f"清理文件失败 {name}: {str(e)}")
+            self.stats['expired'] += len(expired)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = self.stats.copy()
+            stats['files'] = len(self._entries)
+            stats['in_use'] = sum(1 for entry in self._entries.values() if entry[2])
+            stats['foreign'] = sum(1 for entry in self._entries.values() if not entry[3])
+            stats['used_bytes'] = self._used
+        stats['quota_bytes'] = self.quota
+        stats['disk_threshold'] = self.disk_threshold
+        return stats
+
+
+# 创建单例实例
+upload_store = UploadStore(Config.UPLOAD_FOLDER, Config.UPLOAD_QUOTA_BYTES, Config.UPLOAD_DISK_THRESHOLD,
+                           Config.UPLOAD_ORPHAN_AGE)
@@ -0,0 +1,304 @@
+import codecs
+import json
+import math
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Optional, Dict, Any, List, Iterator, Iterable, Tuple, Callable
+from loguru import logger
+
+CHUNK_CUES = 500  # 导出时每次输出的字幕条数
+
+
+def parse_cue(sub: Any) -> Optional[Tuple[float, float, str]]:
+    """校验 subtitlesArray 的元素，返回 (开始, 结束, 文本)
+
+    null、非对象、缺少文本或时间不是有限数值的元素返回 None
+    """
+    if not isinstance(sub, dict) or not isinstance(sub.get('text'), str):
+        return None
+    try:
+        start = float(sub.get('start', 0))
+        end = float(sub.get('end', 0))
+    except (TypeError, ValueError):
+        return None
+    if not (math.isfinite(start) and math.isfinite(end)):
+        return None
+    return start, end, sub['text']
+
+
+class SubtitleTrack:
+    """列式存储的字幕轨
+
+    开始 / 结束时间分别存放在 array('d') 中，所有文本以 UTF-8 连续写入
+    一个 bytearray，按偏移量取出。相比每条字幕一个 dict，长录音的内存
+    占用小得多；时间戳只在导出时格式化一次。
+    """
+
+    def __init__(self):
+        self.starts = array('d')
+        self.ends = array('d')
+        self._buffer = bytearray()
+        self._offsets = array('Q', [0])  # 第 i 条文本为 _buffer[_offsets[i]:_offsets[i + 1]]
+
+    @classmethod
+    def from_subtitles(cls, subtitles: Iterable[Dict[str, Any]]) -> 'SubtitleTrack':
+        """由 BibiGPT 的 subtitlesArray 构建，无效的元素被忽略"""
+        track = cls()
+        for sub in subtitles:
+            cue = parse_cue(sub)
+            if cue is not None:
+                track.append(*cue)
+        return track
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, List[Any]]) -> 'SubtitleTrack':
+        """由 to_columns() 的结果恢复"""
+        track = cls()
+        track.starts = array('d', columns['start'])
+        track.ends = array('d', columns['end'])
+        for text in columns['text']:
+            track._buffer += text.encode('utf-8')
+            track._offsets.append(len(track._buffer))
+        return track
+
+    def to_columns(self) -> Dict[str, List[Any]]:
+        """转换为可 JSON 序列化的列式结构（用于缓存）"""
+        return {
+            'start': self.starts.tolist(),
+            'end': self.ends.tolist(),
+            'text': [self.text(i) for i in range(len(self))],
+        }
+
+    def append(self, start: float, end: float, text: str):
+        self.starts.append(start)
+        self.ends.append(end)
+        self._buffer += text.encode('utf-8')
+        self._offsets.append(len(self._buffer))
+
+    def extend(self, other: 'SubtitleTrack', start: int = 0):
+        """追加另一条字幕轨（如下一个分段）从第 start 条开始的部分"""
+        base = len(self._buffer) - other._offsets[start]
+        self.starts.extend(other.starts[start:])
+        self.ends.extend(other.ends[start:])
+        self._buffer += other._buffer[other._offsets[start]:]
+        self._offsets.extend(base + offset for offset in other._offsets[start + 1:])
+
+    def truncate(self, count: int):
+        """只保留前 count 条"""
+        del self.starts[count:]
+        del self.ends[count:]
+        del self._buffer[self._offsets[count]:]
+        del self._offsets[count + 1:]
+
+    def shifted(self, offset: float) -> 'SubtitleTrack':
+        """返回时间轴平移 offset 秒后的副本，文本缓冲区原样复制"""
+        track = SubtitleTrack()
+        track.starts = array('d', (t + offset for t in self.starts))
+        track.ends = array('d', (t + offset for t in self.ends))
+        track._buffer = bytearray(self._buffer)
+        track._offsets = array('Q', self._offsets)
+        return track
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def text(self, i: int) -> str:
+        return self._buffer[self._offsets[i]:self._offsets[i + 1]].decode('utf-8')
+
+    def line(self, i: int) -> str:
+        """第 i 条的文本行，形如 [1.0s -> 2.5s] 文本"""
+        return f"[{round(self.starts[i], 1)}s -> {round(self.ends[i], 1)}s] {self.text(i)}"
+
+    @property
+    def duration(self) -> float:
+        """总时长（秒），以最后一条字幕的结束时间计"""
+        return self.ends[-1] if self.ends else 0.0
+
+    def bounds(self, start: Optional[float] = None, end: Optional[float] = None) -> Tuple[int, int]:
+        """与 [start, end) 有重叠的字幕下标范围，二分查找"""
+        lo, hi = 0, len(self)
+        if start is not None:
+            lo = bisect_left(self.starts, start)
+            if lo > 0 and self.ends[lo - 1] > start:
+                lo -= 1  # 前一条字幕跨越了起点
+        if end is not None:
+            hi = max(bisect_left(self.starts, end), lo)
+        return lo, hi
+
+    def slice(self, start: Optional[float] = None, end: Optional[float] = None) -> 'SubtitleTrack':
+        lo, hi = self.bounds(start, end)
+        track = SubtitleTrack()
+        track.starts = self.starts[lo:hi]
+        track.ends = self.ends[lo:hi]
+        base = self._offsets[lo]
+        track._buffer = self._buffer[base:self._offsets[hi]]
+        track._offsets = array('Q', (offset - base for offset in self._offsets[lo:hi + 1]))
+        return track
+
+    def _chunks(self, render) -> Iterator[str]:
+        """逐条渲染并按 CHUNK_CUES 条合并输出"""
+        for first in range(0, len(self), CHUNK_CUES):
+            yield ''.join(render(i) for i in range(first, min(first + CHUNK_CUES, len(self))))
+
+    def iter_text(self) -> Iterator[str]:
+        """带时间戳的纯文本，每行形如 [1.0s -> 2.5s] 文本"""
+        def render(i):
+            return self.line(i) if i == 0 else '\n' + self.line(i)
+        return self._chunks(render)
+
+    def iter_srt(self) -> Iterator[str]:
+        def render(i):
+            return (f"{i + 1}\n{_timestamp(self.starts[i], ',')} --> {_timestamp(self.ends[i], ',')}\n"
+                    f"{self.text(i)}\n\n")
+        return self._chunks(render)
+
+    def iter_vtt(self) -> Iterator[str]:
+        def render(i):
+            head = 'WEBVTT\n\n' if i == 0 else ''
+            return (f"{head}{_timestamp(self.starts[i], '.')} --> {_timestamp(self.ends[i], '.')}\n"
+                    f"{self.text(i)}\n\n")
+        if not len(self):
+            return iter(['WEBVTT\n\n'])
+        return self._chunks(render)
+
+    def iter_json(self) -> Iterator[str]:
+        """JSON 数组，元素为 {"start", "end", "text"}"""
+        def render(i):
+            item = json.dumps({'start': round(self.starts[i], 3), 'end': round(self.ends[i], 3),
+                               'text': self.text(i)}, ensure_ascii=False)
+            return ('[' if i == 0 else ',') + item
+        if not len(self):
+            return iter(['[]'])
+        return _then(self._chunks(render), ']')
+
+    EXPORTERS = {
+        'txt': ('iter_text', 'text/plain'),
+        'srt': ('iter_srt', 'application/x-subrip; charset=utf-8'),
+        'vtt': ('iter_vtt', 'text/vtt'),
+        'json': ('iter_json', 'application/json'),
+    }
+
+    def export(self, fmt: str) -> Tuple[Iterator[str], str]:
+        """按格式导出，返回 (分块迭代器, MIME 类型)"""
+        method, mimetype = self.EXPORTERS[fmt]
+        return getattr(self, method)(), mimetype
+
+
+class LiveTrack:
+    """转录过程中逐步增长的字幕轨
+
+    转录线程追加（或在重试前回退），SSE 读取已就绪的文本行；
+    每批写入后调用 on_change 唤醒等待的读取方。
+    """
+
+    def __init__(self, on_change: Optional[Callable[[], None]] = None):
+        self.track = SubtitleTrack()
+        self.on_change = on_change
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.track)
+
+    def append(self, start: float, end: float, text: str):
+        """追加一条，调用方写完一批后调用 changed()"""
+        with self._lock:
+            self.track.append(start, end, text)
+
+    def extend(self, other: SubtitleTrack):
+        with self._lock:
+            self.track.extend(other)
+        self.changed()
+
+    def truncate(self, count: int):
+        with self._lock:
+            if count < len(self.track):
+                self.track.truncate(count)
+        self.changed()
+
+    def changed(self):
+        if self.on_change:
+            self.on_change()
+
+    def read(self, start: int, limit: int = CHUNK_CUES) -> Tuple[int, List[str]]:
+        """从第 start 条起最多 limit 行，返回 (实际起始下标, 文本行)；轨道被回退时起始下标变小"""
+        with self._lock:
+            start = min(start, len(self.track))
+            return start, [self.track.line(i) for i in range(start, min(start + limit, len(self.track)))]
+
+
+class SubtitleStreamParser:
+    """增量解析 BibiGPT 响应体
+
+    响应体按块 feed，subtitlesArray 中每解析出一个完整元素就追加到 track，
+    不构建整个响应的 dict 和字幕 dict 列表。数组之外的字段（success、message 等）
+    拼成不含字幕的响应体，读完后由 envelope() 解析。
+    """
+
+    ARRAY_START = re.compile(r'"subtitlesArray"\s*:\s*\[')
+    SEPARATOR = re.compile(r'[\s,]*')
+
+    def __init__(self, track):
+        self.track = track  # SubtitleTrack 或 LiveTrack
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buffer = ''
+        self._head = ''  # 数组之前的部分（以 "[" 结尾）
+        self._state = 'head'  # head -> items -> tail
+
+    def feed(self, data: bytes) -> int:
+        """解析新收到的字节，返回新增的字幕条数"""
+        self._buffer += self._decoder.decode(data)
+        if self._state == 'head':
+            match = self.ARRAY_START.search(self._buffer)
+            if not match:
+                return 0
+            self._head = self._buffer[:match.end()]
+            self._buffer = self._buffer[match.end():]
+            self._state = 'items'
+        if self._state != 'items':
+            return 0
+
+        added = 0
+        pos = 0
+        while True:
+            pos = self.SEPARATOR.match(self._buffer, pos).end()
+            if pos >= len(self._buffer):
+                break
+            if self._buffer[pos] == ']':
+                self._state = 'tail'
+                break
+            try:
+                sub, pos = self._json.raw_decode(self._buffer, pos)
+            except ValueError:
+                break  # 元素还没收完整
+            cue = parse_cue(sub)
+            if cue is None:
+                logger.warning(f"跳过无效的字幕元素: {json.dumps(sub, ensure_ascii=False)[:200]}")
+                continue
+            self.track.append(*cue)
+            added += 1
+        self._buffer = self._buffer[pos:]
+        return added
+
+    def envelope(self) -> Dict[str, Any]:
+        """读完后解析数组之外的字段，响应体不完整时抛出 ValueError"""
+        rest = self._buffer + self._decoder.decode(b'', final=True)
+        if self._state == 'items':
+            raise ValueError("字幕数组不完整")
+        return json.loads(self._head + rest)
+
+
+def _timestamp(seconds: float, separator: str) -> str:
+    """格式化为 HH:MM:SS,mmm（SRT）或 HH:MM:SS.mmm（WebVTT）"""
+    millis = int(round(max(seconds, 0) * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{separator}{millis:03d}"
+
+
+def _then(chunks: Iterator[str], tail: str) -> Iterator[str]:
+    yield from chunks
+    yield tail
@@ -1,46 +1,83 @@
 import requests
 from loguru import logger
 from config import Config
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, Iterable, Tuple
+import math
+import threading
 import time
 import os
 import json
-from urllib3.util.retry import Retry
-from requests.adapters import HTTPAdapter
+from services.cost_model import cost_model
+from services.http_client import http_client
+from services.hosting import HostSelector, CancellableFile, MultipartFile
+from services.retry import RetryPolicy, DeadlineExceeded
+from services.leases import hosted_leases, file_digest, derived_key
+from services.ingest import IngestError
+from services.signing import url_signer
+from services.media import media_service
+from services.probe import probe_audio, ProbeError
+from services.metrics import stage_latency, stage_errors
+from services.subtitles import SubtitleTrack, LiveTrack, SubtitleStreamParser
+from concurrent.futures import ThreadPoolExecutor
+
+# 预先绑定标签，记录时不再查找
+HOSTING_LATENCY = stage_latency.labels('hosting')
+HOSTING_ERRORS = stage_errors.labels('hosting')
+BIBIGPT_LATENCY = stage_latency.labels('bibigpt')
+BIBIGPT_ERRORS = stage_errors.labels('bibigpt')
+TRANSCODE_LATENCY = stage_latency.labels('transcode')
+
+RESPONSE_CHUNK_SIZE = 64 * 1024  # 逐块读取 BibiGPT 响应
 
 class TranscriptionService:
     def __init__(self):
         self.api_token = Config.BIBIGPT_API_TOKEN
         self.api_base_url = Config.BIBIGPT_API_BASE_URL
+        self.host_selector = HostSelector([
+            ('catbox', self.upload_to_catbox),
+            ('transfer.sh', self.upload_to_transfer_sh),
+            ('temp.sh', self.upload_to_temp_sh),
+        ])
         
-        # 配置 requests session 以处理重试
-        self.session = requests.Session()
-        retries = Retry(
-            total=3,
-            backoff_factor=0.5,
-            status_forcelist=[500, 502, 503, 504],
-            allowed_methods=["GET", "POST", "PUT"]
-        )
-        self.session.mount('https://', HTTPAdapter(max_retries=retries))
-        self.session.timeout = (5, 30)  # (连接超时, 读取超时)
-        
+    @property
+    def session(self) -> requests.Session:
+        """BibiGPT 请求使用的连接池（带超时和重试）"""
+        return http_client.session('bibigpt')
+
+    @property
+    def hosting_session(self) -> requests.Session:
+        """文件托管使用单独的连接池，只重试连接错误"""
+        return http_client.session('hosting')
+
     def get_file_metadata(self, file_path: str) -> Dict[str, Any]:
-        """获取文件元数据"""
+        """获取文件元数据，能解析文件头时同时给出时长（分钟）和编码信息"""
         file_size = os.path.getsize(file_path) / (1024 * 1024)  # MB
-        return {
+        metadata = {
             "file_size": round(file_size, 2),
             "file_type": os.path.splitext(file_path)[1][1:],
         }
+        try:
+            audio = probe_audio(file_path)
+        except ProbeError:
+            return metadata
+        metadata.update({
+            "duration": round(audio['duration'] / 60, 1),
+            "codec": audio['codec'],
+            "sample_rate": audio['sample_rate'],
+            "channels": audio['channels'],
+        })
+        return metadata
 
-    def upload_to_transfer_sh(self, file_path: str) -> Optional[str]:
+    def upload_to_transfer_sh(self, file_path: str,
+                              cancel: Optional[threading.Event] = None) -> Optional[str]:
         """上传文件到 transfer.sh 获取临时URL"""
         try:
             filename = os.path.basename(file_path)
             with open(file_path, 'rb') as f:
-                response = self.session.put(
-                    f'https://transfer.sh/{filename}', 
-                    data=f,
-                    headers={'Max-Days': '1'}  # 文件保存1天
+                response = self.hosting_session.put(
+                    f'{Config.TRANSFER_SH_URL}/{filename}', 
+                    data=CancellableFile(f, cancel),
+                    headers={'Max-Days': str(Config.TRANSFER_SH_MAX_DAYS)}
                 )
                 response.raise_for_status()
                 return response.text.strip()
@@ -48,15 +85,108 @@ class TranscriptionService:
             logger.error(f"上传文件失败: {str(e)}")
             return None
 
-    def upload_to_catbox(self, file_path: str) -> Optional[str]:
+    def upload_stream_to_transfer_sh(self, filename: str, chunks: Iterable[bytes]) -> Optional[str]:
+        """以分块传输编码把正在接收的数据直接上传到 transfer.sh"""
+        start = time.time()
+        size = 0
+
+        def body():
+            nonlocal size
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+
+        try:
+            response = self.hosting_session.put(
+                f'{Config.TRANSFER_SH_URL}/{filename}',
+                data=body(),
+                headers={'Max-Days': str(Config.TRANSFER_SH_MAX_DAYS)}
+            )
+            response.raise_for_status()
+            url = response.text.strip()
+            self.host_selector.record('transfer.sh', True, time.time() - start, size)
+            return url
+        except IngestError:
+            # 客户端上传中止，不计入托管服务失败
+            return None
+        except Exception as e:
+            logger.error(f"直通上传到 transfer.sh 失败: {str(e)}")
+            self.host_selector.record('transfer.sh', False, time.time() - start, size)
+            return None
+
+    def upload_stream(self, filename: str, chunks: Iterable[bytes]) -> Optional[Tuple[str, str]]:
+        """直通上传，返回值与 host_selector.upload 相同：(服务名, URL) 或 None"""
+        url = self.upload_stream_to_transfer_sh(filename, chunks)
+        return ('transfer.sh', url) if url else None
+
+    def prehost(self, file_path: str, digest: Optional[str] = None) -> Optional[Tuple[str, str]]:
+        """在排队期间提前托管文件，返回 (服务名, URL)
+
+        可自托管或需要分段转录（分段各自托管）时不预先托管，返回 None；
+        托管结果记入租约，同一文件稍后的转录重试直接复用。digest 为文件的 SHA-256
+        """
+        if url_signer.can_serve(file_path):
+            return None
+        duration = None
+        if Config.SEGMENTED_TRANSCRIPTION:
+            duration = media_service.get_duration(file_path)
+            if duration and duration > Config.SEGMENT_MINUTES * 60 + Config.SEGMENT_MIN_TAIL:
+                return None
+        transcoded, key = self.transcode(file_path, duration, digest)
+        try:
+            return self.host(transcoded or file_path, RetryPolicy(Config.REQUEST_DEADLINE), key)
+        finally:
+            if transcoded:
+                media_service.cleanup_file(transcoded)
+
+    def host(self, file_path: str, policy: RetryPolicy, digest: Optional[str] = None) -> Tuple[str, str]:
+        """托管文件，返回 (服务名, URL)，全部托管服务失败时抛出异常
+
+        相同内容在租约有效期内复用已托管的地址，不再重复上传；
+        digest 为租约键（上传时已算出的 SHA-256 或 derived_key），未提供时才读取文件计算
+        """
+        digest = digest or file_digest(file_path)
+        hosted = hosted_leases.get(digest)
+        if hosted:
+            logger.info(f"复用已托管的地址: {hosted[1]}")
+            return hosted
+        # 按健康度选择文件托管服务
+        with HOSTING_LATENCY.time(HOSTING_ERRORS):
+            hosted = self.host_selector.upload(file_path, policy)
+            if not hosted:
+                raise Exception("无法获取文件的公网访问URL")
+        hosted_leases.put(digest, *hosted)
+        return hosted
+
+    @staticmethod
+    def transcode(file_path: str, duration: Optional[float] = None,
+                  digest: Optional[str] = None) -> Tuple[Optional[str], Optional[str]]:
+        """托管前转为低码率语音，返回 (转码后的临时文件, 待托管文件的租约键)
+
+        不值得转码时临时文件为 None（调用方负责删除转码文件）；转码文件的租约键由源文件的
+        digest 和转码参数得出，digest 未知时为 None
+        """
+        with TRANSCODE_LATENCY.time():
+            duration = duration or media_service.get_duration(file_path)
+            transcoded = media_service.transcode_for_speech(file_path, duration)
+        if not transcoded:
+            return None, digest
+        if not digest:
+            return transcoded, None
+        kbps = media_service.speech_kbps(os.path.getsize(file_path), duration)
+        return transcoded, derived_key(digest, f'mp3:{kbps}k:{Config.TRANSCODE_SAMPLE_RATE}hz:mono')
+
+    def upload_to_catbox(self, file_path: str,
+                         cancel: Optional[threading.Event] = None) -> Optional[str]:
         """上传文件到 catbox.moe 获取临时URL"""
         try:
             with open(file_path, 'rb') as f:
-                files = {'fileToUpload': (os.path.basename(file_path), f)}
-                response = self.session.post(
-                    'https://catbox.moe/user/api.php',
-                    data={'reqtype': 'fileupload'},
-                    files=files
+                body = MultipartFile({'reqtype': 'fileupload'}, 'fileToUpload', f,
+                                     os.path.basename(file_path), cancel)
+                response = self.hosting_session.post(
+                    Config.CATBOX_UPLOAD_URL,
+                    data=body,
+                    headers={'Content-Type': body.content_type}
                 )
                 response.raise_for_status()
                 url = response.text.strip()
@@ -68,13 +198,16 @@ class TranscriptionService:
             logger.error(f"上传文件到 catbox 失败: {str(e)}")
             return None
 
-    def upload_to_temp_sh(self, file_path: str) -> Optional[str]:
+    def upload_to_temp_sh(self, file_path: str,
+                          cancel: Optional[threading.Event] = None) -> Optional[str]:
         """上传文件到 temp.sh 获取临时URL"""
         try:
             with open(file_path, 'rb') as f:
-                response = self.session.post(
-                    'https://temp.sh/upload',
-                    files={'file': f}
+                body = MultipartFile({}, 'file', f, os.path.basename(file_path), cancel)
+                response = self.hosting_session.post(
+                    Config.TEMP_SH_UPLOAD_URL,
+                    data=body,
+                    headers={'Content-Type': body.content_type}
                 )
                 response.raise_for_status()
                 return response.text.strip()
@@ -82,70 +215,226 @@ class TranscriptionService:
             logger.error(f"上传文件到 temp.sh 失败: {str(e)}")
             return None
         
-    def transcribe(self, file_path: str, retry_count: int = 0) -> Optional[Dict[str, Any]]:
-        """调用 BibiGPT API 进行转录"""
+    def request_subtitles(self, file_url: str,
+                          on_progress: Optional[Callable[..., None]] = None,
+                          audio_seconds: Optional[float] = None,
+                          live: Optional[LiveTrack] = None,
+                          policy: Optional[RetryPolicy] = None) -> SubtitleTrack:
+        """请求 BibiGPT 转录指定 URL 的音频，返回字幕轨
+
+        响应体边接收边解析，字幕直接写入列式字幕轨；提供 live 时解析出的字幕
+        立即写入 live（每次请求从头写入，失败时清空），供页面在转录完成前显示。
+        已知音频时长时，读取超时按耗时模型收紧，明显落后于以往速度的请求尽早失败重试；
+        提供 policy 时读取超时不超过剩余时间，每读一块检查截止时间和取消
+        """
+        # 严格按照 BibiGPT 官方调用方式
+        url = f"{self.api_base_url}/{self.api_token}/subtitle"
+        querystring = {"url": file_url}
+        read_timeout = Config.BIBIGPT_READ_TIMEOUT
+        if audio_seconds:
+            read_timeout = cost_model.deadline('bibigpt', audio_seconds / 60,
+                                               Config.BIBIGPT_MIN_TIMEOUT, Config.BIBIGPT_READ_TIMEOUT)
+        if policy:
+            read_timeout = policy.timeout(read_timeout)
+        
+        logger.info(f"开始转录请求")
+        if on_progress:
+            on_progress('transcribing')
+        if live is not None:
+            live.truncate(0)
+        parser = SubtitleStreamParser(live if live is not None else SubtitleTrack())
+        start = time.time()
         try:
-            # 尝试不同的文件托管服务
-            file_url = None
-            for upload_func in [self.upload_to_catbox, self.upload_to_transfer_sh, self.upload_to_temp_sh]:
-                file_url = upload_func(file_path)
-                if file_url:
-                    break
-            
+            with BIBIGPT_LATENCY.time(BIBIGPT_ERRORS):
+                with self.session.get(url, params=querystring, stream=True,
+                                      timeout=(Config.HTTP_CONNECT_TIMEOUT, read_timeout)) as response:
+                    response.raise_for_status()
+                    for chunk in response.iter_content(RESPONSE_CHUNK_SIZE):
+                        if policy:
+                            policy.check()
+                        if parser.feed(chunk) and live is not None:
+                            live.changed()
+                
+                result = parser.envelope()
+                if not result.get('success'):
+                    error_msg = result.get('message') or result.get('error') or '未知错误'
+                    raise Exception(f"API 处理失败: {error_msg}")
+        except Exception:
+            if live is not None:
+                live.truncate(0)
+            raise
+        
+        track = live.track if live is not None else parser.track
+        if len(track):
+            cost_model.observe('bibigpt', time.time() - start, track.duration / 60)
+        return track
+
+    def estimate(self, file_path: str, audio_seconds: Optional[float]) -> Dict[str, float]:
+        """按耗时模型预估托管和转录耗时（秒），长音频按分段并行计算"""
+        size = os.path.getsize(file_path)
+        minutes = (audio_seconds or 0) / 60
+        waves = 1
+        if Config.SEGMENTED_TRANSCRIPTION and minutes * 60 > Config.SEGMENT_MINUTES * 60 + Config.SEGMENT_MIN_TAIL:
+            segments = math.ceil(minutes / Config.SEGMENT_MINUTES)
+            waves = math.ceil(segments / Config.SEGMENT_PARALLELISM)
+            size, minutes = size / segments, Config.SEGMENT_MINUTES
+        hosting = 0.0 if url_signer.can_serve(file_path) else self.host_selector.expected_latency(int(size))
+        return {
+            'hosting': hosting * waves,
+            'transcription': cost_model.expected('bibigpt', minutes) * waves if minutes else None,
+        }
+
+    def build_result(self, track: SubtitleTrack) -> Dict[str, Any]:
+        """由字幕轨生成转录结果，文本在格式化消息时再一次性导出"""
+        return {
+            'success': True,
+            # 计算总时长（假设最后一个字幕的结束时间就是总时长），转换为分钟
+            'duration': round(track.duration / 60, 1),
+            'track': track
+        }
+
+    def transcribe(self, file_path: str,
+                   on_progress: Optional[Callable[..., None]] = None,
+                   file_url: Optional[str] = None,
+                   live: Optional[LiveTrack] = None,
+                   policy: Optional[RetryPolicy] = None,
+                   digest: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """调用 BibiGPT API 进行转录
+
+        on_progress(stage, **data) 用于向任务队列汇报处理阶段；
+        file_url 为已托管（如直通上传）的地址，提供时跳过文件托管；
+        live 接收边解析边输出的字幕行；
+        policy 决定截止时间和重试，未提供时按 REQUEST_DEADLINE 新建；
+        digest 为文件内容的租约键（上传时算出的 SHA-256），托管时不再重新计算。
+        启用自托管时优先使用本机签名 URL，失败后才上传到第三方托管服务；
+        两种方式都先转码为低码率语音，减少上行字节数。转码和托管只做一次，
+        重试时复用已托管的地址，相同内容的再次转录（如分段重试）按租约复用。
+        超过截止时间时抛出 DeadlineExceeded。
+        """
+        policy = policy or RetryPolicy(Config.REQUEST_DEADLINE)
+        transcoded = None
+        try:
+            audio_seconds = media_service.get_duration(file_path)
             if not file_url:
-                raise Exception("无法获取文件的公网访问URL")
-            
-            logger.info(f"文件已上传，URL: {file_url}")
-            
-            # 严格按照 BibiGPT 官方调用方式
-            url = f"{self.api_base_url}/{self.api_token}/subtitle"
-            querystring = {"url": file_url}
-            
-            logger.info(f"开始转录请求")
-            response = requests.request("GET", url, params=querystring)
-            response.raise_for_status()
-            
-            result = response.json()
-            if not result.get('success'):
-                error_msg = result.get('message') or result.get('error') or '未知错误'
-                raise Exception(f"API 处理失败: {error_msg}")
-            
-            # 提取文本（带时间戳）
-            subtitles = result.get('detail', {}).get('subtitlesArray', [])
-            text_lines = []
-            for sub in subtitles:
-                if 'text' in sub:
-                    start_time = round(float(sub.get('start', 0)), 1)
-                    end_time = round(float(sub.get('end', 0)), 1)
-                    text_lines.append(f"[{start_time}s -> {end_time}s] {sub['text']}")
-            
-            text = '\n'.join(text_lines)
-            
-            # 计算总时长（假设最后一个字幕的结束时间就是总时长）
-            duration = 0
-            if subtitles:
-                last_subtitle = subtitles[-1]
-                if 'end' in last_subtitle:
-                    duration = round(float(last_subtitle['end']) / 60, 1)  # 转换为分钟
-            
-            return {
-                'success': True,
-                'text': text,
-                'duration': duration,
-                'raw_subtitles': subtitles  # 保存原始字幕数据，以备后用
-            }
-            
-        except requests.exceptions.RequestException as e:
-            logger.error(f"转录请求失败: {str(e)}")
-            if retry_count < Config.MAX_RETRIES:
-                logger.info(f"尝试重试 ({retry_count + 1}/{Config.MAX_RETRIES})")
-                time.sleep(Config.RETRY_DELAY)
-                return self.transcribe(file_path, retry_count + 1)
-            return None
-            
+                transcoded, digest = self.transcode(file_path, audio_seconds, digest)
+            source_path = transcoded or file_path
+            if not file_url and url_signer.can_serve(source_path):
+                signed_url = url_signer.sign(os.path.basename(source_path))
+                if on_progress:
+                    on_progress('hosted', host='self', url=signed_url)
+                try:
+                    return self.build_result(
+                        self.request_subtitles(signed_url, on_progress, audio_seconds, live, policy))
+                except DeadlineExceeded:
+                    raise
+                except Exception as e:
+                    logger.warning(f"自托管地址转录失败，改用第三方文件托管: {str(e)}")
+
+            while True:
+                try:
+                    if not file_url:
+                        host, file_url = self.host(source_path, policy, digest)
+                        logger.info(f"文件已上传到 {host}，URL: {file_url}")
+                        if on_progress:
+                            on_progress('hosted', host=host, url=file_url)
+                    track = self.request_subtitles(file_url, on_progress, audio_seconds, live, policy)
+                    return self.build_result(track)
+                except requests.exceptions.RequestException as e:
+                    logger.error(f"转录请求失败: {str(e)}")
+                    if not policy.retry(e):
+                        return None
+
+        except DeadlineExceeded:
+            raise
+
         except Exception as e:
             logger.error(f"转录处理错误: {str(e)}")
             return None
 
+        finally:
+            if transcoded:
+                media_service.cleanup_file(transcoded)
+
+    def _transcribe_segment(self, index: int, total: int, segment_path: str, offset: float,
+                            on_progress: Optional[Callable[..., None]],
+                            policy: RetryPolicy, digest: Optional[str] = None) -> SubtitleTrack:
+        """转录单个分段并把时间戳平移到原始音频的时间轴上，失败时单独重试"""
+        def segment_progress(stage, **data):
+            if on_progress:
+                on_progress(stage, segment=index + 1, segments=total, **data)
+
+        # 分段共用整个请求的截止时间和取消事件，分段内外的重试合计不超过 SEGMENT_RETRIES + 1 次
+        segment_policy = policy.child(Config.SEGMENT_RETRIES + 1)
+        while True:
+            result = self.transcribe(segment_path, on_progress=segment_progress, policy=segment_policy,
+                                     digest=digest)
+            if result:
+                return result['track'].shifted(offset)
+            error = Exception(f"分段 {index + 1}/{total} 转录失败")
+            if not segment_policy.retry(error):
+                raise error
+
+    @staticmethod
+    def segment_key(digest: Optional[str], start: float, end: Optional[float]) -> Optional[str]:
+        """分段的租约键，切分点由源文件决定，相同源文件的同一分段内容相同"""
+        if not digest:
+            return None
+        return derived_key(digest, f"segment:{start:.3f}-{'end' if end is None else f'{end:.3f}'}")
+
+    def transcribe_segmented(self, file_path: str,
+                             on_progress: Optional[Callable[..., None]] = None,
+                             live: Optional[LiveTrack] = None,
+                             policy: Optional[RetryPolicy] = None,
+                             digest: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """长音频在静音处拆分后并行转录，再按偏移拼接为一条字幕轨
+
+        短音频或无法拆分时退回到整段转录；提供 live 时按顺序输出已完成的前缀分段。
+        任一分段最终失败时取消其余分段，不再为注定失败的请求消耗重试。
+        分段的租约键由源文件的 digest 和分段的时间范围得出
+        """
+        policy = policy or RetryPolicy(Config.REQUEST_DEADLINE)
+        segments = None
+        if Config.SEGMENTED_TRANSCRIPTION:
+            segments = media_service.segment_audio(file_path, Config.SEGMENT_MINUTES * 60)
+        if not segments:
+            return self.transcribe(file_path, on_progress=on_progress, live=live, policy=policy, digest=digest)
+
+        try:
+            total = len(segments)
+            logger.info(f"开始分段转录: {total} 段，并行度 {Config.SEGMENT_PARALLELISM}")
+            with ThreadPoolExecutor(max_workers=min(Config.SEGMENT_PARALLELISM, total),
+                                    thread_name_prefix='segment') as executor:
+                ends = [offset for _, offset in segments[1:]] + [None]
+                futures = [
+                    executor.submit(self._transcribe_segment, i, total, path, offset, on_progress, policy,
+                                    self.segment_key(digest, offset, end))
+                    for i, ((path, offset), end) in enumerate(zip(segments, ends))
+                ]
+                if live is not None:
+                    live.truncate(0)
+                track = SubtitleTrack()
+                for future in futures:
+                    try:
+                        segment = future.result()
+                    except Exception:
+                        policy.cancel()
+                        raise
+                    if live is not None:
+                        live.extend(segment)
+                    else:
+                        track.extend(segment)
+            return self.build_result(live.track if live is not None else track)
+
+        except DeadlineExceeded:
+            raise
+
+        except Exception as e:
+            logger.error(f"分段转录失败: {str(e)}")
+            return None
+
+        finally:
+            for path, _ in segments:
+                media_service.cleanup_file(path)
+
 # 创建单例实例
 transcription_service = TranscriptionService() 
\ No newline at end of file
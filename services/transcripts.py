@@ -0,0 +1,176 @@
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from typing import Optional, Dict, Any, List, Tuple
+from loguru import logger
+from config import Config
+from services.subtitles import SubtitleTrack
+
+# 中日韩字符之间没有空格，入库和查询时都按单字切分，短语查询即可匹配任意长度的词
+CJK = re.compile(r'([\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef])')
+
+
+def tokenize(text: str) -> str:
+    return CJK.sub(r' \1 ', text)
+
+
+def build_query(q: str) -> str:
+    """把用户输入转换为 FTS5 查询：按空白分词，每个词作为一个短语，词之间为 AND"""
+    phrases = []
+    for term in q.split():
+        tokens = tokenize(term).split()
+        if tokens:
+            phrases.append('"' + ' '.join(tokens).replace('"', '""') + '"')
+    return ' '.join(phrases)
+
+
+class TranscriptStore:
+    """转录历史：SQLite 保存元数据和字幕行，FTS5 索引字幕文本
+
+    写入由后台线程逐条完成，不占用任务线程；全文索引为无内容表（只存倒排索引），
+    行文本只保存一份。列表和搜索都按自增 id 倒序并以 id 作为游标分页，
+    数据量增大后查询耗时基本不变。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._queue: queue.Queue = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        # fork 后不能复用父进程的连接
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS transcripts '
+                         '(id INTEGER PRIMARY KEY, job_id TEXT, sha256 TEXT, filename TEXT, '
+                         'created_at REAL NOT NULL, duration REAL, file_size REAL, file_type TEXT, '
+                         'lines INTEGER NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS lines '
+                         '(id INTEGER PRIMARY KEY, transcript_id INTEGER NOT NULL, '
+                         'start REAL NOT NULL, end REAL NOT NULL, text TEXT NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS lines_transcript ON lines (transcript_id, id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS transcripts_job ON transcripts (job_id)')
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS lines_fts USING fts5(text, content='')")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def start(self):
+        """启动后台写入线程"""
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, name='transcript-writer')
+                self._writer.daemon = True
+                self._writer.start()
+
+    def add(self, job_id: str, filename: str, sha256: str,
+            metadata: Dict[str, Any], track: SubtitleTrack):
+        """放入写入队列，立即返回"""
+        self.start()
+        self._queue.put((job_id, filename, sha256, dict(metadata), track, time.time()))
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                self._insert(*item)
+            except Exception as e:
+                logger.error(f"写入转录历史失败 {item[0]}: {str(e)}")
+
+    def _insert(self, job_id: str, filename: str, sha256: str,
+                metadata: Dict[str, Any], track: SubtitleTrack, created_at: float):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = conn.execute(
+                'INSERT INTO transcripts (job_id, sha256, filename, created_at, duration, file_size, '
+                'file_type, lines) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, sha256, filename, created_at, metadata.get('duration'),
+                 metadata.get('file_size'), metadata.get('file_type'), len(track))
+            )
+            transcript_id = cursor.lastrowid
+            first = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM lines').fetchone()[0]
+            rows = [(first + i, transcript_id, track.starts[i], track.ends[i], track.text(i))
+                    for i in range(len(track))]
+            conn.executemany('INSERT INTO lines (id, transcript_id, start, end, text) VALUES (?, ?, ?, ?, ?)',
+                             rows)
+            conn.executemany('INSERT INTO lines_fts (rowid, text) VALUES (?, ?)',
+                             ((row[0], tokenize(row[4])) for row in rows))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        logger.info(f"转录历史已保存: {filename} ({len(track)} 行)")
+
+    @staticmethod
+    def _transcript_dict(row: Tuple) -> Dict[str, Any]:
+        keys = ('id', 'job_id', 'sha256', 'filename', 'created_at', 'duration', 'file_size',
+                'file_type', 'lines')
+        return dict(zip(keys, row))
+
+    def list(self, limit: int, cursor: Optional[int] = None) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """按时间倒序列出转录记录，返回 (记录, 下一页游标)"""
+        rows = self._conn().execute(
+            'SELECT id, job_id, sha256, filename, created_at, duration, file_size, file_type, lines '
+            'FROM transcripts WHERE id < ? ORDER BY id DESC LIMIT ?',
+            (cursor if cursor is not None else 2 ** 63 - 1, limit + 1)
+        ).fetchall()
+        items = [self._transcript_dict(row) for row in rows[:limit]]
+        return items, (items[-1]['id'] if len(rows) > limit else None)
+
+    def get(self, transcript_id: int) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            'SELECT id, job_id, sha256, filename, created_at, duration, file_size, file_type, lines '
+            'FROM transcripts WHERE id = ?', (transcript_id,)
+        ).fetchone()
+        return self._transcript_dict(row) if row else None
+
+    def find_by_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """按任务 id 查找转录记录"""
+        row = self._conn().execute(
+            'SELECT id, job_id, sha256, filename, created_at, duration, file_size, file_type, lines '
+            'FROM transcripts WHERE job_id = ? ORDER BY id DESC LIMIT 1', (job_id,)
+        ).fetchone()
+        return self._transcript_dict(row) if row else None
+
+    def get_track(self, transcript_id: int) -> SubtitleTrack:
+        track = SubtitleTrack()
+        for start, end, text in self._conn().execute(
+                'SELECT start, end, text FROM lines WHERE transcript_id = ? ORDER BY id', (transcript_id,)):
+            track.append(start, end, text)
+        return track
+
+    def search(self, q: str, limit: int, cursor: Optional[int] = None
+               ) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """全文搜索字幕行，按时间倒序返回 (匹配行, 下一页游标)"""
+        query = build_query(q)
+        if not query:
+            return [], None
+        rows = self._conn().execute(
+            'SELECT l.id, l.transcript_id, t.filename, t.created_at, l.start, l.end, l.text '
+            'FROM (SELECT rowid FROM lines_fts WHERE lines_fts MATCH ? AND rowid < ? '
+            '      ORDER BY rowid DESC LIMIT ?) AS m '
+            'JOIN lines AS l ON l.id = m.rowid JOIN transcripts AS t ON t.id = l.transcript_id '
+            'ORDER BY l.id DESC',
+            (query, cursor if cursor is not None else 2 ** 63 - 1, limit + 1)
+        ).fetchall()
+        keys = ('line_id', 'transcript_id', 'filename', 'created_at', 'start', 'end', 'text')
+        items = [dict(zip(keys, row)) for row in rows[:limit]]
+        return items, (items[-1]['line_id'] if len(rows) > limit else None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        row = self._conn().execute('SELECT COUNT(*) FROM transcripts').fetchone()
+        return {'transcripts': row[0], 'pending': self._queue.qsize()}
+
+
+# 创建单例实例
+transcript_store = TranscriptStore(Config.TRANSCRIPT_DB_PATH)
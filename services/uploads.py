@@ -0,0 +1,176 @@
+import hashlib
+import os
+import time
+import uuid
+import zlib
+from typing import Dict, Any, List
+from loguru import logger
+from config import Config
+from services.ingest import detect_audio_format
+from services.state import state_backend
+from services.storage import upload_store, StorageFull
+
+
+class UploadSessionError(Exception):
+    """分块上传请求无效，status 为返回的 HTTP 状态码"""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+class ChunkedUploads:
+    """可续传的分块上传
+
+    创建会话时在 UPLOAD_FOLDER 中预分配 <id>.part 文件，各分块按偏移量直接写入，
+    不同分块可以并行上传、落到不同 worker 上。会话信息和已完成的分块记录在共享
+    状态中，断线后客户端查询缺失的分块继续上传；全部到齐后完成上传并转为普通任务。
+    """
+
+    def __init__(self, upload_folder: str, chunk_size: int, ttl: int):
+        self.upload_folder = upload_folder
+        self.chunk_size = chunk_size
+        self.ttl = ttl
+
+    def _part_path(self, upload_id: str) -> str:
+        return os.path.join(self.upload_folder, f"{upload_id}.part")
+
+    def _session(self, upload_id: str) -> Dict[str, Any]:
+        session = state_backend.get_json(f'upload:{upload_id}') if upload_id.isalnum() else None
+        if not session:
+            raise UploadSessionError("上传会话不存在或已过期", 404)
+        return session
+
+    def create(self, filename: str, size: int, client: str) -> Dict[str, Any]:
+        """创建上传会话，返回 upload_id、分块大小和分块数"""
+        if not filename or '.' not in filename or \
+                filename.rsplit('.', 1)[1].lower() not in Config.ALLOWED_EXTENSIONS:
+            raise UploadSessionError("文件无效或格式不支持")
+        if size <= 0:
+            raise UploadSessionError("文件为空")
+        if size > Config.MAX_CONTENT_LENGTH:
+            raise UploadSessionError("文件过大", 413)
+
+        try:
+            upload_store.make_room(size)
+        except StorageFull as e:
+            raise UploadSessionError(str(e), 507)
+        upload_id = uuid.uuid4().hex
+        chunks = (size + self.chunk_size - 1) // self.chunk_size
+        with open(self._part_path(upload_id), 'wb') as f:
+            f.truncate(size)
+        # 未完成的上传不持有引用，空间紧张时最久没有新分块的会话先被淘汰
+        upload_store.add(self._part_path(upload_id), refs=0)
+        session = {
+            'upload_id': upload_id,
+            'filename': filename,
+            'size': size,
+            'chunk_size': self.chunk_size,
+            'chunks': chunks,
+            'client': client,
+            'created_at': time.time(),
+        }
+        state_backend.put_json(f'upload:{upload_id}', session, ttl=self.ttl)
+        logger.info(f"创建分块上传: {upload_id} ({filename}, {size} 字节, {chunks} 块)")
+        return session
+
+    @staticmethod
+    def verify_checksum(data: bytes, checksum: str) -> bool:
+        """校验分块，checksum 形如 sha256=<hex> 或 crc32=<hex>"""
+        algorithm, _, expected = checksum.partition('=')
+        expected = expected.strip().lower()
+        if algorithm == 'sha256':
+            return hashlib.sha256(data).hexdigest() == expected
+        if algorithm == 'crc32':
+            return format(zlib.crc32(data), '08x') == expected.zfill(8)
+        raise UploadSessionError("不支持的校验算法")
+
+    def put_chunk(self, upload_id: str, index: int, data: bytes, checksum: str) -> Dict[str, Any]:
+        """写入一个分块，重复上传同一分块是幂等的"""
+        session = self._session(upload_id)
+        if not 0 <= index < session['chunks']:
+            raise UploadSessionError("分块序号无效")
+        offset = index * session['chunk_size']
+        expected = min(session['chunk_size'], session['size'] - offset)
+        if len(data) != expected:
+            raise UploadSessionError(f"分块大小应为 {expected} 字节")
+        if not checksum or not self.verify_checksum(data, checksum):
+            raise UploadSessionError("分块校验失败", 422)
+
+        try:
+            fd = os.open(self._part_path(upload_id), os.O_WRONLY)
+        except FileNotFoundError:
+            raise UploadSessionError("上传会话不存在或已完成", 404)
+        try:
+            os.pwrite(fd, data, offset)
+        finally:
+            os.close(fd)
+        upload_store.touch(self._part_path(upload_id))
+        state_backend.put_json(f'upload:{upload_id}:{index}', checksum, ttl=self.ttl)
+        return {'index': index, 'received': len(data)}
+
+    def received(self, upload_id: str) -> List[int]:
+        prefix = f'upload:{upload_id}:'
+        return sorted(int(key[len(prefix):]) for key in state_backend.get_json_prefix(prefix))
+
+    def status(self, upload_id: str) -> Dict[str, Any]:
+        """查询会话及已收到的分块，客户端据此续传缺失的分块"""
+        session = self._session(upload_id)
+        received = self.received(upload_id)
+        done = set(received)
+        session['received'] = received
+        session['missing'] = [i for i in range(session['chunks']) if i not in done]
+        return session
+
+    def complete(self, upload_id: str) -> Dict[str, Any]:
+        """所有分块到齐后校验格式、计算整体 SHA-256，返回最终文件信息"""
+        session = self.status(upload_id)
+        if session['missing']:
+            raise UploadSessionError(f"还有 {len(session['missing'])} 个分块未上传", 409)
+
+        part_path = self._part_path(upload_id)
+        digest = hashlib.sha256()
+        try:
+            with open(part_path, 'rb') as f:
+                head = f.read(12)
+                file_type = detect_audio_format(head)
+                digest.update(head)
+                while True:
+                    chunk = f.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+        except FileNotFoundError:
+            raise UploadSessionError("上传会话不存在或已完成", 404)
+        if file_type not in Config.ALLOWED_EXTENSIONS:
+            self.abort(upload_id)
+            raise UploadSessionError("文件无效或格式不支持")
+
+        filepath = os.path.join(self.upload_folder, f"{upload_id}.{file_type}")
+        try:
+            # 重命名是原子的，并发的重复完成请求只有一个成功
+            upload_store.rename(part_path, filepath)
+        except FileNotFoundError:
+            raise UploadSessionError("上传会话不存在或已完成", 404)
+        self._forget(upload_id, session['chunks'])
+        return {
+            'original_filename': session['filename'],
+            'filepath': filepath,
+            'sha256': digest.hexdigest(),
+            'client': session['client'],
+        }
+
+    def abort(self, upload_id: str):
+        session = self._session(upload_id)
+        upload_store.remove(self._part_path(upload_id))
+        self._forget(upload_id, session['chunks'])
+
+    @staticmethod
+    def _forget(upload_id: str, chunks: int):
+        state_backend.delete(f'upload:{upload_id}')
+        for index in range(chunks):
+            state_backend.delete(f'upload:{upload_id}:{index}')
+
+
+# 创建单例实例
+chunked_uploads = ChunkedUploads(Config.UPLOAD_FOLDER, Config.UPLOAD_CHUNK_SIZE, Config.UPLOAD_SESSION_TTL)
@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+# 在导入 config 之前把所有状态目录指向临时目录，不读写本机的真实数据
+_root = tempfile.mkdtemp(prefix='voice-tests-')
+os.environ.update({
+    'UPLOAD_FOLDER': os.path.join(_root, 'uploads'),
+    'CACHE_FOLDER': os.path.join(_root, 'cache'),
+    'FEISHU_OUTBOX_FOLDER': os.path.join(_root, 'outbox'),
+    'STATE_DB_PATH': os.path.join(_root, 'state.db'),
+    'TRANSCRIPT_DB_PATH': os.path.join(_root, 'transcripts.db'),
+    'FEISHU_WEBHOOK_URL': '',
+    'PUBLIC_BASE_URL': '',
+})
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
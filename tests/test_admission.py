@@ -0,0 +1,60 @@
+import pytest
+from config import Config
+from services.admission import AdmissionController, AdmissionRejected, PressureSignal
+
+
+def test_pressure_signal_hysteresis():
+    signal = PressureSignal('CPU', 'cpu_percent', True, high=90, low=75)
+    assert not signal.update(89)
+    assert signal.update(91)
+    # 回落到 high 以下但仍高于 low 时保持过载，避免在阈值附近抖动
+    assert signal.update(80)
+    assert signal.update(75)
+    assert not signal.update(74)
+    assert not signal.update(89)
+
+
+def test_disabled_signal_never_trips():
+    assert not PressureSignal('内存', 'memory_percent', False, high=90, low=75).update(100)
+
+
+@pytest.fixture
+def controller():
+    controller = AdmissionController()
+    controller.signals = [PressureSignal('CPU', 'cpu_percent', True, high=90, low=75)]
+    controller.max_queue = 3
+    controller.max_per_client = 2
+    return controller
+
+
+def test_rejects_under_pressure_until_recovered(controller):
+    with pytest.raises(AdmissionRejected, match='CPU'):
+        controller.check(0, 0, {'cpu_percent': 95})
+    # 没有新的采样时沿用上次的判断
+    with pytest.raises(AdmissionRejected):
+        controller.check(0, 0)
+    with pytest.raises(AdmissionRejected):
+        controller.check(0, 0, {'cpu_percent': 80})
+    controller.check(0, 0, {'cpu_percent': 70})
+    assert controller.get_stats()['rejected'] == 3
+    assert controller.get_stats()['admitted'] == 1
+
+
+def test_queue_and_client_limits(controller):
+    with pytest.raises(AdmissionRejected, match='队列已满'):
+        controller.check(3, 0)
+    with pytest.raises(AdmissionRejected, match='排队'):
+        controller.check(1, 2)
+    controller.check(2, 1, record=False)
+    assert controller.get_stats()['admitted'] == 0
+
+
+def test_retry_after_follows_observed_duration(controller):
+    controller.max_inflight = 2
+    assert controller.retry_after(3) == Config.ADMISSION_DEFAULT_DURATION * 2
+    controller.avg_duration = 10
+    assert controller.retry_after(3) == 20
+    controller.avg_duration = 0.01
+    assert controller.retry_after(0) == 1
+    controller.avg_duration = 10 ** 6
+    assert controller.retry_after(0) == Config.ADMISSION_MAX_RETRY_AFTER
@@ -0,0 +1,64 @@
+import os
+import time
+import pytest
+from services.cache import TranscriptCache
+from services.subtitles import SubtitleTrack
+
+
+def result(text):
+    track = SubtitleTrack()
+    track.append(0, 1, text)
+    return {'duration': 1.0, 'track': track}
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """同一缓存目录上的两个 worker"""
+    folder = str(tmp_path / 'cache')
+    return TranscriptCache(folder, 10 ** 6, 3600), TranscriptCache(folder, 10 ** 6, 3600)
+
+
+def test_entry_written_by_another_worker_is_a_hit(workers):
+    a, b = workers
+    assert not b.contains('k1')  # b 已加载过（空）索引
+    a.put('k1', result('第一条'))
+    assert b.contains('k1')
+    cached = b.get('k1')
+    assert cached['track'].text(0) == '第一条'
+    assert b.get_stats()['hits'] == 1
+
+
+def test_entry_evicted_by_another_worker_is_a_miss(workers):
+    a, b = workers
+    a.put('k1', result('第一条'))
+    assert b.get('k1')
+    os.remove(a._path('k1'))
+    assert not b.contains('k1')
+    assert b.get('k1') is None
+
+
+def test_quota_covers_the_whole_directory(tmp_path):
+    folder = str(tmp_path / 'cache')
+    a = TranscriptCache(folder, 10 ** 6, 3600)
+    a.put('k1', result('a' * 100))
+    entry_size = os.path.getsize(a._path('k1'))
+    limit = entry_size * 2 + entry_size // 2
+    a.max_bytes = limit
+    b = TranscriptCache(folder, limit, 3600)
+    time.sleep(0.01)
+    a.put('k2', result('b' * 100))
+    time.sleep(0.01)
+    b.get('k1')  # 命中更新 atime，k1 成为最近使用
+    time.sleep(0.01)
+    b.put('k3', result('c' * 100))
+    # b 写入时按整个目录计算容量，淘汰最久未使用的 k2
+    assert sorted(name[:-5] for name in os.listdir(folder)) == ['k1', 'k3']
+    assert b.get_stats()['bytes'] <= limit
+
+
+def test_expired_entry_is_removed(workers):
+    a, b = workers
+    a.put('k1', result('旧'))
+    b.ttl = -1
+    assert b.get('k1') is None
+    assert not os.path.exists(a._path('k1'))
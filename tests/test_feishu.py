@@ -0,0 +1,138 @@
+import json
+import os
+import pytest
+import requests
+from config import Config
+from services import feishu as feishu_module
+from services.feishu import FeishuService, FeishuSendError, OutboxItem
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, body=None):
+        self.status_code = status_code
+        self.text = json.dumps(body or {})
+        self._body = body
+
+    def json(self):
+        if self._body is None:
+            raise ValueError('不是 JSON')
+        return self._body
+
+
+class FakeSession:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.sent = []
+
+    def post(self, url, data, headers, timeout):
+        self.sent.append(json.loads(data)['content']['text'])
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'FEISHU_DEAD_LETTER_FILE', str(tmp_path / 'dead_letter.jsonl'))
+    monkeypatch.setattr(feishu_module.retry_budget, 'try_acquire', lambda: True)
+    service = FeishuService()
+    service.webhook_url = 'https://open.feishu.cn/hook/test'
+    service.outbox_dir = str(tmp_path / 'outbox')
+    os.makedirs(service.outbox_dir)
+    return service
+
+
+def use_session(monkeypatch, session):
+    monkeypatch.setattr(feishu_module.http_client, 'session', lambda name: session)
+
+
+def make_item(service, text, attempts=0):
+    path = os.path.join(service.outbox_dir, f'{text}.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'text': text, 'attempts': attempts}, f)
+    return OutboxItem(text, path, attempts)
+
+
+def dead_letters():
+    if not os.path.exists(Config.FEISHU_DEAD_LETTER_FILE):
+        return []
+    with open(Config.FEISHU_DEAD_LETTER_FILE, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.mark.parametrize('outcome, retryable', [
+    (FakeResponse(500), True),
+    (FakeResponse(429), True),
+    (requests.exceptions.Timeout('读取超时'), True),
+    (FakeResponse(200, {'code': 11232, 'msg': 'frequency limited'}), True),
+    (FakeResponse(200), True),
+    (FakeResponse(400, {'code': 9499, 'msg': 'Bad Request'}), False),
+    (FakeResponse(200, {'code': 19024, 'msg': 'Key Words Not Found'}), False),
+])
+def test_post_classifies_failures(service, monkeypatch, outcome, retryable):
+    use_session(monkeypatch, FakeSession(outcome))
+    with pytest.raises(FeishuSendError) as info:
+        service._post('你好')
+    assert info.value.retryable is retryable
+
+
+def test_missing_webhook_is_permanent_and_not_enqueued(service):
+    service.webhook_url = ''
+    with pytest.raises(FeishuSendError) as info:
+        service._post('你好')
+    assert not info.value.retryable
+
+    assert service.enqueue('你好') == 0
+    service.start_delivery()
+    assert service._worker is None
+    assert service.get_stats()['pending'] == 0
+
+
+def test_permanent_failure_is_dead_lettered_and_queue_moves_on(service, monkeypatch):
+    session = FakeSession(FakeResponse(200, {'code': 19021, 'msg': 'sign match fail'}),
+                          FakeResponse(200, {'code': 0}))
+    use_session(monkeypatch, session)
+    bad, good = make_item(service, 'bad'), make_item(service, 'good')
+
+    service._deliver_batch([bad])
+    assert not os.path.exists(bad.path)
+    assert [(d['text'], d['attempts']) for d in dead_letters()] == [('bad', 1)]
+    assert service.get_stats()['pending'] == 0
+
+    service._deliver_batch([good])
+    assert session.sent == ['bad', 'good']
+    assert service.get_stats()['sent'] == 1
+    assert service.get_stats()['dead_letters'] == 1
+
+
+def test_rejected_merged_batch_is_retried_one_by_one(service, monkeypatch):
+    use_session(monkeypatch, FakeSession(FakeResponse(200, {'code': 19024, 'msg': 'Key Words Not Found'})))
+    first, second = make_item(service, 'first'), make_item(service, 'second')
+
+    service._deliver_batch([first, second])
+    assert dead_letters() == []
+    with service._cond:
+        assert service._next_batch() == [first]
+        assert service._next_batch() == [second]
+    assert first.next_attempt_at == 0
+
+
+def test_retryable_failure_backs_off_until_max_attempts(service, monkeypatch):
+    monkeypatch.setattr(Config, 'FEISHU_MAX_ATTEMPTS', 3)
+    use_session(monkeypatch, FakeSession(FakeResponse(503), FakeResponse(503), FakeResponse(503)))
+    item = make_item(service, 'flaky')
+
+    for attempt in (1, 2):
+        service._deliver_batch([item])
+        with service._cond:
+            assert service._next_batch() == [item]
+        assert item.attempts == attempt
+        with open(item.path, encoding='utf-8') as f:
+            assert json.load(f)['attempts'] == attempt  # 重启后累计次数不丢失
+    assert dead_letters() == []
+
+    service._deliver_batch([item])
+    assert [d['attempts'] for d in dead_letters()] == [3]
+    assert not os.path.exists(item.path)
+    assert service.get_stats()['pending'] == 0
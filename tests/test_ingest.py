@@ -0,0 +1,194 @@
+import hashlib
+import io
+import os
+import threading
+import pytest
+from services.ingest import StreamingIngest, IngestError, detect_audio_format
+
+BOUNDARY = b'----test-boundary'
+AUDIO = b'ID3\x04\x00\x00' + bytes(range(256)) * 40
+
+
+def multipart(data: bytes, filename: str = 'talk.mp3', field: str = 'audio', close: bool = True) -> bytes:
+    body = (b'--' + BOUNDARY + b'\r\n'
+            b'Content-Disposition: form-data; name="note"\r\n\r\nhello\r\n'
+            b'--' + BOUNDARY + b'\r\n'
+            b'Content-Disposition: form-data; name="' + field.encode() + b'"; filename="' + filename.encode() + b'"\r\n'
+            b'Content-Type: application/octet-stream\r\n\r\n' + data + b'\r\n')
+    if close:
+        body += b'--' + BOUNDARY + b'--\r\n'
+    return body
+
+
+@pytest.fixture
+def ingest(tmp_path):
+    # 小分块，覆盖魔数和边界跨分块的情况
+    return StreamingIngest(str(tmp_path), chunk_size=7)
+
+
+def test_saves_file_and_digest(ingest, tmp_path):
+    result = ingest.ingest(io.BytesIO(multipart(AUDIO)), BOUNDARY)
+    assert result['file_type'] == 'mp3'
+    assert result['original_filename'] == 'talk.mp3'
+    assert result['size'] == len(AUDIO)
+    assert result['sha256'] == hashlib.sha256(AUDIO).hexdigest()
+    with open(result['filepath'], 'rb') as f:
+        assert f.read() == AUDIO
+
+
+def test_tiny_file(ingest):
+    result = ingest.ingest(io.BytesIO(multipart(b'ID3\x04')), BOUNDARY)
+    with open(result['filepath'], 'rb') as f:
+        assert f.read() == b'ID3\x04'
+
+
+@pytest.mark.parametrize('data', [
+    b'ID3\x04',
+    AUDIO,
+    AUDIO + b'\r',
+    AUDIO + b'\r\r\n',
+    b'ID3\x04' + b'\r\n--' + BOUNDARY[:-1] + b'\r' * 3,
+], ids=['tiny', 'audio', 'trailing-cr', 'trailing-crlf', 'partial-boundary'])
+def test_chunk_alignment_does_not_change_content(tmp_path, data):
+    # 分块在边界分隔符的 \r 和 \n 之间切开时，不能把分隔符写进文件
+    body = multipart(data)
+    for chunk_size in range(1, 200):
+        result = StreamingIngest(str(tmp_path), chunk_size=chunk_size).ingest(io.BytesIO(body), BOUNDARY)
+        with open(result['filepath'], 'rb') as f:
+            assert f.read() == data, f'chunk_size={chunk_size}'
+        assert result['sha256'] == hashlib.sha256(data).hexdigest()
+        os.remove(result['filepath'])
+
+
+def test_truncated_body_is_rejected(ingest, tmp_path):
+    body = multipart(AUDIO, close=False)[:-200]
+    with pytest.raises(IngestError, match='上传不完整'):
+        ingest.ingest(io.BytesIO(body), BOUNDARY)
+    assert os.listdir(tmp_path) == []
+
+
+def test_missing_closing_boundary_is_rejected(ingest, tmp_path):
+    with pytest.raises(IngestError):
+        ingest.ingest(io.BytesIO(multipart(AUDIO, close=False)), BOUNDARY)
+    assert os.listdir(tmp_path) == []
+
+
+def test_malformed_body_is_rejected(ingest, tmp_path):
+    body = b'--' + BOUNDARY + b'\r\nno headers terminator' + b'x' * 200
+    with pytest.raises(IngestError):
+        ingest.ingest(io.BytesIO(body), BOUNDARY)
+    assert os.listdir(tmp_path) == []
+
+
+def test_unsupported_format(ingest, tmp_path):
+    with pytest.raises(IngestError, match='格式不支持'):
+        ingest.ingest(io.BytesIO(multipart(b'%PDF-1.7' + b'\0' * 100, 'talk.mp3')), BOUNDARY)
+    assert os.listdir(tmp_path) == []
+
+
+def test_missing_field(ingest):
+    with pytest.raises(IngestError, match='没有文件'):
+        ingest.ingest(io.BytesIO(multipart(AUDIO, field='other')), BOUNDARY)
+
+
+def test_passthrough_receives_the_same_bytes(ingest):
+    def passthrough(filename, chunks):
+        return filename, b''.join(chunks)
+
+    result = ingest.ingest(io.BytesIO(multipart(AUDIO)), BOUNDARY, passthrough=passthrough)
+    filename, data = result['hosted'].result(timeout=5)
+    assert filename == result['filename']
+    assert data == AUDIO
+
+
+def test_passthrough_is_aborted_on_truncated_body(ingest):
+    received = []
+
+    def passthrough(filename, chunks):
+        for chunk in chunks:
+            received.append(chunk)
+        return 'hosted'
+
+    with pytest.raises(IngestError):
+        ingest.ingest(io.BytesIO(multipart(AUDIO, close=False)[:-200]), BOUNDARY, passthrough=passthrough)
+
+
+def blocking_passthrough():
+    """读到第一块后等待放行的直通上传，返回 (passthrough, 已开始, 放行)"""
+    started, release = threading.Event(), threading.Event()
+
+    def passthrough(filename, chunks):
+        chunks = iter(chunks)
+        next(chunks)
+        started.set()
+        release.wait(5)
+        return b''.join(chunks)
+
+    return passthrough, started, release
+
+
+def test_running_passthrough_can_be_aborted(tmp_path):
+    ingest = StreamingIngest(str(tmp_path), chunk_size=64 * 1024)
+    passthrough, started, release = blocking_passthrough()
+    result = ingest.ingest(io.BytesIO(multipart(AUDIO)), BOUNDARY, passthrough=passthrough)
+    assert started.wait(5)
+
+    assert not result['hosted'].cancel()
+    result['abort_hosted']()
+    release.set()
+    assert result['hosted'].result(timeout=5) is None
+
+
+@pytest.mark.parametrize('head, expected', [
+    (b'ID3\x04\x00\x00\x00\x00\x00\x00\x00\x00', 'mp3'),
+    (b'\xff\xfb\x90\x00' + b'\0' * 8, 'mp3'),
+    (b'\0\0\0\x20ftypM4A ', 'm4a'),
+    (b'RIFF\0\0\0\0WAVE', 'wav'),
+    (b'OggS' + b'\0' * 8, 'ogg'),
+    (b'%PDF-1.7' + b'\0' * 4, None),
+])
+def test_detect_audio_format(head, expected):
+    assert detect_audio_format(head) == expected
+
+
+@pytest.fixture
+def client():
+    import app as app_module
+    os.makedirs(app_module.Config.UPLOAD_FOLDER, exist_ok=True)
+    return app_module.app.test_client()
+
+
+@pytest.mark.parametrize('body, error', [
+    (multipart(AUDIO, close=False)[:-200], '上传不完整'),
+    (b'--' + BOUNDARY + b'\r\nno headers terminator' + b'x' * 200, None),
+], ids=['truncated', 'malformed'])
+def test_upload_rejects_bad_bodies_with_400(client, body, error):
+    response = client.post('/upload', data=body,
+                           content_type='multipart/form-data; boundary=' + BOUNDARY.decode())
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+    if error:
+        assert response.get_json()['error'] == error
+
+
+def test_rejected_upload_stops_running_passthrough(client, monkeypatch):
+    import app as app_module
+    passthrough, started, release = blocking_passthrough()
+    uploads = []
+    ingest = app_module.streaming_ingest.ingest
+    monkeypatch.setattr(app_module.Config, 'STREAMING_PASSTHROUGH', True)
+    monkeypatch.setattr(app_module.transcription_service, 'upload_stream', passthrough)
+    monkeypatch.setattr(app_module.streaming_ingest, 'ingest',
+                        lambda *args: uploads.append(ingest(*args)) or uploads[-1])
+
+    def reject(filepath):
+        assert started.wait(5)  # 直通上传已在进行，Future 无法再取消
+        return '文件已损坏'
+
+    monkeypatch.setattr(app_module, 'reject_unreadable', reject)
+    response = client.post('/upload', data=multipart(AUDIO),
+                           content_type='multipart/form-data; boundary=' + BOUNDARY.decode())
+    assert response.status_code == 400
+
+    release.set()
+    assert uploads[0]['hosted'].result(timeout=5) is None
@@ -0,0 +1,103 @@
+import json
+import threading
+import pytest
+from services import jobs as jobs_module
+from services.jobs import JobQueue
+
+
+@pytest.fixture
+def queue():
+    return JobQueue(max_workers=2)
+
+
+def run(queue, handler, *args, client='client'):
+    job = queue.submit('talk.mp3', handler, *args, client=client)
+    assert queue.wait_any([job.id], timeout=5), '任务没有结束'
+    return queue.get(job.id)
+
+
+def test_job_result(queue):
+    snapshot = run(queue, lambda job, x: {'value': x * 2}, 21)
+    assert snapshot['status'] == 'done'
+    assert snapshot['result'] == {'value': 42}
+    assert queue.get_stats()['running'] == 0
+
+
+def test_failed_job(queue):
+    def handler(job):
+        raise RuntimeError('转录失败')
+
+    snapshot = run(queue, handler)
+    assert snapshot['status'] == 'failed'
+    assert snapshot['error'] == '转录失败'
+    assert queue.get_stats()['running'] == 0
+
+
+def test_job_finishes_when_slot_release_fails(queue, monkeypatch):
+    leaked = []
+    controller = jobs_module.admission_controller
+
+    def release(holder, duration=None):
+        leaked.append(holder)
+        raise RuntimeError('database is locked')
+
+    monkeypatch.setattr(controller, 'release', release)
+    try:
+        snapshot = run(queue, lambda job: {'ok': True})
+        assert snapshot['status'] == 'done'
+        assert queue.get_stats()['running'] == 0
+        # 本进程的执行线程没有泄漏，后续任务照常执行
+        assert run(queue, lambda job: {'ok': True})['status'] == 'done'
+    finally:
+        for holder in leaked:
+            jobs_module.state_backend.release_slot(controller.SLOT_KEY, holder)
+
+
+def test_events_end_with_done(queue):
+    started = threading.Event()
+    release = threading.Event()
+
+    def handler(job):
+        started.set()
+        queue.update(job.id, 'transcribing')
+        release.wait(5)
+        return {'lines': 0}
+
+    job = queue.submit('talk.mp3', handler)
+    started.wait(5)
+    release.set()
+    events = [chunk for chunk in queue.stream_events(job.id, heartbeat=1) if chunk.startswith('event:')]
+    names = [chunk.split('\n')[0][len('event: '):] for chunk in events]
+    assert names[0] == 'stage'
+    assert names[-1] == 'done'
+    stages = [json.loads(chunk.split('data: ', 1)[1])['stage'] for chunk in events if 'event: stage' in chunk]
+    assert stages == ['queued', 'transcribing']
+
+
+def test_streamed_lines_precede_done(queue):
+    attached = threading.Event()
+    release = threading.Event()
+
+    def handler(job):
+        live = queue.attach_transcript(job.id)
+        attached.set()
+        release.wait(5)
+        live.append(0.0, 1.0, '第一行')
+        live.append(1.0, 2.0, '第二行')
+        return {'lines': 2}
+
+    job = queue.submit('talk.mp3', handler)
+    attached.wait(5)
+    stream = queue.stream_events(job.id, heartbeat=1)
+    chunks = [next(stream)]  # 订阅后再输出字幕行
+    release.set()
+    chunks += list(stream)
+    names = [chunk.split('\n')[0] for chunk in chunks if chunk.startswith('event:')]
+    lines = []
+    for chunk in chunks:
+        if chunk.startswith('event: lines'):
+            lines += json.loads(chunk.split('data: ', 1)[1])['lines']
+    assert len(lines) == 2
+    assert '第一行' in lines[0] and '第二行' in lines[1]
+    assert names[-1] == 'event: done'
+    assert names.index('event: done') > max(i for i, name in enumerate(names) if name == 'event: lines')
@@ -0,0 +1,77 @@
+import pytest
+from services import transcription as transcription_module
+from services.leases import HostedUrlLeases, derived_key, hosted_leases
+from services.media import media_service
+from services.retry import RetryPolicy
+from services.transcription import transcription_service
+
+
+@pytest.fixture
+def uploads(monkeypatch):
+    """记录实际上传次数，托管地址的 HEAD 校验一律成功"""
+    calls = []
+
+    def upload(file_path, policy):
+        calls.append(file_path)
+        return 'catbox', f'https://files.example/{len(calls)}'
+
+    monkeypatch.setattr(transcription_service.host_selector, 'upload', upload)
+    monkeypatch.setattr(HostedUrlLeases, 'check', staticmethod(lambda url: 200))
+    return calls
+
+
+def test_host_reuses_lease_without_hashing(uploads, monkeypatch, tmp_path):
+    monkeypatch.setattr(transcription_module, 'file_digest',
+                        lambda path: pytest.fail('已知摘要时不应重新读取文件'))
+    first, second = tmp_path / 'a.mp3', tmp_path / 'b.mp3'
+    first.write_bytes(b'a')
+    second.write_bytes(b'a')
+    policy = RetryPolicy(60)
+
+    hosted = transcription_service.host(str(first), policy, 'sha-reuse')
+    assert transcription_service.host(str(second), policy, 'sha-reuse') == hosted
+    assert uploads == [str(first)]
+    hosted_leases.invalidate('sha-reuse')
+
+
+def test_host_hashes_when_digest_unknown(uploads, tmp_path):
+    path = tmp_path / 'a.mp3'
+    path.write_bytes(b'same content')
+    policy = RetryPolicy(60)
+    transcription_service.host(str(path), policy)
+    transcription_service.host(str(path), policy)
+    assert len(uploads) == 1
+    hosted_leases.invalidate(transcription_module.file_digest(str(path)))
+
+
+def test_transcoded_key_derives_from_source(monkeypatch, tmp_path):
+    source = tmp_path / 'talk.wav'
+    source.write_bytes(b'\0' * 4 * 1024 * 1024)
+    output = tmp_path / 'talk.mp3'
+    monkeypatch.setattr(media_service, 'get_duration', lambda path: 600.0)
+    monkeypatch.setattr(media_service, 'transcode_for_speech', lambda path, duration: str(output))
+
+    transcoded, key = transcription_service.transcode(str(source), digest='sha-source')
+    assert transcoded == str(output)
+    assert key == derived_key('sha-source', 'mp3:24k:16000hz:mono')
+    # 不转码时仍使用源文件的摘要
+    monkeypatch.setattr(media_service, 'transcode_for_speech', lambda path, duration: None)
+    assert transcription_service.transcode(str(source), digest='sha-source') == (None, 'sha-source')
+
+
+def test_segments_are_keyed_by_source_and_range(monkeypatch, tmp_path):
+    paths = [str(tmp_path / f'{i}.mp3') for i in range(3)]
+    monkeypatch.setattr(media_service, 'segment_audio', lambda path, seconds: list(zip(paths, [0.0, 598.5, 1201.25])))
+    keys = {}
+
+    def transcribe(path, on_progress=None, policy=None, digest=None, **kwargs):
+        keys[path] = digest
+        return transcription_service.build_result(transcription_module.SubtitleTrack())
+
+    monkeypatch.setattr(transcription_service, 'transcribe', transcribe)
+    assert transcription_service.transcribe_segmented('talk.mp3', digest='sha-long')
+    assert keys == {
+        paths[0]: derived_key('sha-long', 'segment:0.000-598.500'),
+        paths[1]: derived_key('sha-long', 'segment:598.500-1201.250'),
+        paths[2]: derived_key('sha-long', 'segment:1201.250-end'),
+    }
@@ -0,0 +1,55 @@
+import os
+import pytest
+from services.lifecycle import Lifecycle
+
+
+def in_child(fn) -> int:
+    """在 fork 出的子进程中运行 fn，返回其退出码"""
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            code = fn()
+        finally:
+            os._exit(code)
+    return os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+
+
+@pytest.fixture
+def lock_path(tmp_path):
+    return str(tmp_path / 'leader.lock')
+
+
+def test_registering_before_fork_does_not_elect(lock_path, tmp_path):
+    marker = tmp_path / 'ran'
+    lifecycle = Lifecycle(lock_path)
+    lifecycle.on_leader(lambda: marker.write_text(str(os.getpid())))
+
+    # 相当于 --preload 的 master：只注册任务，不启动
+    assert not lifecycle.is_leader
+    assert lifecycle.leader_pid() is None
+
+    def worker():
+        lifecycle.start()
+        return 0 if lifecycle.is_leader and lifecycle.leader_pid() == os.getpid() else 1
+
+    assert in_child(worker) == 0
+    assert int(marker.read_text()) != os.getpid()
+    assert not lifecycle.is_leader
+
+
+def test_child_of_started_process_cannot_steal_leadership(lock_path):
+    lifecycle = Lifecycle(lock_path)
+    lifecycle.start()
+    assert lifecycle.is_leader
+
+    def worker():
+        # fork 后继承的状态已清空，子进程启动前不参与选举
+        if lifecycle.is_leader or lifecycle._try_elect():
+            return 1
+        lifecycle._fd = os.open(lock_path, os.O_RDWR)
+        lifecycle._pid = os.getpid()
+        return 0 if not lifecycle._try_elect() else 1
+
+    assert in_child(worker) == 0
+    assert lifecycle.leader_pid() == os.getpid()
@@ -0,0 +1,92 @@
+import subprocess
+import sys
+import time
+import pytest
+from services import metrics as metrics_module
+from services.metrics import MetricsRegistry, HOSTNAME, RETIRED_KEY, SNAPSHOT_PREFIX, _Family
+from services.state import state_backend
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    for key in state_backend.get_json_prefix(SNAPSHOT_PREFIX):
+        state_backend.delete(key)
+    state_backend.delete(RETIRED_KEY)
+    yield
+
+
+def counter_value(text, name):
+    for line in text.splitlines():
+        if line.startswith(name + ' '):
+            return float(line.split()[1])
+    return None
+
+
+def dead_pid():
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    return proc.pid
+
+
+def put_snapshot(key, registry, host=HOSTNAME, pid=None, flushed_at=None):
+    state_backend.put_json(SNAPSHOT_PREFIX + key, {
+        'host': host,
+        'pid': pid if pid is not None else dead_pid(),
+        'flushed_at': flushed_at if flushed_at is not None else time.time(),
+        'families': registry.snapshot()
+    })
+
+
+def make_registry(count):
+    registry = MetricsRegistry()
+    registry.counter('test_requests_total', '请求数').labels().inc(count)
+    return registry
+
+
+def test_family_requires_new_child():
+    with pytest.raises(TypeError):
+        _Family('test', '测试', ())
+
+
+def test_merges_live_workers():
+    registry = make_registry(2)
+    put_snapshot('other:1:a', make_registry(3), host='other-node', pid=1)
+    assert counter_value(registry.render(), 'test_requests_total') == 5
+
+
+def test_dead_worker_is_folded_into_retired_total():
+    registry = make_registry(2)
+    put_snapshot('local:dead:a', make_registry(3))
+    put_snapshot('other:1:b', make_registry(4), host='other-node', pid=1,
+                 flushed_at=time.time() - metrics_module.Config.METRICS_RETIRE_AFTER - 1)
+
+    assert counter_value(registry.render(), 'test_requests_total') == 9
+    # 快照已删除，计数保留在累计值中，重复汇总不会重复计入
+    assert set(state_backend.get_json_prefix(SNAPSHOT_PREFIX)) == {registry._key()}
+    assert counter_value(registry.render(), 'test_requests_total') == 9
+
+
+def test_concurrent_retire_counts_once():
+    put_snapshot('local:dead:c', make_registry(3))
+    dead = state_backend.get_json_prefix(SNAPSHOT_PREFIX)
+    first, second = MetricsRegistry(), MetricsRegistry()
+    first._retire(dead)
+    # 另一个 worker 读到的是同一份旧快照
+    retired = second._retire(dead)
+    assert retired['families']['test_requests_total']['series']['[]'] == [3]
+
+
+def test_stale_node_that_comes_back_counts_once():
+    registry = make_registry(2)
+    stale_at = time.time() - metrics_module.Config.METRICS_RETIRE_AFTER - 1
+    put_snapshot('other:1:d', make_registry(3), host='other-node', pid=1, flushed_at=stale_at)
+    assert counter_value(registry.render(), 'test_requests_total') == 5
+
+    # 节点恢复后在同一个键下继续写入，只计入并入之后的增量
+    put_snapshot('other:1:d', make_registry(7), host='other-node', pid=1)
+    assert counter_value(registry.render(), 'test_requests_total') == 9
+
+    # 再次失联时只并入增量
+    put_snapshot('other:1:d', make_registry(8), host='other-node', pid=1, flushed_at=stale_at + 0.5)
+    assert counter_value(registry.render(), 'test_requests_total') == 10
+    assert counter_value(registry.render(), 'test_requests_total') == 10
@@ -0,0 +1,86 @@
+import struct
+import wave
+import pytest
+from services.probe import ProbeError, probe_audio
+
+# MPEG-1 Layer III，128kbps，44100Hz，立体声：每帧 417 字节、1152 个采样
+MP3_HEADER = b'\xff\xfb\x90\x64'
+MP3_FRAME = MP3_HEADER + b'\0' * 413
+
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def id3(size=100):
+    # syncsafe 长度：每字节只用低 7 位
+    return b'ID3\x03\x00\x00' + bytes([(size >> 21) & 0x7f, (size >> 14) & 0x7f, (size >> 7) & 0x7f,
+                                        size & 0x7f]) + b'\0' * size
+
+
+def box(kind, payload):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def test_wav(tmp_path):
+    path = str(tmp_path / 'speech.wav')
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(16000)
+        w.writeframes(b'\0\0' * 16000 * 3)
+    info = probe_audio(path)
+    assert info == {'format': 'wav', 'codec': 'pcm', 'duration': 3.0, 'sample_rate': 16000,
+                    'channels': 1, 'bitrate': 256000}
+
+
+def test_cbr_mp3_with_id3(tmp_path):
+    info = probe_audio(write(tmp_path, 'talk.mp3', id3() + MP3_FRAME * 100))
+    assert info['codec'] == 'mp3'
+    assert (info['sample_rate'], info['channels']) == (44100, 2)
+    # 不带填充字节的帧，平均码率略低于标称的 128kbps
+    assert info['bitrate'] == pytest.approx(128000, rel=0.01)
+    assert info['duration'] == pytest.approx(100 * 1152 / 44100, abs=0.01)
+
+
+def test_vbr_mp3_uses_xing_frame_count(tmp_path):
+    # 立体声 MPEG-1 的边信息为 32 字节，Xing 头紧随其后
+    xing = MP3_HEADER + b'\0' * 32 + b'Xing' + struct.pack('>II', 1, 1000)
+    first = xing + b'\0' * (417 - len(xing))
+    info = probe_audio(write(tmp_path, 'vbr.mp3', first + MP3_FRAME * 10))
+    assert info['duration'] == pytest.approx(1000 * 1152 / 44100, abs=0.001)
+
+
+def test_opus(tmp_path):
+    def page(granule, packet):
+        return (b'OggS\x00\x02' + struct.pack('<q', granule) + b'\x01\x00\x00\x00' + b'\0' * 8 +
+                bytes([1, len(packet)]) + packet)
+    head = b'OpusHead\x01\x02' + struct.pack('<HI', 312, 48000) + b'\0\0\0'
+    info = probe_audio(write(tmp_path, 'voice.ogg', page(0, head) + page(48000 * 5 + 312, b'\0' * 20)))
+    assert (info['codec'], info['channels'], info['sample_rate']) == ('opus', 2, 48000)
+    assert info['duration'] == 5.0
+
+
+def test_m4a(tmp_path):
+    mvhd = box(b'mvhd', b'\0' * 12 + struct.pack('>II', 1000, 90500) + b'\0' * 80)
+    entry = box(b'mp4a', b'\0' * 6 + b'\0\x01' + b'\0' * 8 + struct.pack('>HHHHI', 1, 16, 0, 0, 22050 << 16))
+    stsd = box(b'stsd', b'\0' * 4 + struct.pack('>I', 1) + entry)
+    trak = box(b'trak', box(b'mdia', box(b'minf', box(b'stbl', stsd))))
+    data = box(b'ftyp', b'M4A \0\0\0\0') + box(b'moov', mvhd + trak) + box(b'mdat', b'\0' * 1000)
+    info = probe_audio(write(tmp_path, 'memo.m4a', data))
+    assert (info['codec'], info['channels'], info['sample_rate'], info['duration']) == ('aac', 1, 22050, 90.5)
+
+
+@pytest.mark.parametrize('name,data,message', [
+    ('talk.mp3', id3() + b'\0' * 5000, '未找到有效的 MP3'),
+    ('talk.mp3', b'RIFF\0\0\0\0WAVEfmt ', '与扩展名'),
+    ('talk.wav', b'RIFF\0\0\0\0WAVEfmt \x10\0\0\0', 'fmt'),
+    ('memo.m4a', box(b'ftyp', b'M4A \0\0\0\0') + box(b'mdat', b'\0' * 100), 'moov'),
+    ('voice.ogg', b'OggS' + b'\0' * 30, '不支持'),
+    ('notes.txt', b'hello world, not audio', '无法识别'),
+], ids=['mp3-no-frames', 'wrong-extension', 'wav-truncated', 'm4a-no-moov', 'ogg-unknown', 'not-audio'])
+def test_rejects_broken_files(tmp_path, name, data, message):
+    with pytest.raises(ProbeError, match=message):
+        probe_audio(write(tmp_path, name, data))
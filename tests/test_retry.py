@@ -0,0 +1,80 @@
+import threading
+import time
+import uuid
+import pytest
+from services import retry as retry_module
+from services.retry import DeadlineExceeded, RetryBudget, RetryPolicy, backoff_delay
+
+
+@pytest.fixture
+def budget():
+    # 每个用例使用独立的令牌桶，补充速率低到测试期间可以忽略
+    return RetryBudget(f'test-budget-{uuid.uuid4().hex}', rate=0.001, capacity=3)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(retry_module.Config, 'RETRY_DELAY', 0.001)
+    monkeypatch.setattr(retry_module.Config, 'RETRY_MAX_DELAY', 0.001)
+
+
+def test_backoff_is_capped_and_jittered():
+    delays = [backoff_delay(attempt, 5, 60) for attempt in range(1, 10) for _ in range(20)]
+    assert all(0 <= d <= 60 for d in delays)
+    assert max(backoff_delay(1, 5, 60) for _ in range(50)) <= 5
+    assert len(set(delays)) > 1
+
+
+def test_budget_is_shared_and_exhausts(budget):
+    other = RetryBudget(budget.key, budget.rate, budget.capacity)
+    assert budget.try_acquire() and other.try_acquire() and budget.try_acquire()
+    assert not other.try_acquire()
+    assert budget.get_stats()['granted'] == 2
+    assert other.get_stats()['denied'] == 1
+
+
+def test_budget_fails_open_when_state_unavailable(budget, monkeypatch):
+    def broken(*args):
+        raise OSError('状态后端不可用')
+
+    monkeypatch.setattr(retry_module.state_backend, 'take_token', broken)
+    assert budget.try_acquire()
+
+
+def test_retry_stops_at_max_attempts(budget):
+    policy = RetryPolicy(60, max_attempts=3, budget=budget)
+    assert policy.retry(Exception('1'))
+    assert policy.retry(Exception('2'))
+    assert not policy.retry(Exception('3'))
+    assert budget.get_stats()['granted'] == 2
+
+
+def test_retry_stops_when_budget_is_spent(budget):
+    policies = [RetryPolicy(60, max_attempts=10, budget=budget) for _ in range(2)]
+    results = [policy.retry(Exception('失败')) for policy in policies for _ in range(2)]
+    assert results == [True, True, True, False]
+
+
+def test_deadline_bounds_timeouts(budget):
+    policy = RetryPolicy(0.2, budget=budget)
+    assert policy.timeout(30) <= 0.2
+    time.sleep(0.25)
+    assert not policy.allow_retry()
+    with pytest.raises(DeadlineExceeded):
+        policy.timeout(30)
+    assert policy.cancelled
+
+
+def test_cancel_propagates_to_children(budget, monkeypatch):
+    monkeypatch.setattr(retry_module, 'backoff_delay', lambda attempt, base, cap: 30)
+    parent = RetryPolicy(120, budget=budget)
+    child = parent.child(max_attempts=5)
+    assert child.deadline == parent.deadline
+
+    threading.Timer(0.05, parent.cancel).start()
+    started = time.time()
+    # 子策略在退避等待中被父策略取消，立即结束且不再重试
+    assert not child.retry(Exception('失败'))
+    assert time.time() - started < 5
+    with pytest.raises(DeadlineExceeded):
+        child.check()
@@ -0,0 +1,81 @@
+import threading
+import pytest
+from services.state import (KeyValueClient, LocalKeyValueStore, NetworkStateBackend, SQLiteStateBackend,
+                            StateBackend)
+
+
+@pytest.fixture(params=['sqlite', 'network'])
+def backend(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteStateBackend(str(tmp_path / 'state.db'))
+    return NetworkStateBackend(LocalKeyValueStore())
+
+
+def in_threads(fn, count=8):
+    threads = [threading.Thread(target=fn) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_interfaces_are_abstract():
+    with pytest.raises(TypeError):
+        StateBackend()
+    with pytest.raises(TypeError):
+        KeyValueClient()
+
+
+def test_local_store_cas_checks_version():
+    store = LocalKeyValueStore()
+    assert store.get('k') == (None, 0)
+    assert store.cas('k', 0, 'a')
+    assert not store.cas('k', 0, 'b')
+    assert store.get('k') == ('a', 1)
+    assert store.cas('k', 1, 'b')
+    assert store.get('k') == ('b', 2)
+
+
+def test_incr_is_atomic(backend):
+    in_threads(lambda: [backend.incr('requests', floor=0) for _ in range(50)])
+    assert backend.get_counter('requests') == 400
+    assert backend.incr('requests', -1000, floor=0) == 0
+
+
+def test_update_json_is_atomic(backend):
+    in_threads(lambda: [backend.update_json('doc', lambda old: {'n': (old or {'n': 0})['n'] + 1})
+                        for _ in range(25)])
+    assert backend.get_json('doc') == {'n': 200}
+
+
+def test_slots_respect_limit(backend):
+    assert backend.acquire_slot('run', 'a', 2, ttl=60)
+    assert backend.acquire_slot('run', 'b', 2, ttl=60)
+    assert not backend.acquire_slot('run', 'c', 2, ttl=60)
+    # 重复占用同一 holder 只续租
+    assert backend.acquire_slot('run', 'a', 2, ttl=60)
+    assert backend.count_slots('run') == 2
+    backend.release_slot('run', 'a')
+    assert backend.acquire_slot('run', 'c', 2, ttl=60)
+
+
+def test_expired_slots_are_reclaimed(backend):
+    assert backend.acquire_slot('run', 'crashed', 1, ttl=-1)
+    assert backend.count_slots('run') == 0
+    assert backend.acquire_slot('run', 'next', 1, ttl=60)
+
+
+def test_json_prefix_skips_expired(backend):
+    backend.put_json('jobs:1', {'id': 1})
+    backend.put_json('jobs:2', {'id': 2}, ttl=-1)
+    backend.put_json('other', {'id': 3})
+    assert backend.get_json_prefix('jobs:') == {'jobs:1': {'id': 1}}
+    backend.delete('jobs:1')
+    assert backend.get_json('jobs:1') is None
+
+
+def test_network_backend_gives_up_after_conflicts(monkeypatch):
+    store = LocalKeyValueStore()
+    monkeypatch.setattr(store, 'cas', lambda *args: False)
+    with pytest.raises(RuntimeError):
+        NetworkStateBackend(store).put_json('k', 1)
@@ -0,0 +1,94 @@
+import os
+import time
+import pytest
+from config import Config
+from services.storage import UploadStore, StorageFull
+
+ORPHAN_AGE = 600
+
+
+@pytest.fixture
+def store(tmp_path):
+    # 磁盘阈值 100% 时只有字节配额生效
+    return UploadStore(str(tmp_path), quota=1000, disk_threshold=100, orphan_age=ORPHAN_AGE)
+
+
+def write(folder, name, size, age=0.0):
+    path = os.path.join(folder, name)
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+    if age:
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_scanned_files_of_other_workers_are_not_evicted(store, tmp_path):
+    path = write(str(tmp_path), 'other.mp3', 800)
+    store.scan()
+    with pytest.raises(StorageFull):
+        store.make_room(500)
+    assert os.path.exists(path)
+
+
+def test_orphaned_files_are_evicted(store, tmp_path):
+    path = write(str(tmp_path), 'orphan.mp3', 800, age=ORPHAN_AGE + 60)
+    store.scan()
+    store.make_room(500)
+    assert not os.path.exists(path)
+    assert store.get_stats()['evicted'] == 1
+
+
+def test_referenced_files_are_kept(store, tmp_path):
+    held = write(str(tmp_path), 'held.mp3', 600)
+    store.add(held)
+    with pytest.raises(StorageFull):
+        store.make_room(500)
+    store.release(held)
+    store.make_room(500)
+    assert not os.path.exists(held)
+
+
+def test_least_recently_used_is_evicted_first(store, tmp_path):
+    old = write(str(tmp_path), 'old.mp3', 400)
+    new = write(str(tmp_path), 'new.mp3', 400)
+    store.add(old, refs=0)
+    store.add(new, refs=0)
+    store.touch(old)
+    store.make_room(500)
+    assert os.path.exists(old)
+    assert not os.path.exists(new)
+
+
+def test_expire_scans_the_whole_folder(store, tmp_path):
+    store.scan()
+    stale = write(str(tmp_path), 'stale.mp3', 10, age=max(ORPHAN_AGE, Config.CLEANUP_INTERVAL) + 60)
+    fresh = write(str(tmp_path), 'fresh.mp3', 10)
+    store.expire()
+    assert not os.path.exists(stale)
+    assert os.path.exists(fresh)
+    assert store.get_stats()['expired'] == 1
+
+
+def test_expire_keeps_parts_written_by_other_workers(store, tmp_path):
+    part = write(str(tmp_path), 'abc.part', 10)
+    store.add(part, refs=0)
+    # 本进程很久没有收到分块，但其他 worker 刚写入过
+    store._entries['abc.part'][1] = time.time() - Config.UPLOAD_SESSION_TTL - 60
+    store.expire()
+    assert os.path.exists(part)
+
+
+def test_expire_removes_abandoned_parts(store, tmp_path):
+    part = write(str(tmp_path), 'abc.part', 10, age=Config.UPLOAD_SESSION_TTL + 60)
+    store.expire()
+    assert not os.path.exists(part)
+
+
+def test_scan_forgets_files_removed_by_other_workers(store, tmp_path):
+    path = write(str(tmp_path), 'gone.mp3', 100)
+    store.scan()
+    os.remove(path)
+    store.scan()
+    assert store.get_stats()['files'] == 0
+    assert store.get_stats()['used_bytes'] == 0
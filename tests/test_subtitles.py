@@ -0,0 +1,130 @@
+import json
+import pytest
+from services.subtitles import SubtitleStreamParser, SubtitleTrack
+
+
+def body(subtitles, **fields):
+    return json.dumps(dict({'success': True}, subtitlesArray=subtitles, **fields), ensure_ascii=False).encode()
+
+
+def parse(data, chunk_size):
+    track = SubtitleTrack()
+    parser = SubtitleStreamParser(track)
+    added = sum(parser.feed(data[i:i + chunk_size]) for i in range(0, len(data), chunk_size))
+    return track, parser, added
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+def test_parses_split_utf8_chunks(chunk_size):
+    data = body([{'start': 0, 'end': 1.5, 'text': '你好'}, {'start': 1.5, 'end': 3, 'text': 'world'}],
+                message='完成')
+    track, parser, added = parse(data, chunk_size)
+    assert added == 2
+    assert [track.text(i) for i in range(len(track))] == ['你好', 'world']
+    assert list(track.ends) == [1.5, 3.0]
+    assert parser.envelope() == {'success': True, 'subtitlesArray': [], 'message': '完成'}
+
+
+def test_skips_null_and_malformed_elements():
+    data = body([None, 42, 'text', {'start': 0}, {'start': 'soon', 'end': 1, 'text': '坏时间'},
+                 {'start': None, 'end': 1, 'text': '空时间'}, {'text': ['列表']},
+                 {'start': 1, 'end': 2, 'text': '有效'}])
+    track, parser, added = parse(data, 5)
+    assert added == 1
+    assert (track.starts[0], track.ends[0], track.text(0)) == (1.0, 2.0, '有效')
+    assert parser.envelope()['success'] is True
+
+
+def test_truncated_body_is_rejected():
+    data = body([{'start': 0, 'end': 1, 'text': 'a'}, {'start': 1, 'end': 2, 'text': 'b'}])
+    track, parser, added = parse(data[:-15], 4096)
+    assert added == 1
+    with pytest.raises(ValueError):
+        parser.envelope()
+
+
+def test_from_subtitles_ignores_invalid_elements():
+    track = SubtitleTrack.from_subtitles([None, {'text': 'a', 'start': 1, 'end': 2}, {'end': 3}])
+    assert len(track) == 1 and track.text(0) == 'a'
+
+
+@pytest.fixture
+def track():
+    track = SubtitleTrack()
+    track.append(0, 1.5, '第一行')
+    track.append(3661.004, 3662.25, 'second')
+    return track
+
+
+def export(track, fmt):
+    chunks, mimetype = track.export(fmt)
+    return ''.join(chunks), mimetype
+
+
+def test_srt_export(track):
+    text, mimetype = export(track, 'srt')
+    assert text == ('1\n00:00:00,000 --> 00:00:01,500\n第一行\n\n'
+                    '2\n01:01:01,004 --> 01:01:02,250\nsecond\n\n')
+    assert mimetype.startswith('application/x-subrip')
+
+
+def test_vtt_export(track):
+    text, mimetype = export(track, 'vtt')
+    assert text == ('WEBVTT\n\n00:00:00.000 --> 00:00:01.500\n第一行\n\n'
+                    '01:01:01.004 --> 01:01:02.250\nsecond\n\n')
+    assert mimetype == 'text/vtt'
+    assert export(SubtitleTrack(), 'vtt')[0] == 'WEBVTT\n\n'
+
+
+def test_json_export_round_trips(track):
+    items = json.loads(export(track, 'json')[0])
+    assert items == [{'start': 0.0, 'end': 1.5, 'text': '第一行'},
+                     {'start': 3661.004, 'end': 3662.25, 'text': 'second'}]
+    assert export(SubtitleTrack(), 'json')[0] == '[]'
+
+
+def test_export_spans_chunks(monkeypatch):
+    monkeypatch.setattr('services.subtitles.CHUNK_CUES', 2)
+    track = SubtitleTrack()
+    for i in range(5):
+        track.append(i, i + 1, f'line {i}')
+    chunks = list(track.iter_srt())
+    assert len(chunks) == 3
+    assert ''.join(chunks).count(' --> ') == 5
+
+
+@pytest.fixture
+def finished_elsewhere():
+    """在其他 worker 上完成的任务：本进程只能从共享状态读到结果"""
+    import app as app_module
+    from services.state import state_backend
+
+    def make(job_id, sha256):
+        state_backend.put_json(f'job:{job_id}', {'id': job_id, 'status': 'done', 'result': {'sha256': sha256}})
+        return app_module.app.test_client()
+    return make
+
+
+def test_job_subtitles_read_cache_written_by_another_worker(finished_elsewhere, track):
+    from config import Config
+    from services.cache import TranscriptCache
+    import app as app_module
+    client = finished_elsewhere('job-other-cache', 'sha-other-worker')
+    assert not app_module.transcript_cache.contains('sha-other-worker')  # 本进程的索引已加载
+    TranscriptCache(Config.CACHE_FOLDER, Config.CACHE_MAX_BYTES, Config.CACHE_TTL).put(
+        'sha-other-worker', {'duration': 2.0, 'track': track})
+
+    response = client.get('/jobs/job-other-cache/subtitles.srt')
+    assert response.status_code == 200
+    assert '第一行' in response.get_data(as_text=True)
+
+
+def test_job_subtitles_fall_back_to_history(finished_elsewhere, track):
+    from services.transcripts import transcript_store
+    client = finished_elsewhere('job-evicted', 'sha-evicted')
+    transcript_store._insert('job-evicted', 'talk.mp3', 'sha-evicted', {}, track, 0.0)
+
+    response = client.get('/jobs/job-evicted/subtitles.vtt')
+    assert response.status_code == 200
+    assert response.get_data(as_text=True).startswith('WEBVTT\n\n00:00:00.000 --> 00:00:01.500\n第一行')
+    assert client.get('/jobs/job-unknown-sha/subtitles.vtt').status_code == 404
@@ -0,0 +1,93 @@
+import os
+import types
+import pytest
+from services.subtitles import SubtitleTrack
+from services.transcripts import TranscriptStore, build_query
+
+
+def make_track(*texts):
+    track = SubtitleTrack()
+    for i, text in enumerate(texts):
+        track.append(i * 2.0, i * 2.0 + 1.5, text)
+    return track
+
+
+@pytest.fixture
+def store(tmp_path):
+    return TranscriptStore(str(tmp_path / 'transcripts.db'))
+
+
+def insert(store, filename, *texts):
+    store._insert('job-' + filename, filename, 'sha-' + filename, {'duration': 10.0}, make_track(*texts), 0.0)
+
+
+def test_build_query_splits_cjk_into_phrases():
+    assert build_query('语音识别 api') == '"语 音 识 别" "api"'
+    assert build_query('say "hi"') == '"say" """hi"""'
+    assert build_query('   ') == ''
+
+
+def test_search_matches_cjk_substrings(store):
+    insert(store, 'a.mp3', '今天我们讨论语音识别的准确率', 'hello world')
+    insert(store, 'b.mp3', '识别结果发送到飞书')
+
+    items, cursor = store.search('识别', limit=10)
+    assert [item['filename'] for item in items] == ['b.mp3', 'a.mp3']
+    assert cursor is None
+
+    items, _ = store.search('语音 准确率', limit=10)
+    assert [item['text'] for item in items] == ['今天我们讨论语音识别的准确率']
+
+    # 短语必须连续出现
+    assert store.search('语识', limit=10) == ([], None)
+    assert store.search('HELLO', limit=10)[0][0]['filename'] == 'a.mp3'
+
+
+def test_search_paginates_by_line_id(store):
+    for i in range(5):
+        insert(store, f'{i}.mp3', f'第{i}段会议记录')
+
+    first, cursor = store.search('会议', limit=3)
+    assert [item['filename'] for item in first] == ['4.mp3', '3.mp3', '2.mp3']
+    rest, cursor = store.search('会议', limit=3, cursor=cursor)
+    assert [item['filename'] for item in rest] == ['1.mp3', '0.mp3']
+    assert cursor is None
+
+
+def test_stats_counts_rows(store):
+    for i in range(3):
+        insert(store, f'{i}.mp3', '内容')
+    assert store.get_stats()['transcripts'] == 3
+
+    # 删除最新以外的记录后，计数不能再按最大 id 估算
+    store._conn().execute('DELETE FROM transcripts WHERE id = 1')
+    assert store.get_stats()['transcripts'] == 2
+
+
+def test_cached_upload_is_recorded(monkeypatch):
+    import app as app_module
+    from config import Config
+
+    result = {'duration': 3.5, 'track': make_track('缓存命中的字幕')}
+    app_module.transcript_cache.put('cached-sha', result)
+
+    recorded = []
+    monkeypatch.setattr(app_module.transcript_store, 'add', lambda *args: recorded.append(args))
+    monkeypatch.setattr(app_module.feishu_service, 'enqueue', lambda text: 1)
+    monkeypatch.setattr(app_module.transcription_service, 'transcribe_segmented',
+                        lambda *args, **kwargs: pytest.fail('缓存命中时不应再转录'))
+
+    os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
+    filepath = os.path.join(Config.UPLOAD_FOLDER, 'cached.mp3')
+    with open(filepath, 'wb') as f:
+        f.write(b'ID3' + b'\0' * 64)
+
+    job = types.SimpleNamespace(id='cached-job', filename='cached.mp3')
+    output = app_module.process_upload(job, filepath, 'cached-sha')
+
+    assert output['lines'] == 1
+    assert len(recorded) == 1
+    job_id, filename, sha256, metadata, track = recorded[0]
+    assert (job_id, filename, sha256) == ('cached-job', 'cached.mp3', 'cached-sha')
+    assert 'duration' in metadata
+    assert track.text(0) == '缓存命中的字幕'